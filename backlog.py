@@ -0,0 +1,75 @@
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Tuple
+
+from telegram import Message, Update
+
+logger = logging.getLogger(__name__)
+
+MAX_UPDATES_PER_CALL = 100  # Telegram limit for one getUpdates call
+
+
+@dataclass
+class BacklogReport:
+    """Summary of the updates that were waiting when the bot started."""
+    updates: int = 0
+    users: int = 0  # Users whose messages were coalesced
+    coalesced: int = 0  # User messages forwarded in per-user batches
+    duplicates: int = 0  # Coalesced tx hashes dropped as already submitted
+    processed: int = 0  # Other updates, run through the regular handlers
+    failed_users: int = 0
+    fetch_seconds: float = 0.0
+    started_at: float = field(default_factory=time.monotonic)
+    duration: float = 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"updates={self.updates} users={self.users} coalesced={self.coalesced} duplicates={self.duplicates} "
+            f"processed={self.processed} "
+            f"failed_users={self.failed_users} fetch={self.fetch_seconds:.2f}s duration={self.duration:.2f}s"
+        )
+
+
+async def fetch_backlog(bot, max_updates: int) -> List[Update]:
+    """Fetches and confirms up to `max_updates` pending updates.
+
+    Anything beyond `max_updates`, or arriving meanwhile, is left for the live
+    polling or webhook to pick up.
+    """
+    # getUpdates is refused while a webhook is set; run_webhook sets it again afterwards
+    await bot.delete_webhook()
+    updates: List[Update] = []
+    offset = None
+    while len(updates) < max_updates:
+        batch = await bot.get_updates(
+            offset=offset, limit=min(MAX_UPDATES_PER_CALL, max_updates - len(updates)), timeout=0,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        if not batch:
+            return updates  # The empty call already confirmed everything before `offset`
+        updates.extend(batch)
+        offset = batch[-1].update_id + 1
+    # Stopped at max_updates: confirm what was fetched without taking anything newer
+    await bot.get_updates(offset=offset, limit=1, timeout=0, allowed_updates=Update.ALL_TYPES)
+    return updates
+
+
+def split_backlog(
+    updates: List[Update], coalesce: Callable[[Update], bool]
+) -> Tuple[Dict[int, List[Message]], List[Update]]:
+    """Splits the backlog into messages to coalesce per user and updates to process one by one.
+
+    Messages of each user are sorted by message_id; the other updates keep
+    their order.
+    """
+    by_user: Dict[int, List[Message]] = {}
+    others: List[Update] = []
+    for update in updates:
+        if coalesce(update):
+            by_user.setdefault(update.effective_user.id, []).append(update.message)
+        else:
+            others.append(update)
+    for messages in by_user.values():
+        messages.sort(key=lambda message: message.message_id)
+    return by_user, others
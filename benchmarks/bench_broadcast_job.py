@@ -0,0 +1,117 @@
+"""Cost of one scheduled broadcast through BroadcastJobRunner.tick(), audience included.
+
+Usage: python benchmarks/bench_broadcast_job.py [--users 1000000] [--batch 50]
+
+Each case runs in a fresh subprocess. It builds a UserRegistry and runs one full
+tick(): taking the audience, creating the job (for SQLite this writes the
+audience to the store), then claiming, sending and checkpointing every batch.
+The cases are the memory and SQLite backends with the registry snapshot, and the
+memory backend with the old list(all_users) audience. The Bot API is left out:
+the engine only counts the ids it is given. The script reports:
+
+- the time until the first batch goes out and the total tick time;
+- the Python memory the tick allocates at its peak (tracemalloc, in a second run);
+- the longest wait of a lease renewal running alongside (every 50ms, as a leader would).
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bench_common import HERE
+from broadcast import BroadcastReport
+from broadcast_jobs import BroadcastJobRunner
+from state_store import MemoryStateStore, SQLiteStateStore
+from user_registry import UserRegistry
+
+CASES = ("memory+list", "memory", "sqlite")
+
+
+class CountingEngine:
+    """Stands in for BroadcastEngine without any Bot API calls."""
+
+    def __init__(self):
+        self.sent = 0
+        self.first_batch_at = None
+
+    async def broadcast(self, chat_ids, render, on_forbidden=None, **kwargs) -> BroadcastReport:
+        if self.first_batch_at is None:
+            self.first_batch_at = time.perf_counter()
+        self.sent += len(chat_ids)
+        return BroadcastReport(total=len(chat_ids), sent=len(chat_ids))
+
+
+async def tick_once(case: str, registry: UserRegistry, batch: int, path: str) -> dict:
+    store = SQLiteStateStore(path) if case == "sqlite" else MemoryStateStore()
+    engine = CountingEngine()
+    runner = BroadcastJobRunner(store, engine, "bench", interval=86400, batch_size=batch)
+    audience = (lambda: list(registry)) if case == "memory+list" else registry.snapshot
+    waits = []
+    done = asyncio.Event()
+
+    async def renew_lease() -> None:
+        while not done.is_set():
+            start = time.perf_counter()
+            await store.acquire_lease("scheduler", "bench", 30)
+            waits.append(time.perf_counter() - start)
+            await asyncio.sleep(0.05)
+
+    renewals = asyncio.create_task(renew_lease())
+    start = time.perf_counter()
+    await runner.tick(audience, lambda user_id: "faucet list")
+    elapsed = time.perf_counter() - start
+    done.set()
+    await renewals
+    store.close()
+    assert engine.sent == len(registry), (engine.sent, len(registry))
+    return {
+        "first_batch_ms": (engine.first_batch_at - start) * 1000,
+        "tick_s": elapsed,
+        "max_lease_wait_ms": max(waits) * 1000,
+    }
+
+
+def measure(case: str, users: int, batch: int) -> dict:
+    registry = UserRegistry()
+    registry.load_rows((10_000 + 7 * n, "en" if n % 3 else None) for n in range(users))
+    with tempfile.TemporaryDirectory() as tmp:
+        result = asyncio.run(tick_once(case, registry, batch, os.path.join(tmp, "timed.db")))
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        asyncio.run(tick_once(case, registry, batch, os.path.join(tmp, "traced.db")))
+        result["peak_mb"] = (tracemalloc.get_traced_memory()[1] - baseline) / 2**20
+        tracemalloc.stop()
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--batch", type=int, default=50, help="BROADCAST_BATCH")
+    parser.add_argument("--child", metavar="CASE", choices=CASES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(measure(args.child, args.users, args.batch)))
+        return
+
+    print(f"{args.users:,} users, batches of {args.batch}, no Bot API calls")
+    for case in CASES:
+        out = subprocess.run(
+            [sys.executable, os.path.join(HERE, "bench_broadcast_job.py"), "--child", case,
+             "--users", str(args.users), "--batch", str(args.batch)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        r = json.loads(out)
+        print(
+            f"{case:11} first batch={r['first_batch_ms']:8.1f}ms tick={r['tick_s']:6.2f}s "
+            f"peak=+{r['peak_mb']:6.1f}MB max lease wait={r['max_lease_wait_ms']:6.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Throughput of the horizontal mode (router + N workers sharing one SQLite store).
+
+Usage: python benchmarks/bench_cluster.py [--workers 1 2 4] [--users 400] [--messages 10] [--latency 20]
+
+For each worker count, starts the router and the workers as separate processes
+against the local fake Bot API (run by this script), seeds the shared store with
+users for the scheduled broadcast, and posts every user's messages to the router
+the way Telegram's webhook does (each chat in order, chats in parallel). It
+reports updates/sec until every message was answered and the speed-up against
+one worker. Scaling needs a free core per worker plus one for the router and one
+for this script: with fewer cores the workers just share the CPU.
+
+It also checks that exactly one worker holds the leader lease, that the
+broadcast ran once with nobody getting it twice, and that another worker takes
+over the lead when the leader stops. Exits with status 1 if a check fails.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench_common import HERE, OWNER_ID
+from fake_telegram import FakeBotAPI, text_update
+
+LEASE_TTL = 3.0
+with open(os.path.join(HERE, "..", "locales", "en.json"), encoding="utf-8") as f:
+    _TEXTS = json.load(f)
+REPLY_TEXT = _TEXTS["purchase_details_prompt"]
+BROADCAST_TEXT = _TEXTS["faucet_list_message"]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# --- child processes ---
+def run_worker_process(api_url: str) -> None:
+    import lim
+    from cluster import UpdateReceiver, serve_worker
+
+    app = lim.build_application(base_url=api_url)
+    receiver = UpdateReceiver(app, lim.WEBHOOK_LISTEN, lim.WEBHOOK_PORT, lim.WEBHOOK_PATH)
+    asyncio.run(serve_worker(app, receiver))
+
+
+def run_router_process(port: int, worker_urls: list) -> None:
+    from cluster import UpdateRouter, serve_router
+
+    asyncio.run(serve_router(UpdateRouter(worker_urls, "127.0.0.1", port, "webhook")))
+
+
+def spawn(args: list, env: dict) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), *args], env={**os.environ, **env})
+
+
+async def wait_for_port(port: int, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"nothing listening on port {port}")
+            await asyncio.sleep(0.1)
+
+
+async def wait_until(check, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while not check():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.1)
+    return True
+
+
+def query(db: str, sql: str) -> list:
+    conn = sqlite3.connect(db, timeout=10)
+    try:
+        return conn.execute(sql).fetchall()
+    except sqlite3.OperationalError:
+        return []  # Tables not created yet
+    finally:
+        conn.close()
+
+
+def seed_users(db: str, count: int) -> None:
+    from state_store import SQLiteStateStore
+
+    store = SQLiteStateStore(db)
+    store._write_conn.executemany("INSERT INTO users (user_id, language) VALUES (?, 'en')",
+                                  ((1000 + n,) for n in range(count)))
+    store.close()
+
+
+async def post_user_messages(client: httpx.AsyncClient, url: str, user_id: int, messages: int, ids) -> None:
+    for n in range(messages):
+        update = dict(text_update(user_id, 100 + n, "1"), update_id=next(ids))
+        response = await client.post(url, json=update)
+        response.raise_for_status()
+
+
+async def run(workers: int, users: int, messages: int, latency: float, seeded: int) -> tuple:
+    server = FakeBotAPI(default_latency=latency / 1000)
+    await server.start()
+    replies = collections.Counter()
+    broadcasts = collections.Counter()
+
+    def on_call(method: str, params: dict) -> None:
+        if method == "sendMessage":
+            text = params.get("text")
+            if text == REPLY_TEXT:
+                replies[int(params["chat_id"])] += 1
+            elif text == BROADCAST_TEXT:
+                broadcasts[int(params["chat_id"])] += 1
+
+    server.on_call = on_call
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "state.db")
+        seed_users(db, seeded)
+        ports = [free_port() for _ in range(workers)]
+        router_port = free_port()
+        base_env = {
+            "BOT_TOKEN": "123456:fake", "OWNER_ID": OWNER_ID, "BOT_MODE": "worker", "STATE_BACKEND": "sqlite",
+            "STATE_DB_PATH": db, "CLUSTER_WORKERS": str(workers), "LEADER_LEASE_TTL": str(LEASE_TTL),
+            "METRICS_PORT": "0", "INBOUND_RATE": "0", "LOG_LEVEL": "WARNING", "LOG_UPDATES": "0",
+            "WEBHOOK_LISTEN": "127.0.0.1", "WEBHOOK_PATH": "webhook",
+        }
+        procs = [
+            spawn(["--worker", server.base_url], dict(base_env, CLUSTER_WORKER_ID=str(i), WEBHOOK_PORT=str(port)))
+            for i, port in enumerate(ports)
+        ]
+        urls = [f"http://127.0.0.1:{port}/webhook" for port in ports]
+        router = spawn(["--router", str(router_port), ",".join(urls)], {"LOG_LEVEL": "WARNING"})
+        try:
+            for port in ports + [router_port]:
+                await wait_for_port(port)
+
+            update_ids = iter(range(1, 10**9))
+            semaphore = asyncio.Semaphore(200)
+
+            async def user_session(client: httpx.AsyncClient, user_id: int) -> None:
+                async with semaphore:
+                    await post_user_messages(client, f"http://127.0.0.1:{router_port}/webhook",
+                                             user_id, messages, update_ids)
+
+            expected = users * messages
+            started = time.monotonic()
+            async with httpx.AsyncClient(timeout=60, limits=httpx.Limits(max_connections=200)) as client:
+                await asyncio.gather(*(user_session(client, 100_000 + n) for n in range(users)))
+            if not await wait_until(lambda: sum(replies.values()) >= expected, 120):
+                print(f"  only {sum(replies.values())} of {expected} messages answered")
+                ok = False
+            elapsed = time.monotonic() - started
+            if any(count != messages for count in replies.values()):
+                print("  some messages were answered more than once")
+                ok = False
+
+            # The first broadcast tick comes 5s after start; wait for the job to finish
+            finished = await wait_until(
+                lambda: query(db, "SELECT COUNT(*) FROM broadcast_jobs WHERE finished_at IS NOT NULL") == [(1,)], 120
+            )
+            jobs = query(db, "SELECT COUNT(*) FROM broadcast_jobs")[0][0]
+            twice = [chat for chat, count in broadcasts.items() if count > 1]
+            missed = [n for n in range(seeded) if broadcasts[1000 + n] != 1]
+            if not finished or jobs != 1 or twice or missed:
+                print(f"  broadcast: jobs={jobs} finished={finished} sent twice={len(twice)} seeded users missed={len(missed)}")
+                ok = False
+            leases = query(db, "SELECT holder FROM leases")
+            if len(leases) != 1:
+                print(f"  expected one leader, found {leases}")
+                ok = False
+            elif workers > 1:
+                # Stop the leader: another worker must take over
+                leader_id = int(leases[0][0].rsplit(":", 1)[1])
+                procs[leader_id].send_signal(signal.SIGTERM)
+                procs[leader_id].wait(30)
+                if not await wait_until(
+                    lambda: [h for (h,) in query(db, "SELECT holder FROM leases") if not h.endswith(f":{leader_id}")],
+                    3 * LEASE_TTL,
+                ):
+                    print("  no worker took over the lead")
+                    ok = False
+        finally:
+            for proc in procs + [router]:
+                if proc.poll() is None:
+                    proc.send_signal(signal.SIGTERM)
+            for proc in procs + [router]:
+                try:
+                    proc.wait(30)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+    await server.stop()
+    return expected / elapsed, ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=400)
+    parser.add_argument("--messages", type=int, default=10, help="messages per user")
+    parser.add_argument("--latency", type=float, default=20, help="mean Bot API latency in ms")
+    parser.add_argument("--seeded", type=int, default=100, help="stored users for the broadcast check")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--router", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        run_worker_process(args.worker)
+        return
+    if args.router:
+        run_router_process(int(args.router[0]), args.router[1].split(","))
+        return
+
+    print(f"{os.cpu_count()} CPUs, {args.users} users x {args.messages} messages, {args.latency:.0f}ms API latency")
+    baseline = None
+    all_ok = True
+    for workers in args.workers:
+        throughput, ok = asyncio.run(run(workers, args.users, args.messages, args.latency, args.seeded))
+        baseline = baseline or throughput
+        all_ok &= ok
+        print(f"workers={workers}: {throughput:7.1f} updates/s  speed-up x{throughput / baseline:.2f}  "
+              f"{'OK' if ok else 'FAILED'}")
+    sys.exit(0 if all_ok else 1)
+
+
+if __name__ == "__main__":
+    main()
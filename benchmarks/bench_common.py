@@ -0,0 +1,33 @@
+"""Helpers shared by the benchmarks.
+
+Importing this module puts the repository root and this directory on sys.path,
+so the bot's modules and fake_telegram can be imported afterwards.
+"""
+import os
+import sys
+from types import ModuleType
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+OWNER_ID = "999"
+
+
+def import_bot(**env: str) -> ModuleType:
+    """Imports lim with a fake token and OWNER_ID, after setting the other environment variables in `env`.
+
+    lim reads its settings at import time, so call this before anything else imports it.
+    """
+    os.environ.update(BOT_TOKEN="123456:fake", OWNER_ID=OWNER_ID, **env)
+    import lim
+
+    return lim
+
+
+def percentile(samples, pct: float) -> float:
+    """The `pct` percentile of `samples` (0.0 when there are none)."""
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
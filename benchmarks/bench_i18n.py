@@ -0,0 +1,65 @@
+"""Micro-benchmark of get_message: nested dict lookups + str.format vs. the compiled catalog.
+
+Usage: python benchmarks/bench_i18n.py [--iterations 200000]
+"""
+import argparse
+import json
+import logging
+import os
+import timeit
+
+from bench_common import import_bot
+
+lim = import_bot()
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def load_raw_messages() -> dict:
+    raw = {}
+    for name in os.listdir(lim.I18N_DIR):
+        if name.endswith(".json"):
+            with open(os.path.join(lim.I18N_DIR, name), encoding="utf-8") as f:
+                raw[name[:-5]] = json.load(f)
+    return raw
+
+
+RAW_MESSAGES = load_raw_messages()
+
+
+def legacy_get_message(context, _user_id_for_lang_lookup: int, key: str, **kwargs) -> str:
+    """The previous implementation, kept here as the baseline."""
+    user_lang = context.bot_data.get('user_languages', {}).get(_user_id_for_lang_lookup, 'en')
+    lim.logger.debug(f"get_message: User ID {_user_id_for_lang_lookup}, Key '{key}', Using language '{user_lang}'")
+    message_template = RAW_MESSAGES.get(user_lang, RAW_MESSAGES['en']).get(
+        key, RAW_MESSAGES['en'].get(key, f"Error: Message key '{key}' not found.")
+    )
+    return message_template.format(**kwargs)
+
+
+class FakeContext:
+    bot_data = {'user_languages': {1: 'id', 2: 'en'}}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200_000)
+    args = parser.parse_args()
+    context = FakeContext()
+    cases = {
+        "static (faucet_list_message)": ("faucet_list_message", {}),
+        "template (owner_attribution)": ("owner_attribution", {"user_full_name": "Budi", "user_id": 123456789}),
+    }
+    for label, (key, kwargs) in cases.items():
+        for user_id in (1, 2):
+            assert legacy_get_message(context, user_id, key, **kwargs) == lim.get_message(context, user_id, key, **kwargs)
+        legacy = timeit.timeit(lambda: legacy_get_message(context, 1, key, **kwargs), number=args.iterations)
+        compiled = timeit.timeit(lambda: lim.get_message(context, 1, key, **kwargs), number=args.iterations)
+        print(
+            f"{label:>30}: legacy {legacy / args.iterations * 1e9:.0f}ns, compiled {compiled / args.iterations * 1e9:.0f}ns "
+            f"({legacy / compiled:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
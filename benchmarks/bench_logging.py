@@ -0,0 +1,84 @@
+"""Micro-benchmark of the logging cost paid by the caller (the event loop in the bot).
+
+Usage: python benchmarks/bench_logging.py [--iterations 20000] [--stall-ms 1]
+
+Compares a handler called directly (format and write in the calling thread, as
+logging.basicConfig did) with log_pipeline (queue the record, format and write
+on the writer thread). The "stalled" sink sleeps --stall-ms per write, like a
+busy disk. Each case waits for the writer to catch up before the next one.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from log_pipeline import TEXT_FORMAT, setup_logging  # noqa: E402
+
+
+class NullHandler(logging.Handler):
+    """Formats the record and throws it away, optionally after a simulated disk stall."""
+
+    def __init__(self, stall: float = 0.0):
+        super().__init__()
+        self.stall = stall
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.format(record)
+        if self.stall:
+            time.sleep(self.stall)
+
+
+def time_calls(iterations: int, level: int = logging.INFO, users: int = 0) -> float:
+    logger = logging.getLogger("bench")
+    users = users or iterations
+    started = time.perf_counter()
+    for n in range(iterations):
+        logger.log(level, "User %s (ID: %s) selected language: %s", "Budi", n % users, "id",
+                   extra={"user_id": n % users})
+    return (time.perf_counter() - started) / iterations
+
+
+def direct(sink: logging.Handler, iterations: int, **kwargs) -> float:
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    sink.setFormatter(logging.Formatter(TEXT_FORMAT))
+    root.addHandler(sink)
+    root.setLevel(logging.INFO)
+    try:
+        return time_calls(iterations, **kwargs)
+    finally:
+        root.removeHandler(sink)
+
+
+def queued(sink: logging.Handler, iterations: int, user_rate: float = 0, **kwargs) -> float:
+    listener = setup_logging("INFO", json_format=True, user_rate=user_rate, handler=sink)
+    try:
+        return time_calls(iterations, **kwargs)
+    finally:
+        listener.stop()  # Drains the queue before the next case
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20_000)
+    parser.add_argument("--stall-ms", type=float, default=1.0)
+    args = parser.parse_args()
+    n = args.iterations
+    stalled = n // 20  # Stalled writes are slow by design, keep that case short
+
+    print(f"enabled record:  direct {direct(NullHandler(), n) * 1e6:.1f}us, "
+          f"queued {queued(NullHandler(), n) * 1e6:.1f}us per call")
+    print(f"stalled sink:    direct {direct(NullHandler(args.stall_ms / 1000), stalled) * 1e6:.1f}us, "
+          f"queued {queued(NullHandler(args.stall_ms / 1000), stalled) * 1e6:.1f}us per call")
+    print(f"below level:     direct {direct(NullHandler(), n, level=logging.DEBUG) * 1e9:.0f}ns, "
+          f"queued {queued(NullHandler(), n, level=logging.DEBUG) * 1e9:.0f}ns per call")
+    print(f"rate limited:    {queued(NullHandler(), n, user_rate=20, users=10) * 1e6:.1f}us per call "
+          f"(10 users, 20 records per user per minute)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Micro-benchmark of the instrumentation cost on the update path.
+
+Usage: python benchmarks/bench_metrics.py [--iterations 200000]
+
+Awaits a trivial handler bare and through BotMetrics.wrap_handler, times a single
+histogram observation and one full /metrics render.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from metrics import BotMetrics  # noqa: E402
+
+
+async def handler(update, context) -> None:
+    return None
+
+
+async def time_handler(callback, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await callback(None, None)
+    return (time.perf_counter() - started) / iterations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200_000)
+    args = parser.parse_args()
+    metrics = BotMetrics()
+    wrapped = metrics.wrap_handler(handler)
+
+    bare = asyncio.run(time_handler(handler, args.iterations))
+    instrumented = asyncio.run(time_handler(wrapped, args.iterations))
+    print(f"handler call: bare {bare * 1e9:.0f}ns, instrumented {instrumented * 1e9:.0f}ns "
+          f"(+{(instrumented - bare) * 1e9:.0f}ns per update)")
+
+    child = metrics.api_seconds.labels("sendMessage")
+    observe = timeit.timeit(lambda: child.observe(0.042), number=args.iterations) / args.iterations
+    print(f"histogram observe: {observe * 1e9:.0f}ns")
+
+    for n in range(20):
+        metrics.handler_seconds.labels(f"handler_{n}").observe(0.01)
+    render = timeit.timeit(metrics.registry.render, number=1000) / 1000
+    print(f"/metrics render ({len(metrics.registry.render().splitlines())} lines): {render * 1e6:.0f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Cost of the owner inbox operations as the number of open threads grows.
+
+Usage: python benchmarks/bench_owner_inbox.py [--threads 10000 100000 1000000]
+
+For each size, fills an inbox with that many pending threads, then reports
+the time per forward recorded (existing and new thread), per answer, per
+thread lookup and per /inbox page (first, middle and last page), next to a
+plain dict of threads that sorts the pending ones for every page. The inbox
+numbers should stay flat from one size to the next.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from owner_inbox import OwnerInbox  # noqa: E402
+
+PAGE_SIZE = 20
+
+
+class DictInbox:
+    """The straightforward version: a dict of threads, pending ones sorted on demand."""
+
+    def __init__(self):
+        self.threads = {}  # user_id -> [since, unanswered, message ids]
+
+    def record(self, user_id, message_id, name=""):
+        thread = self.threads.setdefault(user_id, [0.0, 0, []])
+        if not thread[1]:
+            thread[0] = time.time()
+        thread[1] += 1
+        thread[2] = (thread[2] + [message_id])[-5:]
+
+    def mark_answered(self, user_id):
+        thread = self.threads.get(user_id)
+        if thread and thread[1]:
+            thread[1] = 0
+            return True
+        return False
+
+    def thread(self, user_id):
+        return self.threads.get(user_id)
+
+    def page(self, number, size):
+        pending = sorted((t[0], user_id) for user_id, t in self.threads.items() if t[1])
+        return pending[number * size:(number + 1) * size]
+
+
+def per_op_us(op, args) -> float:
+    t0 = time.perf_counter()
+    for arg in args:
+        op(*arg)
+    return (time.perf_counter() - t0) / len(args) * 1e6
+
+
+def measure(inbox, threads: int) -> dict:
+    rnd = random.Random(threads)
+    for user_id in range(threads):
+        inbox.record(user_id, user_id)
+    existing = [(rnd.randrange(threads), threads + n) for n in range(10_000)]
+    new = [(threads + n, threads + n) for n in range(10_000)]
+    answered = [(user_id,) for user_id in rnd.sample(range(threads), 10_000)]
+    lookups = [(rnd.randrange(threads),) for _ in range(10_000)]
+    result = {
+        "record": per_op_us(inbox.record, existing),
+        "record_new": per_op_us(inbox.record, new),
+        "answer": per_op_us(inbox.mark_answered, answered),
+        "thread": per_op_us(inbox.thread, lookups),
+    }
+    last = (threads - 1) // PAGE_SIZE
+    pages = [(0, PAGE_SIZE), (last // 2, PAGE_SIZE), (last, PAGE_SIZE)]
+    repeat = 100 if isinstance(inbox, OwnerInbox) else 1
+    result["page"] = per_op_us(inbox.page, pages * repeat)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+    for threads in args.threads:
+        print(f"--- {threads:,} pending threads ---")
+        for name, inbox in (("dict+sort", DictInbox()), ("inbox", OwnerInbox())):
+            r = measure(inbox, threads)
+            print(f"{name:9} record={r['record']:6.2f}us new={r['record_new']:6.2f}us answer={r['answer']:6.2f}us "
+                  f"thread={r['thread']:6.2f}us page={r['page']:10.1f}us")
+
+
+if __name__ == "__main__":
+    main()
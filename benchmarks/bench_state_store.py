@@ -0,0 +1,89 @@
+"""Handler latency and restart time of the SQLite state store.
+
+Usage: python benchmarks/bench_state_store.py [--users 1000000] [--forwards 10000000]
+
+The database is pre-populated directly, then the script measures the cost of the
+operations the handlers perform (all_users.add + user_map store + owner-reply
+lookup), the group commit, and a cold restart (open + load users + first lookup).
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from bench_common import percentile
+from state_store import PersistentUserMap, PersistentUserRegistry, SQLiteStateStore
+
+
+def populate(path: str, users: int, forwards: int, batch: int = 500_000) -> None:
+    store = SQLiteStateStore(path)
+    conn = store._write_conn
+    now = time.time()
+    conn.execute("BEGIN")
+    for start in range(0, users, batch):
+        conn.executemany(
+            "INSERT INTO users (user_id, language) VALUES (?, ?)",
+            ((uid, "en" if uid % 2 else "id") for uid in range(start + 1, min(start + batch, users) + 1)),
+        )
+    for start in range(0, forwards, batch):
+        conn.executemany(
+            "INSERT INTO user_map (message_id, user_id, forwarded_at) VALUES (?, ?, ?)",
+            ((mid, mid % users + 1, now) for mid in range(start + 1, min(start + batch, forwards) + 1)),
+        )
+    conn.execute("COMMIT")
+    store.close()
+
+
+async def run(users: int, forwards: int, updates: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "state.db")
+        t0 = time.perf_counter()
+        populate(path, users, forwards)
+        print(f"populated {users} users / {forwards} user_map rows in {time.perf_counter() - t0:.1f}s")
+
+        # Cold restart: open, load users and languages, first lazy user_map lookup
+        t0 = time.perf_counter()
+        store = SQLiteStateStore(path)
+        all_users = PersistentUserRegistry(store)
+        all_users.load_rows(store.iter_users())
+        user_map = PersistentUserMap(store)
+        user_map.get(random.randint(1, forwards))
+        print(f"restart: {time.perf_counter() - t0:.2f}s ({len(all_users)} users loaded, user_map lazy)")
+
+        # Handler path: register user, store a forward, look up an old forward
+        add_lat, lookup_lat = [], []
+        next_message_id = forwards + 1
+        for i in range(updates):
+            t0 = time.perf_counter_ns()
+            all_users.add(random.randint(1, users * 2))
+            user_map[next_message_id + i] = random.randint(1, users)
+            add_lat.append(time.perf_counter_ns() - t0)
+            t0 = time.perf_counter_ns()
+            user_map.get(random.randint(1, forwards))
+            lookup_lat.append(time.perf_counter_ns() - t0)
+        for name, lat in (("handler writes", add_lat), ("user_map lookup (cold)", lookup_lat)):
+            print(
+                f"{name}: p50={percentile(lat, 50) / 1000:.1f}us p99={percentile(lat, 99) / 1000:.1f}us "
+                f"mean={statistics.mean(lat) / 1000:.1f}us"
+            )
+
+        t0 = time.perf_counter()
+        written = await store.flush()
+        print(f"group commit: {written} rows in {(time.perf_counter() - t0) * 1000:.1f}ms")
+        store.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--forwards", type=int, default=10_000_000)
+    parser.add_argument("--updates", type=int, default=20_000)
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.forwards, args.updates))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Per-update latency with sequential processing vs. per-chat concurrent processing.
+
+Usage: python benchmarks/bench_update_concurrency.py [--users 30] [--messages 3] [--rate 50]
+
+Runs the real handlers from lim.py against the local fake Bot API with a slow
+forwardMessage, and measures the time from an update being queued to the bot's
+reply reaching the user. It also checks that each chat's messages were forwarded
+to the owner in the order they were sent.
+"""
+import argparse
+import asyncio
+import collections
+import logging
+import time
+
+from bench_common import OWNER_ID, import_bot, percentile
+
+lim = import_bot(STATE_BACKEND="memory")
+from fake_telegram import FakeBotAPI, text_update  # noqa: E402
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+async def run_once(concurrency: int, users: int, messages: int, rate: float, forward_latency: float) -> dict:
+    server = FakeBotAPI(latency={"forwardMessage": forward_latency}, default_latency=0.02)
+    await server.start()
+
+    queued = collections.defaultdict(collections.deque)  # chat id -> queue times
+    latencies = []
+    forwarded = collections.defaultdict(list)  # chat id -> forwarded message ids in arrival order
+
+    def on_call(method: str, params: dict) -> None:
+        chat_id = str(params.get("chat_id"))
+        if method == "forwardMessage":
+            forwarded[int(params["from_chat_id"])].append(int(params["message_id"]))
+        elif method == "sendMessage" and chat_id != OWNER_ID and queued[int(chat_id)]:
+            latencies.append(time.monotonic() - queued[int(chat_id)].popleft())
+
+    server.on_call = on_call
+
+    lim.UPDATE_CONCURRENCY = concurrency
+    app = lim.build_application(base_url=server.base_url)
+    for job in app.job_queue.jobs():
+        job.schedule_removal()  # No broadcasts during the measurement
+
+    total = users * messages
+    async with app:
+        await app.start()
+        await app.updater.start_polling(poll_interval=0, timeout=1)
+        started = time.monotonic()
+        for i in range(total):
+            user_id = 10_000 + i % users
+            text = f"tx hash : 0x{i:06x}" if i % 2 == 0 else f"question {i}"
+            queued[user_id].append(time.monotonic())
+            server.push_update(text_update(user_id, message_id=i + 1, text=text))
+            await asyncio.sleep(1 / rate)
+        while len(latencies) < total:
+            await asyncio.sleep(0.01)
+        elapsed = time.monotonic() - started
+        await app.updater.stop()
+        await app.stop()
+    await server.stop()
+
+    reordered = sum(1 for ids in forwarded.values() if ids != sorted(ids))
+    return {
+        "p50": percentile(latencies, 50) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "throughput": total / elapsed,
+        "reordered_chats": reordered,
+    }
+
+
+async def main_async(args) -> None:
+    for label, concurrency in (("sequential", 1), (f"per-chat x{args.concurrency}", args.concurrency)):
+        result = await run_once(concurrency, args.users, args.messages, args.rate, args.forward_latency)
+        print(
+            f"{label:>16}: p50={result['p50']:.0f}ms p99={result['p99']:.0f}ms "
+            f"throughput={result['throughput']:.1f} updates/s reordered chats={result['reordered_chats']}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=30)
+    parser.add_argument("--messages", type=int, default=3, help="messages per user")
+    parser.add_argument("--rate", type=float, default=50, help="updates queued per second")
+    parser.add_argument("--forward-latency", type=float, default=0.15, help="seconds per forwardMessage")
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
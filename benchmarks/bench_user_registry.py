@@ -0,0 +1,123 @@
+"""Memory and speed of the user registry against the previous set + dict.
+
+Usage: python benchmarks/bench_user_registry.py [--users 1000000 10000000]
+
+For each size, every structure is built in a fresh subprocess from the same
+random Telegram-like ids (60% "en", 30% "id", 10% no language) and the script
+reports the memory it allocates (tracemalloc), build time, membership,
+language and insert latency, the cost of taking a broadcast audience
+(list(all_users) before, snapshot() now) and, for the registry, the snapshot
+file save/load time. bench_broadcast_job.py times the whole broadcast, audience
+included.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from user_registry import UserRegistry  # noqa: E402
+
+
+def user_rows(users: int):
+    rnd = random.Random(users)
+    ids = sorted(set(rnd.randrange(1, 8_000_000_000) for _ in range(users)))
+    languages = ["en"] * 6 + ["id"] * 3 + [None]
+    return ids, [languages[user_id % 10] for user_id in ids]
+
+
+def per_op_ns(op, keys) -> float:
+    t0 = time.perf_counter_ns()
+    for key in keys:
+        op(key)
+    return (time.perf_counter_ns() - t0) / len(keys)
+
+
+def build(kind: str, ids, languages):
+    if kind == "set+dict":
+        all_users = set(ids)
+        return all_users, {user_id: language for user_id, language in zip(ids, languages) if language is not None}
+    all_users = UserRegistry()
+    all_users.load_rows(zip(ids, languages))
+    return all_users, all_users.languages
+
+
+def audience(kind: str, all_users):
+    # The old code copied the set into a list for every broadcast
+    return list(all_users) if kind == "set+dict" else all_users.snapshot()
+
+
+def measure(kind: str, users: int) -> dict:
+    ids, languages = user_rows(users)
+    probes = random.Random(0).sample(ids, min(len(ids), 100_000))
+    new_ids = [random.Random(1).randrange(1, 8_000_000_000) for _ in range(100_000)]
+
+    # Memory (Python allocations, so freed temporaries do not hide anything)
+    tracemalloc.start()
+    all_users, user_languages = build(kind, ids, languages)
+    built = tracemalloc.get_traced_memory()[0]
+    frozen = audience(kind, all_users)
+    result = {"memory_mb": built / 2**20, "audience_mb": (tracemalloc.get_traced_memory()[0] - built) / 2**20}
+    tracemalloc.stop()
+    del all_users, user_languages, frozen
+
+    t0 = time.perf_counter()
+    all_users, user_languages = build(kind, ids, languages)
+    result["build_s"] = time.perf_counter() - t0
+    result["contains_ns"] = per_op_ns(all_users.__contains__, probes)
+    result["language_ns"] = per_op_ns(lambda user_id: user_languages.get(user_id, "en"), probes)
+    t0 = time.perf_counter()
+    frozen = audience(kind, all_users)
+    result["audience_ms"] = (time.perf_counter() - t0) * 1000
+    # Inserts while the broadcast holds its audience (the registry copies each touched leaf once)
+    result["add_ns"] = per_op_ns(all_users.add, new_ids)
+    del frozen
+
+    if kind == "registry":
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "users.snapshot")
+            t0 = time.perf_counter()
+            all_users.save(path)
+            result["save_ms"] = (time.perf_counter() - t0) * 1000
+            t0 = time.perf_counter()
+            loaded = UserRegistry()
+            loaded.load(path)
+            result["load_ms"] = (time.perf_counter() - t0) * 1000
+            assert len(loaded) == len(all_users)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--child", nargs=2, metavar=("KIND", "USERS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(measure(args.child[0], int(args.child[1]))))
+        return
+
+    for users in args.users:
+        print(f"--- {users:,} users ---")
+        for kind in ("set+dict", "registry"):
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", kind, str(users)], check=True, capture_output=True, text=True
+            ).stdout
+            r = json.loads(out)
+            line = (
+                f"{kind:9} memory={r['memory_mb']:7.1f}MB build={r['build_s']:5.2f}s "
+                f"contains={r['contains_ns']:5.0f}ns language={r['language_ns']:5.0f}ns add={r['add_ns']:5.0f}ns "
+                f"audience={r['audience_ms']:6.1f}ms/+{r['audience_mb']:.1f}MB"
+            )
+            if "save_ms" in r:
+                line += f" save={r['save_ms']:.0f}ms load={r['load_ms']:.1f}ms"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""A local stand-in for the Telegram Bot API, used by the benchmarks.
+
+Point the bot at it with `Application.builder().base_url(server.base_url)`.
+Updates are injected with `push_update()` and handed out by getUpdates; every
+other method is answered with a plausible result after a configurable delay.
+Failures can be injected per call: generic errors, 429 with retry_after
+(RetryAfter in PTB) and 403 (Forbidden), either at random or for chosen chats.
+"""
+import asyncio
+import collections
+import itertools
+import json
+import random
+import time
+from typing import Callable, Dict, List, Optional, Set
+from urllib.parse import parse_qsl
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+
+def user_dict(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "en"}
+
+
+def text_update(user_id: int, message_id: int, text: str, reply_to_message_id: Optional[int] = None) -> dict:
+    """Builds a private-chat text message update (update_id is filled in by push_update)."""
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": user_dict(user_id),
+        "text": text,
+    }
+    if reply_to_message_id is not None:
+        message["reply_to_message"] = {
+            "message_id": reply_to_message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": BOT_USER,
+            "text": "forwarded",
+        }
+    return {"message": message}
+
+
+def command_update(user_id: int, message_id: int, command: str) -> dict:
+    """Builds a "/command" message update."""
+    update = text_update(user_id, message_id, command)
+    update["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command.split()[0])}]
+    return update
+
+
+def callback_update(user_id: int, message_id: int, data: str) -> dict:
+    """Builds an inline button press on a message the bot sent to the user."""
+    return {
+        "callback_query": {
+            "id": f"cb-{user_id}-{message_id}",
+            "from": user_dict(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "choose",
+            },
+        }
+    }
+
+
+def photo_update(user_id: int, message_id: int, media_group_id: Optional[str] = None) -> dict:
+    """Builds a private-chat photo update, optionally as part of an album."""
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": user_dict(user_id),
+        "photo": [{"file_id": f"photo-{user_id}-{message_id}", "file_unique_id": f"u{message_id}",
+                   "width": 90, "height": 90}],
+    }
+    if media_group_id is not None:
+        message["media_group_id"] = media_group_id
+    return {"message": message}
+
+
+class FakeBotAPI:
+    """Minimal HTTP/1.1 Bot API server built on asyncio streams (no extra dependencies)."""
+
+    def __init__(self, token: str = "123456:fake", host: str = "127.0.0.1", port: int = 0,
+                 latency: Optional[Dict[str, float]] = None, default_latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, retry_after_rate: float = 0.0, retry_after: int = 1,
+                 forbidden_rate: float = 0.0, forbidden_chats: Optional[Set[int]] = None,
+                 reliable_chats: Optional[Set[int]] = None, seed: Optional[int] = None):
+        self.token = token
+        self.host = host
+        self.port = port
+        self.latency = latency or {}  # method name -> seconds
+        self.default_latency = default_latency
+        self.jitter = jitter  # up to this fraction of the latency is added or removed at random
+        self.error_rate = error_rate  # share of calls failing with a 500
+        self.retry_after_rate = retry_after_rate  # share of calls failing with 429 + retry_after
+        self.retry_after = retry_after
+        self.forbidden_rate = forbidden_rate  # share of sends to a user failing with 403
+        self.forbidden_chats = forbidden_chats or set()  # chats that always answer 403 (blocked the bot)
+        self.reliable_chats = reliable_chats or set()  # chats never hit by random 403s (e.g. the owner)
+        self.calls: List[tuple] = []  # (monotonic time, method, params)
+        self.sent_messages: Dict[int, List[int]] = collections.defaultdict(list)  # chat id -> message ids sent there
+        self.errors = collections.Counter()  # error code -> count
+        self._random = random.Random(seed)
+        self.on_call: Optional[Callable[[str, dict], None]] = None
+        self._updates: List[dict] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1_000_000)
+        self._new_update = asyncio.Event()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def push_update(self, update: dict) -> int:
+        """Queues an update for getUpdates and returns its update_id."""
+        update = dict(update, update_id=next(self._update_ids))
+        self._updates.append(update)
+        self._new_update.set()
+        return update["update_id"]
+
+    def count(self, method: str) -> int:
+        return sum(1 for _, m, _ in self.calls if m == method)
+
+    # --- HTTP plumbing ---
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode().strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                params = self._parse_body(body, headers.get("content-type", ""))
+                method = path.rsplit("/", 1)[-1]
+                payload = await self._dispatch(method, params)
+                data = json.dumps(payload).encode()
+                status = payload.get("error_code", 200)
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n".encode()
+                    + b"Content-Type: application/json\r\n"
+                    + f"Content-Length: {len(data)}\r\n\r\n".encode()
+                    + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _parse_body(body: bytes, content_type: str) -> dict:
+        if not body:
+            return {}
+        if content_type.startswith("application/json"):
+            return json.loads(body)
+        params = {}
+        for key, value in parse_qsl(body.decode(), keep_blank_values=True):
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+    # --- Bot API methods ---
+    async def _dispatch(self, method: str, params: dict) -> dict:
+        self.calls.append((time.monotonic(), method, params))
+        if self.on_call is not None:
+            self.on_call(method, params)
+        if method == "getUpdates":
+            return {"ok": True, "result": await self._get_updates(params)}
+        delay = self.latency.get(method, self.default_latency)
+        if delay and self.jitter:
+            delay *= 1 + self._random.uniform(-self.jitter, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        error = self._injected_error(method, params)
+        if error is not None:
+            self.errors[error["error_code"]] += 1
+            return error
+        return {"ok": True, "result": self._result(method, params)}
+
+    def _injected_error(self, method: str, params: dict) -> Optional[dict]:
+        if method in ("getMe", "deleteWebhook", "setWebhook"):
+            return None
+        chat_id = params.get("chat_id")
+        if chat_id is not None and method.startswith("send"):
+            chat_id = int(chat_id)
+            if chat_id in self.forbidden_chats or (
+                chat_id not in self.reliable_chats and self._random.random() < self.forbidden_rate
+            ):
+                return {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+        if self._random.random() < self.retry_after_rate:
+            return {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+        if self._random.random() < self.error_rate:
+            return {"ok": False, "error_code": 500, "description": "Internal Server Error"}
+        return None
+
+    async def _get_updates(self, params: dict) -> List[dict]:
+        offset = int(params.get("offset") or 0)
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[: int(params.get("limit") or 100)]
+
+    def _message(self, chat_id, **fields) -> dict:
+        message_id = next(self._message_ids)
+        self.sent_messages[int(chat_id)].append(message_id)
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "from": BOT_USER,
+        }
+        message.update(fields)
+        return message
+
+    def _result(self, method: str, params: dict):
+        if method == "getMe":
+            return BOT_USER
+        if method == "sendMessage":
+            return self._message(params["chat_id"], text=params.get("text", ""))
+        if method == "forwardMessage":
+            return self._message(params["chat_id"], text="forwarded")
+        if method == "sendPhoto":
+            return self._message(params["chat_id"], photo=[], caption=params.get("caption"))
+        if method == "forwardMessages":
+            return [{"message_id": self._message(params["chat_id"])["message_id"]} for _ in params.get("message_ids", [])]
+        if method == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if method == "sendMediaGroup":
+            return [self._message(params["chat_id"], photo=[]) for _ in params.get("media", [])]
+        return True
@@ -0,0 +1,289 @@
+"""Load test of the real bot against the local fake Bot API.
+
+Usage: python benchmarks/load_test.py [--rate 200] [--duration 10] [--users 500] [options]
+
+Replays a synthetic mix of updates (tx-hash texts, digits, free text, photos,
+albums, /start and language buttons, owner replies) at a target rate, then runs
+one scheduled faucet-list broadcast to every user seen. Reports updates/sec,
+per-handler latency percentiles, Bot API calls per update, injected errors,
+broadcast throughput and memory growth.
+
+Thresholds (--max-p99-ms, --min-throughput, --max-calls-per-update,
+--max-memory-growth-mb) turn it into a regression gate: the exit status is 1
+when any of them is exceeded.
+
+The fake server runs in the same process and event loop as the bot, so its CPU
+time is included: compare results between runs on the same machine rather than
+with production numbers.
+"""
+import argparse
+import asyncio
+import collections
+import functools
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import time
+
+from bench_common import OWNER_ID, import_bot, percentile
+
+os.environ.setdefault("STATE_BACKEND", "memory")
+lim = import_bot()
+from telegram.ext import ApplicationHandlerStop  # noqa: E402
+from fake_telegram import FakeBotAPI, callback_update, command_update, photo_update, text_update  # noqa: E402
+
+logging.getLogger().setLevel(logging.WARNING)
+logging.getLogger("telegram").setLevel(logging.CRITICAL)  # Injected errors are counted, not logged
+
+# Relative weights of the synthetic update kinds
+DEFAULT_MIX = {
+    "tx_hash": 30,
+    "digit": 15,
+    "free_text": 15,
+    "photo": 15,
+    "album": 5,
+    "start": 10,
+    "language": 5,
+    "owner_reply": 5,
+}
+
+
+def rss_mb() -> float:
+    """Current resident memory in MB (peak RSS where /proc is not available)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class HandlerStats:
+    """Wraps handler callbacks to record their latency and failures."""
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)  # handler name -> seconds
+        self.errors = collections.Counter()  # (handler name, exception type) -> count
+        self.completed = 0
+
+    def wrap(self, callback, final: bool = True):
+        """`final` is False for handlers that pass admitted updates on to a later group."""
+        name = callback.__name__
+
+        @functools.wraps(callback)
+        async def timed(update, context):
+            started = time.perf_counter()
+            done = final
+            try:
+                return await callback(update, context)
+            except ApplicationHandlerStop:
+                done = True  # Dropped here, no later handler runs
+                raise
+            except Exception as e:
+                self.errors[(name, type(e).__name__)] += 1
+                raise
+            finally:
+                self.latencies[name].append(time.perf_counter() - started)
+                if done:
+                    self.completed += 1
+
+        return timed
+
+
+class UpdateGenerator:
+    """Produces the synthetic update stream."""
+
+    def __init__(self, server: FakeBotAPI, users: int, mix: dict, seed: int):
+        self.server = server
+        self.users = [100_000 + n for n in range(users)]
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.rng = random.Random(seed)
+        self.message_ids = collections.defaultdict(lambda: 1)
+        self.albums = 0
+
+    def _next_id(self, chat_id: int) -> int:
+        message_id = self.message_ids[chat_id]
+        self.message_ids[chat_id] += 1
+        return message_id
+
+    def push(self) -> int:
+        """Pushes one update (or one album) and returns the number of updates pushed."""
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        user_id = self.rng.choice(self.users)
+        push = self.server.push_update
+        if kind == "tx_hash":
+            push(text_update(user_id, self._next_id(user_id), f"tx hash : 0x{self.rng.getrandbits(128):032x}"))
+        elif kind == "digit":
+            push(text_update(user_id, self._next_id(user_id), str(self.rng.randint(1, 6))))
+        elif kind == "free_text":
+            push(text_update(user_id, self._next_id(user_id), f"hello, is faucet {self.rng.randint(1, 6)} available?"))
+        elif kind == "photo":
+            push(photo_update(user_id, self._next_id(user_id)))
+        elif kind == "album":
+            self.albums += 1
+            size = self.rng.randint(2, 5)
+            for _ in range(size):
+                push(photo_update(user_id, self._next_id(user_id), media_group_id=f"album-{self.albums}"))
+            return size
+        elif kind == "start":
+            push(command_update(user_id, self._next_id(user_id), "/start"))
+        elif kind == "language":
+            push(callback_update(user_id, self._next_id(user_id), self.rng.choice(("lang_en", "lang_id"))))
+        elif kind == "owner_reply":
+            owner_messages = self.server.sent_messages.get(int(OWNER_ID))
+            if not owner_messages:
+                return self.push()
+            owner_id = int(OWNER_ID)
+            push(text_update(owner_id, self._next_id(owner_id), "Confirmed, thank you!",
+                             reply_to_message_id=self.rng.choice(owner_messages[-200:])))
+        return 1
+
+
+async def run(args) -> dict:
+    blocked = set(random.Random(args.seed).sample(range(100_000, 100_000 + args.users), int(args.users * args.blocked)))
+    server = FakeBotAPI(
+        default_latency=args.latency / 1000, jitter=0.5, error_rate=args.error_rate,
+        retry_after_rate=args.retry_after_rate, forbidden_chats=blocked, reliable_chats={int(OWNER_ID)},
+        seed=args.seed,
+    )
+    await server.start()
+
+    app = lim.build_application(base_url=server.base_url)
+    for job in app.job_queue.jobs():
+        job.schedule_removal()  # The broadcast is run explicitly below
+    stats = HandlerStats()
+    for group, handlers in app.handlers.items():
+        for handler in handlers:
+            handler.callback = stats.wrap(handler.callback, final=group >= 0)
+
+    generator = UpdateGenerator(server, args.users, DEFAULT_MIX, args.seed)
+    memory_before = rss_mb()
+    pushed = 0
+    async with app:
+        await app.start()
+        await app.updater.start_polling(poll_interval=0, timeout=1)
+
+        # Replay the update stream at the target rate
+        started = time.monotonic()
+        while time.monotonic() - started < args.duration:
+            target = int((time.monotonic() - started) * args.rate)
+            while pushed < target:
+                pushed += generator.push()
+            await asyncio.sleep(0.005)
+
+        # Wait for the backlog to drain
+        deadline = time.monotonic() + args.drain_timeout
+        while stats.completed < pushed and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        elapsed = time.monotonic() - started
+        update_calls = len([c for c in server.calls if c[1] not in ("getUpdates", "getMe", "deleteWebhook")])
+
+        # One scheduled broadcast to everyone seen so far
+        await lim.send_scheduled_faucet_list(_JobContext(app))
+        report = app.bot_data['last_broadcast_report']
+
+        await app.updater.stop()
+        await app.stop()
+    await server.stop()
+    memory_after = rss_mb()
+
+    return {
+        "updates_pushed": pushed,
+        "updates_processed": stats.completed,
+        "updates_per_sec": stats.completed / elapsed,
+        "api_calls_per_update": update_calls / max(stats.completed, 1),
+        "handlers": {
+            name: {
+                "count": len(samples),
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p95_ms": percentile(samples, 95) * 1000,
+                "p99_ms": percentile(samples, 99) * 1000,
+            }
+            for name, samples in sorted(stats.latencies.items())
+        },
+        "handler_errors": {f"{name}:{error}": count for (name, error), count in stats.errors.items()},
+        "injected_errors": dict(server.errors),
+        "broadcast": {
+            "sent": report.sent, "failed": report.failed, "pruned": report.pruned,
+            "retried": report.retried, "msgs_per_sec": report.msgs_per_sec,
+        },
+        "memory_growth_mb": memory_after - memory_before,
+    }
+
+
+class _JobContext:
+    """Just enough of a CallbackContext to call a job callback directly."""
+
+    def __init__(self, app):
+        self.application = app
+        self.bot = app.bot
+        self.bot_data = app.bot_data
+
+
+def check_gates(result: dict, args) -> list:
+    failures = []
+    worst_p99 = max((h["p99_ms"] for h in result["handlers"].values()), default=0.0)
+    if args.max_p99_ms is not None and worst_p99 > args.max_p99_ms:
+        failures.append(f"handler p99 {worst_p99:.0f}ms > {args.max_p99_ms}ms")
+    if args.min_throughput is not None and result["updates_per_sec"] < args.min_throughput:
+        failures.append(f"throughput {result['updates_per_sec']:.1f}/s < {args.min_throughput}/s")
+    if args.max_calls_per_update is not None and result["api_calls_per_update"] > args.max_calls_per_update:
+        failures.append(f"API calls per update {result['api_calls_per_update']:.2f} > {args.max_calls_per_update}")
+    if args.max_memory_growth_mb is not None and result["memory_growth_mb"] > args.max_memory_growth_mb:
+        failures.append(f"memory growth {result['memory_growth_mb']:.1f}MB > {args.max_memory_growth_mb}MB")
+    if result["updates_processed"] < result["updates_pushed"]:
+        failures.append(f"only {result['updates_processed']} of {result['updates_pushed']} updates processed")
+    return failures
+
+
+def print_report(result: dict) -> None:
+    print(f"updates: {result['updates_processed']}/{result['updates_pushed']} processed, "
+          f"{result['updates_per_sec']:.1f}/s, {result['api_calls_per_update']:.2f} API calls per update")
+    for name, h in result["handlers"].items():
+        print(f"  {name:>32}: n={h['count']:<6} p50={h['p50_ms']:.1f}ms p95={h['p95_ms']:.1f}ms p99={h['p99_ms']:.1f}ms")
+    if result["handler_errors"]:
+        print(f"handler errors: {result['handler_errors']}")
+    print(f"injected API errors: {result['injected_errors']}")
+    b = result["broadcast"]
+    print(f"broadcast: sent={b['sent']} failed={b['failed']} pruned={b['pruned']} retried={b['retried']} "
+          f"{b['msgs_per_sec']:.1f} msg/s")
+    print(f"memory growth: {result['memory_growth_mb']:.1f}MB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=200, help="updates per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of traffic")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=20, help="mean Bot API latency in ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls failing with 500")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="share of calls failing with 429")
+    parser.add_argument("--blocked", type=float, default=0.02, help="share of users who blocked the bot (403)")
+    parser.add_argument("--drain-timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    parser.add_argument("--max-p99-ms", type=float)
+    parser.add_argument("--min-throughput", type=float)
+    parser.add_argument("--max-calls-per-update", type=float)
+    parser.add_argument("--max-memory-growth-mb", type=float)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+    failures = check_gates(result, args)
+    for failure in failures:
+        print(f"GATE FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Simulates albums whose parts arrive out of order and interleaved with other chats.
+
+Usage: python benchmarks/sim_albums.py [--users 20] [--album-size 5] [--mode forward]
+
+Drives the real handlers from lim.py against the local fake Bot API, then checks
+that every album produced one owner delivery containing all of its photos in
+order, one acknowledgement to the user, and a user_map entry for every message
+the owner received. Each user also sends a text right after their album, which
+must reach the owner after the album. Exits with status 1 if any check fails.
+"""
+import argparse
+import asyncio
+import collections
+import logging
+import random
+import sys
+
+from bench_common import OWNER_ID, import_bot
+
+lim = import_bot(STATE_BACKEND="memory")
+from fake_telegram import FakeBotAPI, photo_update, text_update  # noqa: E402
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+async def simulate(users: int, album_size: int, mode: str, seed: int) -> bool:
+    rng = random.Random(seed)
+    server = FakeBotAPI(default_latency=0.01)
+    await server.start()
+    lim.OWNER_DELIVERY = mode
+    app = lim.build_application(base_url=server.base_url)
+    for job in app.job_queue.jobs():
+        job.schedule_removal()
+
+    # Every user sends one album; parts are shuffled within and across albums
+    parts = []
+    for n in range(users):
+        user_id = 20_000 + n
+        parts += [photo_update(user_id, message_id=100 + i, media_group_id=f"album-{user_id}") for i in range(album_size)]
+    rng.shuffle(parts)
+    # Then a text, right after the last part of their album arrived
+    last_part = {update["message"]["chat"]["id"]: index for index, update in enumerate(parts)}
+    for user_id, index in sorted(last_part.items(), key=lambda item: item[1], reverse=True):
+        parts.insert(index + 1, text_update(user_id, 100 + album_size, f"after album {user_id}"))
+
+    async with app:
+        await app.start()
+        await app.updater.start_polling(poll_interval=0, timeout=1)
+        for part in parts:
+            server.push_update(part)
+            await asyncio.sleep(rng.uniform(0, 0.02))
+        await asyncio.sleep(lim.ALBUM_WINDOW + 1)
+        await app.updater.stop()
+        await app.stop()
+    await server.stop()
+
+    user_map = app.bot_data['user_map']
+    deliveries = collections.Counter()
+    acks = collections.Counter()
+    text_before_album = set()
+    ok = True
+    for _, method, params in server.calls:
+        if method == "forwardMessages":
+            user_id = int(params["from_chat_id"])
+            deliveries[user_id] += 1
+            if params["message_ids"] != list(range(100, 100 + album_size)):
+                print(f"user {user_id}: album forwarded out of order {params['message_ids']}")
+                ok = False
+        elif method == "sendMediaGroup":
+            deliveries[int(params["media"][0]["caption"].rsplit("ID: ", 1)[1].rstrip(")"))] += 1
+        elif method == "sendMessage" and str(params["chat_id"]) != OWNER_ID:
+            acks[int(params["chat_id"])] += 1
+        if method == "forwardMessage" or (method == "sendMessage" and str(params["chat_id"]) == OWNER_ID):
+            senders = [int(params["from_chat_id"])] if method == "forwardMessage" else [
+                20_000 + n for n in range(users) if f"after album {20_000 + n}" in params["text"]
+            ]
+            text_before_album.update(user_id for user_id in senders if not deliveries[user_id])
+
+    for n in range(users):
+        user_id = 20_000 + n
+        # One acknowledgement for the album, one for the text
+        if deliveries[user_id] != 1 or acks[user_id] != 2:
+            print(f"user {user_id}: {deliveries[user_id]} owner deliveries, {acks[user_id]} acknowledgements")
+            ok = False
+    if text_before_album:
+        print(f"{len(text_before_album)} users: the text reached the owner before the album")
+        ok = False
+
+    mapped = collections.Counter(user_map.get(m) for m in range(1_000_000, 1_000_000 + 10 * users * album_size))
+    mapped.pop(None, None)
+    # The texts are mapped too, except in digest mode where they are still waiting for the digest
+    expected = album_size if mode == "digest" else album_size + 1
+    if len(mapped) != users or any(count != expected for count in mapped.values()):
+        print(f"user_map entries per user: {dict(mapped)}")
+        ok = False
+
+    api_calls = len([c for c in server.calls if c[1] not in ("getUpdates", "getMe", "deleteWebhook")])
+    print(f"{mode}: {users} albums x {album_size} photos -> {api_calls} API calls "
+          f"({api_calls / users:.1f} per album and text, was {3 * album_size + 3}) {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--album-size", type=int, default=5)
+    parser.add_argument("--mode", choices=("forward", "copy", "digest"), default=None, help="default: all modes")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    modes = [args.mode] if args.mode else ["forward", "copy", "digest"]
+    results = [asyncio.run(simulate(args.users, args.album_size, mode, args.seed)) for mode in modes]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
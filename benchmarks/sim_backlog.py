@@ -0,0 +1,100 @@
+"""Simulates a restart with a backlog of pending updates, with and without the catch-up drain.
+
+Usage: python benchmarks/sim_backlog.py [--users 50] [--messages 10] [--latency 20]
+
+Queues texts, photos and a /start per user on the local fake Bot API before the
+bot starts, then measures the time until every update is handled and the API
+calls spent: once replayed one by one by the live poller, once drained by
+lim.drain_backlog. Checks that the drain answered every user once and mapped
+every message the owner received in user_map. Exits with status 1 if a check
+fails.
+"""
+import argparse
+import asyncio
+import collections
+import logging
+import os
+import sys
+import time
+
+from bench_common import OWNER_ID, import_bot
+
+os.environ.setdefault("INBOUND_RATE", "0")  # The backlog is old traffic, do not throttle the replay
+lim = import_bot(STATE_BACKEND="memory")
+from fake_telegram import FakeBotAPI, command_update, photo_update, text_update  # noqa: E402
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def queue_backlog(server: FakeBotAPI, users: int, messages: int) -> int:
+    pushed = 0
+    for n in range(users):
+        user_id = 30_000 + n
+        for i in range(messages):
+            if i % 4 == 0:
+                server.push_update(photo_update(user_id, 100 + i))
+            else:
+                server.push_update(text_update(user_id, 100 + i, f"tx hash : 0x{user_id:x}{i:04x}" if i == 1 else f"message {i}"))
+        server.push_update(command_update(user_id, 100 + messages, "/start"))
+        pushed += messages + 1
+    return pushed
+
+
+async def simulate(users: int, messages: int, latency: float, drain: bool) -> bool:
+    server = FakeBotAPI(default_latency=latency / 1000)
+    await server.start()
+    pushed = queue_backlog(server, users, messages)
+    app = lim.build_application(base_url=server.base_url)
+    for job in app.job_queue.jobs():
+        job.schedule_removal()
+
+    started = time.monotonic()
+    async with app:
+        if drain:
+            await lim.drain_backlog(app)
+        else:
+            await app.start()
+            await app.updater.start_polling(poll_interval=0, timeout=1)
+            # Every user update ends with a reply to the user
+            while sum(1 for c in server.calls if c[1] == "sendMessage" and str(c[2]["chat_id"]) != OWNER_ID) < pushed:
+                await asyncio.sleep(0.05)
+            await app.updater.stop()
+            await app.stop()
+        elapsed = time.monotonic() - started
+    await server.stop()
+
+    ok = True
+    api_calls = len([c for c in server.calls if c[1] not in ("getUpdates", "getMe", "deleteWebhook")])
+    if drain:
+        acks = collections.Counter(
+            int(c[2]["chat_id"]) for c in server.calls if c[1] == "sendMessage" and str(c[2]["chat_id"]) != OWNER_ID
+        )
+        # One acknowledgement for the coalesced messages plus the /start reply
+        wrong = {user_id: count for user_id, count in acks.items() if count != 2}
+        if len(acks) != users or wrong:
+            print(f"users answered: {len(acks)}, wrong answer counts: {wrong}")
+            ok = False
+        owner_messages = set(server.sent_messages.get(int(OWNER_ID), []))
+        forwarded = [m for m in owner_messages if app.bot_data['user_map'].get(m) is not None]
+        if len(forwarded) != users * messages:
+            print(f"user_map holds {len(forwarded)} of {users * messages} forwarded messages")
+            ok = False
+        print(f"drain report: {app.bot_data['last_backlog_report']}")
+    label = "drain" if drain else "replay"
+    print(f"{label}: {pushed} pending updates handled in {elapsed:.2f}s with {api_calls} API calls "
+          f"{'OK' if ok else 'FAILED'}")
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=10, help="texts and photos per user")
+    parser.add_argument("--latency", type=float, default=20, help="mean Bot API latency in ms")
+    args = parser.parse_args()
+    results = [asyncio.run(simulate(args.users, args.messages, args.latency, drain)) for drain in (False, True)]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
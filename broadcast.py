@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Callable, Iterable, Optional
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows roughly 30 messages per second across all chats
+# and about 1 message per second inside a single chat.
+DEFAULT_GLOBAL_RATE = 30.0
+DEFAULT_PER_CHAT_INTERVAL = 1.0
+DEFAULT_CONCURRENCY = 25
+DEFAULT_MAX_RETRIES = 3
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Returns the RetryAfter delay in seconds (PTB may give an int or a timedelta)."""
+    delay = error.retry_after
+    if isinstance(delay, timedelta):
+        return delay.total_seconds()
+    return float(delay)
+
+
+class TokenBucket:
+    """Simple asyncio token bucket used to stay under the global send rate."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """Waits until one token is available and takes it."""
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class BroadcastReport:
+    """Summary of one broadcast run."""
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    pruned: int = 0
+    retried: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    duration: float = 0.0
+
+    @property
+    def msgs_per_sec(self) -> float:
+        return self.sent / self.duration if self.duration > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"total={self.total} sent={self.sent} failed={self.failed} pruned={self.pruned} "
+            f"retried={self.retried} duration={self.duration:.2f}s rate={self.msgs_per_sec:.1f} msg/s"
+        )
+
+
+class BroadcastEngine:
+    """Sends messages concurrently while respecting Telegram's rate limits.
+
+    A global token bucket caps the overall send rate, each chat is paced to one
+    message per `per_chat_interval` seconds and a RetryAfter response pauses every
+    worker until Telegram allows sending again.
+    """
+
+    def __init__(
+        self,
+        bot,
+        global_rate: float = DEFAULT_GLOBAL_RATE,
+        per_chat_interval: float = DEFAULT_PER_CHAT_INTERVAL,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+    ):
+        self.bot = bot
+        self.per_chat_interval = per_chat_interval
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._bucket = TokenBucket(global_rate)
+        self._last_sent = {}  # chat_id -> monotonic time of the last send
+        self._paused_until = 0.0
+
+    async def _wait_for_slot(self, chat_id: int) -> None:
+        # Honour a global RetryAfter pause first
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        # Then per-chat pacing
+        last = self._last_sent.get(chat_id)
+        if last is not None:
+            delay = last + self.per_chat_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await self._bucket.acquire()
+        self._last_sent[chat_id] = time.monotonic()
+
+    def _forget_idle_chats(self) -> None:
+        # Keep the pacing table from growing with every chat ever contacted
+        cutoff = time.monotonic() - self.per_chat_interval
+        for chat_id in [c for c, t in self._last_sent.items() if t < cutoff]:
+            del self._last_sent[chat_id]
+
+    async def send(self, chat_id: int, text: str, report: Optional[BroadcastReport] = None, **kwargs) -> bool:
+        """Sends one message through the rate limiter, retrying on RetryAfter and timeouts.
+
+        Returns True when the message was delivered. Forbidden and BadRequest are
+        re-raised so the caller can decide what to do with the user.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_slot(chat_id)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                return True
+            except RetryAfter as e:
+                wait = retry_after_seconds(e)
+                self._paused_until = max(self._paused_until, time.monotonic() + wait)
+                logger.warning("Flood control hit while sending to %s, pausing sends for %ss", chat_id, wait)
+            except BadRequest:
+                raise
+            except NetworkError as e:  # includes TimedOut
+                logger.warning("Network error while sending to %s (attempt %d): %s", chat_id, attempt + 1, e)
+                await asyncio.sleep(min(2 ** attempt, 10))
+            if report is not None and attempt < self.max_retries:
+                report.retried += 1
+        return False
+
+    async def broadcast(
+        self,
+        chat_ids: Iterable[int],
+        render: Callable[[int], str],
+        on_forbidden: Optional[Callable[[int], None]] = None,
+        on_sent: Optional[Callable[[int], None]] = None,
+        **kwargs,
+    ) -> BroadcastReport:
+        """Sends `render(chat_id)` to every chat in `chat_ids` and returns a report.
+
+        `on_forbidden` is called once per user who blocked the bot, after all
+        workers have finished, so the audience is never mutated mid-iteration.
+        `on_sent` is called with each chat the message was delivered to.
+        """
+        report = BroadcastReport()
+        blocked = []
+        iterator = iter(chat_ids)
+
+        async def worker() -> None:
+            # Workers share one iterator; next() never awaits so no two workers get the same chat
+            for chat_id in iterator:
+                report.total += 1
+                try:
+                    if await self.send(chat_id, render(chat_id), report=report, **kwargs):
+                        report.sent += 1
+                        if on_sent is not None:
+                            on_sent(chat_id)
+                    else:
+                        report.failed += 1
+                        logger.error("Gave up sending broadcast to user ID: %s", chat_id)
+                except Forbidden:
+                    blocked.append(chat_id)
+                except Exception as e:
+                    report.failed += 1
+                    logger.error("Failed to send broadcast to user ID: %s: %s", chat_id, e)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+        for chat_id in blocked:
+            if on_forbidden is not None:
+                on_forbidden(chat_id)
+            report.pruned += 1
+        self._forget_idle_chats()
+        report.duration = time.monotonic() - report.started_at
+        return report
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, Collection, Optional
+
+from broadcast import BroadcastEngine, BroadcastReport
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BroadcastJob:
+    """A broadcast with a frozen audience and a persisted cursor into it."""
+    job_id: str  # "<name>:<slot>", unique per interval
+    name: str
+    slot: int  # Index of the interval the job belongs to (unix time // interval)
+    created_at: float  # Unix time
+    total: int  # Size of the audience snapshot
+    cursor: int = 0  # Audience positions before the cursor are done (or claimed by a crashed run)
+    sent: int = 0
+    failed: int = 0
+    pruned: int = 0
+    finished_at: Optional[float] = None
+
+
+class BroadcastJobRunner:
+    """Runs one broadcast per interval as a durable, resumable job.
+
+    `tick()` is safe to call as often as wanted (every minute from the JobQueue):
+
+    * if a job of this name from the current interval is unfinished, it is
+      resumed from its cursor (one from an earlier interval is abandoned);
+    * otherwise, if no job exists for the current interval, `audience()` is
+      called for a frozen, ordered snapshot of the user ids and a new job starts;
+    * otherwise it does nothing, so restarts cannot send a broadcast twice in
+      one interval.
+
+    The audience is sent in batches. The cursor is moved past a batch *before*
+    the batch is sent, so a crash can make up to `batch_size` users miss this
+    broadcast but never sends anyone the same broadcast twice. With a `window`,
+    batches are paced so the job ends about `window` seconds after it was
+    created instead of as fast as the rate limit allows.
+
+    When several processes share the store, `leader` tells whether this process
+    may run broadcasts. It is checked before every batch, and each claim only
+    succeeds if the stored cursor is still where this run left it, so a process
+    that lost the lead stops instead of sending batches a new leader took over.
+    """
+
+    def __init__(self, store, engine: BroadcastEngine, name: str, interval: float, window: float = 0.0,
+                 batch_size: int = 50, clock: Callable[[], float] = time.time,
+                 leader: Optional[Callable[[], bool]] = None):
+        self.store = store
+        self.engine = engine
+        self.name = name
+        self.interval = interval
+        self.window = window
+        self.batch_size = batch_size
+        self._clock = clock
+        self._leader = leader
+        self._running = False
+        self.current_job: Optional[BroadcastJob] = None
+
+    def slot(self, now: float) -> int:
+        return int(now // self.interval)
+
+    def _may_run(self) -> bool:
+        return self._leader is None or self._leader()
+
+    def due(self) -> bool:
+        """True if `tick()` would start or resume a broadcast now."""
+        if self._running or not self._may_run():
+            return False
+        if self.store.load_unfinished_broadcast(self.name) is not None:
+            return True
+        return self.store.load_broadcast(f"{self.name}:{self.slot(self._clock())}") is None
+
+    async def tick(
+        self,
+        audience: Callable[[], Collection[int]],
+        render: Callable[[int], str],
+        on_forbidden: Optional[Callable[[int], None]] = None,
+        **kwargs,
+    ) -> Optional[BroadcastReport]:
+        """Starts or resumes the broadcast that is due; returns its report, or None if nothing was due."""
+        if self._running or not self._may_run():
+            return None
+        self._running = True
+        try:
+            job = self.store.load_unfinished_broadcast(self.name)
+            if job is not None and job.slot < self.slot(self._clock()):
+                # Interrupted in an earlier interval: this interval's run replaces it
+                logger.warning("Abandoning broadcast %s at %d/%d", job.job_id, job.cursor, job.total)
+                job.finished_at = self._clock()
+                await self.store.checkpoint_broadcast(job)
+                job = None
+            if job is not None:
+                logger.info("Resuming broadcast %s at %d/%d", job.job_id, job.cursor, job.total)
+            else:
+                job = await self._create(audience)
+                if job is None:
+                    return None
+            return await self._run(job, render, on_forbidden, **kwargs)
+        finally:
+            self._running = False
+            self.current_job = None
+
+    async def _create(self, audience: Callable[[], Collection[int]]) -> Optional[BroadcastJob]:
+        now = self._clock()
+        slot = self.slot(now)
+        job_id = f"{self.name}:{slot}"
+        if self.store.load_broadcast(job_id) is not None:
+            return None  # Already ran in this interval
+        user_ids = audience()  # Frozen, ordered snapshot; later joiners wait for the next interval
+        job = BroadcastJob(job_id, self.name, slot, now, len(user_ids))
+        if not await self.store.create_broadcast(job, user_ids):
+            return None  # Another process created it first
+        logger.info("Created broadcast %s for %d users", job_id, job.total)
+        return job
+
+    async def _run(self, job: BroadcastJob, render: Callable[[int], str],
+                   on_forbidden: Optional[Callable[[int], None]], **kwargs) -> BroadcastReport:
+        self.current_job = job
+        report = BroadcastReport()  # This run only (a resumed job does not count the earlier runs)
+        finished = True
+        while job.cursor < job.total:
+            await self._pace(job)
+            if not self._may_run():
+                logger.warning("No longer the leader, leaving broadcast %s at %d/%d", job.job_id, job.cursor, job.total)
+                finished = False
+                break
+            user_ids = self.store.load_audience(job.job_id, job.cursor, self.batch_size)
+            # Claim the batch first: a crash while sending skips it instead of sending it twice
+            claimed_from = job.cursor
+            job.cursor = job.cursor + len(user_ids) if user_ids else job.total
+            if not await self.store.checkpoint_broadcast(job, expected_cursor=claimed_from):
+                logger.warning("Broadcast %s was moved on by another process, stopping", job.job_id)
+                finished = False
+                break
+            if not user_ids:
+                break
+            batch = await self.engine.broadcast(user_ids, render, on_forbidden, **kwargs)
+            for name in ("total", "sent", "failed", "pruned", "retried"):
+                setattr(report, name, getattr(report, name) + getattr(batch, name))
+            job.sent += batch.sent
+            job.failed += batch.failed
+            job.pruned += batch.pruned  # Persisted with the next claim
+        report.duration = time.monotonic() - report.started_at
+        if finished:
+            job.finished_at = self._clock()
+            await self.store.checkpoint_broadcast(job, expected_cursor=job.cursor)
+            logger.info("Broadcast %s finished: sent=%d failed=%d pruned=%d of %d",
+                        job.job_id, job.sent, job.failed, job.pruned, job.total)
+        return report
+
+    async def _pace(self, job: BroadcastJob) -> None:
+        if self.window <= 0 or not job.total:
+            return
+        due = job.created_at + self.window * job.cursor / job.total
+        delay = due - self._clock()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
@@ -0,0 +1,267 @@
+import asyncio
+import json
+import logging
+import signal
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import httpx
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+
+def partition_key(data: dict) -> int:
+    """Chat id of a raw (JSON) update, the user id if it has no chat, 0 if it has neither.
+
+    Mirrors concurrency.update_chat_key, so all updates of a chat go to the same
+    worker and keep their order there.
+    """
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = value.get("from") or value.get("user")
+        if user:
+            return user["id"]
+    return 0
+
+
+def partition(key: int, workers: int) -> int:
+    """Index of the worker that owns chat (or user) `key`."""
+    return key % workers
+
+
+class LeaderLease:
+    """Leadership of one role among processes sharing a state store.
+
+    `renew()` takes or extends a lease of `ttl` seconds in the store and must be
+    called every ttl / 3 or so. The process counts as leader only until ttl / 2
+    after its last successful renewal started, while the others cannot take the
+    lease before a full ttl has passed, so a stalled leader has stopped acting
+    before anyone else starts.
+    """
+
+    def __init__(self, store, name: str, holder: str, ttl: float = 30.0, clock: Callable[[], float] = time.time):
+        self.store = store
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+        self._clock = clock
+        self._valid_until = 0.0
+
+    @property
+    def is_leader(self) -> bool:
+        return self._clock() < self._valid_until
+
+    async def renew(self) -> bool:
+        started = self._clock()
+        was_leader = self.is_leader
+        try:
+            acquired = await self.store.acquire_lease(self.name, self.holder, self.ttl)
+        except Exception as e:
+            logger.error("Could not renew the %s lease: %s", self.name, e)
+            acquired = False
+        self._valid_until = started + self.ttl / 2 if acquired else 0.0
+        if acquired and not was_leader:
+            logger.info("%s is now the leader for %s", self.holder, self.name)
+        elif was_leader and not acquired:
+            logger.warning("%s is no longer the leader for %s", self.holder, self.name)
+        return acquired
+
+    async def release(self) -> None:
+        """Hands the lease over right away instead of letting it expire."""
+        if self._valid_until:
+            self._valid_until = 0.0
+            await self.store.release_lease(self.name, self.holder)
+
+
+# --- minimal HTTP/1.1 server (keep-alive, Content-Length bodies) ---
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path = request_line.decode("latin-1").split()[:2]
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", "0")))
+    return method, path.split("?")[0], headers, body
+
+
+class _HTTPServer:
+    def __init__(self, host: str, port: int, path: str, secret: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.path = "/" + path.lstrip("/")
+        self.secret = secret
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.StreamWriter] = set()
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._connections):
+                writer.close()  # Idle keep-alive connections would otherwise outlive the server
+            await self._server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections.add(writer)
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                if method != "POST" or path != self.path:
+                    status = 404
+                elif self.secret and headers.get(SECRET_HEADER) != self.secret:
+                    status = 403
+                else:
+                    try:
+                        status = await self.handle(json.loads(body), body)
+                    except ValueError:
+                        status = 400
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\nContent-Length: 0\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def handle(self, data: dict, body: bytes) -> int:
+        raise NotImplementedError
+
+
+class UpdateReceiver(_HTTPServer):
+    """Worker side: accepts the updates the router hands over and queues them for the application."""
+
+    def __init__(self, app: Application, host: str, port: int, path: str, secret: Optional[str] = None):
+        super().__init__(host, port, path, secret)
+        self.app = app
+
+    async def start(self) -> None:
+        await super().start()
+        logger.info("Worker receiving updates on http://%s:%s%s", self.host, self.port, self.path)
+
+    async def handle(self, data: dict, body: bytes) -> int:
+        await self.app.update_queue.put(Update.de_json(data, self.app.bot))
+        return 200
+
+
+class UpdateRouter(_HTTPServer):
+    """Receives Telegram's webhook and forwards each update to the worker that owns its chat.
+
+    The update is answered only once a worker accepted it, so Telegram retries
+    it if none did. When the owning worker is down, the next one takes its
+    updates until it is back.
+    """
+
+    def __init__(self, worker_urls: List[str], host: str, port: int, path: str, secret: Optional[str] = None):
+        super().__init__(host, port, path, secret)
+        self.worker_urls = worker_urls
+        self.routed = [0] * len(worker_urls)
+        self.failovers = 0
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self) -> None:
+        self._client = httpx.AsyncClient(timeout=10.0, limits=httpx.Limits(max_connections=256))
+        await super().start()
+        logger.info("Routing updates from http://%s:%s%s to %d workers",
+                    self.host, self.port, self.path, len(self.worker_urls))
+
+    async def stop(self) -> None:
+        await super().stop()
+        if self._client is not None:
+            await self._client.aclose()
+
+    async def handle(self, data: dict, body: bytes) -> int:
+        headers = {"Content-Type": "application/json"}
+        if self.secret:
+            headers[SECRET_HEADER] = self.secret
+        owner = partition(partition_key(data), len(self.worker_urls))
+        for attempt in range(len(self.worker_urls)):
+            index = (owner + attempt) % len(self.worker_urls)
+            try:
+                response = await self._client.post(self.worker_urls[index], content=body, headers=headers)
+            except httpx.TransportError as e:
+                logger.warning("Worker %d (%s) unreachable: %s", index, self.worker_urls[index], e)
+                continue
+            if response.status_code >= 500:
+                continue
+            self.routed[index] += 1
+            self.failovers += attempt > 0
+            return response.status_code
+        logger.error("No worker accepted update %s", data.get("update_id"))
+        return 503
+
+
+def _stop_event() -> asyncio.Event:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: Ctrl+C raises KeyboardInterrupt instead
+    return stop
+
+
+async def serve_worker(app: Application, receiver: UpdateReceiver, stop: Optional[asyncio.Event] = None) -> None:
+    """Runs the application on updates from the router until `stop` is set (or SIGINT/SIGTERM).
+
+    Same lifecycle as run_polling/run_webhook, including post_init, post_stop
+    and post_shutdown, but no webhook is set: the router owns it.
+    """
+    stop = stop or _stop_event()
+    await app.initialize()
+    try:
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+        await receiver.start()
+        await stop.wait()
+        await receiver.stop()
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+    finally:
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+async def serve_router(router: UpdateRouter, bot=None, webhook_url: Optional[str] = None,
+                       stop: Optional[asyncio.Event] = None) -> None:
+    """Runs the router until `stop` is set (or SIGINT/SIGTERM), registering `webhook_url` with Telegram first."""
+    stop = stop or _stop_event()
+    await router.start()
+    try:
+        if bot is not None and webhook_url:
+            async with bot:
+                await bot.set_webhook(webhook_url, secret_token=router.secret, allowed_updates=Update.ALL_TYPES)
+            logger.info("Webhook set to %s", webhook_url)
+        await stop.wait()
+    finally:
+        await router.stop()
+        logger.info("Router stopped, updates per worker: %s, failovers: %d", router.routed, router.failovers)
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from typing import Awaitable, Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+def update_chat_key(update: object) -> Optional[Hashable]:
+    """Returns the chat an update belongs to, or None if it has no chat or user."""
+    if isinstance(update, Update):
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return update.effective_user.id
+    return None
+
+
+# Updates taken in at once, running or waiting for their chat's turn (PTB's own semaphore)
+MAX_HELD_UPDATES = 10_000
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates from different chats in parallel and updates from one chat in order.
+
+    Every chat keeps a chain of futures: an update waits for the previous update of
+    the same chat to finish before it takes one of the `max_concurrent_updates`
+    handler slots. The place in the chain is taken synchronously when
+    `do_process_update` starts, and PTB enters it in arrival order (its semaphore,
+    sized MAX_HELD_UPDATES, wakes waiters first in first out), so a user's
+    "tx hash" message and their follow-up can never be reordered. Waiting updates
+    do not hold a handler slot, so one busy chat cannot starve the others.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._limit = max_concurrent_updates
+        self._running = 0
+        self._tails: Dict[Hashable, asyncio.Future] = {}  # chat key -> future of the chat's last update
+        super().__init__(max(MAX_HELD_UPDATES, max_concurrent_updates))
+
+    @property
+    def max_concurrent_updates(self) -> int:
+        """Number of handler slots (updates running at once)."""
+        return self._limit
+
+    @property
+    def current_concurrent_updates(self) -> int:
+        """Number of updates running their handlers right now."""
+        return self._running
+
+    @property
+    def active_chats(self) -> int:
+        """Number of chats with an update running or queued."""
+        return len(self._tails)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        key = update_chat_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        previous = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        try:
+            if previous is not None:
+                try:
+                    await previous
+                except asyncio.CancelledError:
+                    coroutine.close()  # Shutting down before our turn came
+                    raise
+            await self._run(coroutine)
+        finally:
+            done.set_result(None)
+            if self._tails.get(key) is done:
+                del self._tails[key]
+
+    async def _run(self, coroutine: Awaitable) -> None:
+        async with self._slots:
+            self._running += 1
+            try:
+                await coroutine
+            finally:
+                self._running -= 1
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
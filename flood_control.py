@@ -0,0 +1,210 @@
+import hashlib
+import math
+import re
+import time
+from typing import Callable, Dict, Optional
+
+# "tx hash : 0xABC..." -> "0xABC..."
+_TX_HASH = re.compile(r"tx hash\s*:\s*(\S+)", re.IGNORECASE)
+_HEX = re.compile(r"(?:0x)?[0-9a-fA-F]+")
+
+
+def normalize_tx_hash(text: str) -> Optional[str]:
+    """Returns the canonical form of the tx hash in `text`, or None if there is none.
+
+    Hex hashes are case-insensitive and the 0x prefix is optional, so
+    "0xABC", "abc" and "0xabc" are the same hash. Other encodings (base58, ...)
+    are case-sensitive and only stripped.
+    """
+    match = _TX_HASH.search(text)
+    if not match:
+        return None
+    value = match.group(1).strip(".,;")
+    if _HEX.fullmatch(value):
+        value = value.lower()
+        return value[2:] if value.startswith("0x") else value
+    return value or None
+
+
+class RateLimiter:
+    """Per-user token bucket stored as one float per active user (GCRA).
+
+    Each user allows `burst` messages at once, refilled at `per_minute`. Only the
+    "theoretical arrival time" of the next message is kept; once it is in the past
+    the user is back to a full bucket and the entry is dropped by the next sweep,
+    so the table only holds users who were active within the last burst period.
+    """
+
+    def __init__(self, per_minute: float, burst: int = 5, clock: Callable[[], float] = time.monotonic):
+        self.interval = 60.0 / per_minute
+        self.tolerance = self.interval * (burst - 1)
+        self._clock = clock
+        self._tat: Dict[int, float] = {}
+        self._sweep_at = 1024
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    def allow(self, user_id: int) -> bool:
+        """Takes one token from the user's bucket; False when it is empty."""
+        now = self._clock()
+        tat = self._tat.get(user_id, now)
+        if tat < now:
+            tat = now
+        if tat - now > self.tolerance:
+            return False
+        self._tat[user_id] = tat + self.interval
+        if len(self._tat) > self._sweep_at:
+            self._forget_idle(now)
+        return True
+
+    def _forget_idle(self, now: float) -> None:
+        # Amortized: the next sweep waits until the table doubled again
+        for user_id in [u for u, tat in self._tat.items() if tat <= now]:
+            del self._tat[user_id]
+        self._sweep_at = max(1024, 2 * len(self._tat))
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over bytes keys."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))  # bits
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: bytes):
+        # Double hashing: k positions from one 128-bit digest
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: bytes) -> bool:
+        """Adds `key`; returns True if it was (probably) already present."""
+        present = True
+        bits = self._bits
+        for position in self._positions(key):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not bits[byte] & mask:
+                present = False
+                bits[byte] |= mask
+        if not present:
+            self.count += 1
+        return present
+
+    def __contains__(self, key: bytes) -> bool:
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class SeenSet:
+    """Bounded "seen before" set made of two rotating Bloom filters.
+
+    Remembers at least the last `capacity` keys and at most 2 * `capacity`: when
+    the current filter is full it becomes the previous one and the oldest filter
+    is dropped. Memory is fixed (about 29 bits per key at the default 1e-6 false
+    positive rate), whatever the number of keys seen.
+    """
+
+    def __init__(self, capacity: int = 100_000, error_rate: float = 1e-6):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous: Optional[BloomFilter] = None
+
+    def check_and_add(self, key: str) -> bool:
+        """Returns True if `key` was seen before, and remembers it."""
+        data = key.encode()
+        if self._previous is not None and data in self._previous:
+            self._current.add(data)  # Keep recent keys alive across the rotation
+            return True
+        if self._current.add(data):
+            return True
+        if self._current.count >= self.capacity:
+            self._previous, self._current = self._current, BloomFilter(self.capacity, self.error_rate)
+        return False
+
+    def __contains__(self, key: str) -> bool:
+        data = key.encode()
+        return data in self._current or (self._previous is not None and data in self._previous)
+
+
+class InboundGuard:
+    """Admission checks for user messages before they reach the handlers.
+
+    `admit()` rate limits each user, counts an album as a single message and
+    flags tx hashes that were already submitted (by anyone). A hash only counts
+    as submitted once `remember_tx_hash()` was called after its delivery, so a
+    failed delivery can be retried. `should_notify()`
+    limits the "slow down" reply to one per user per `notice_interval` so
+    throttled messages stay almost free.
+    """
+
+    ADMITTED = "admitted"
+    THROTTLED = "throttled"
+    DUPLICATE = "duplicate"
+
+    def __init__(self, per_minute: float, burst: int = 5, seen_capacity: int = 100_000,
+                 notice_interval: float = 60.0, clock: Callable[[], float] = time.monotonic):
+        self.limiter = RateLimiter(per_minute, burst, clock)
+        self.seen = SeenSet(seen_capacity)
+        self.notice_interval = notice_interval
+        self._clock = clock
+        self._notified: Dict[int, float] = {}  # user_id -> time of the last throttle reply
+        self._albums: Dict[str, str] = {}  # media_group_id -> decision for its first part
+        self.admitted = 0
+        self.throttled = 0
+        self.duplicates = 0
+
+    def admit(self, user_id: int, text: Optional[str] = None, media_group_id: Optional[str] = None) -> str:
+        if media_group_id is not None:
+            decision = self._albums.get(media_group_id)
+            if decision is not None:
+                return self._count(decision)
+        decision = self.ADMITTED if self.limiter.allow(user_id) else self.THROTTLED
+        if decision == self.ADMITTED and text:
+            tx_hash = normalize_tx_hash(text)
+            if tx_hash is not None and tx_hash in self.seen:
+                decision = self.DUPLICATE
+        if media_group_id is not None:
+            self._albums[media_group_id] = decision
+            if len(self._albums) > 1000:
+                del self._albums[next(iter(self._albums))]
+        return self._count(decision)
+
+    def remember_tx_hash(self, text: str) -> None:
+        """Records the tx hash in `text` (if any) as submitted."""
+        tx_hash = normalize_tx_hash(text)
+        if tx_hash is not None:
+            self.seen.check_and_add(tx_hash)
+
+    def _count(self, decision: str) -> str:
+        if decision == self.ADMITTED:
+            self.admitted += 1
+        elif decision == self.THROTTLED:
+            self.throttled += 1
+        else:
+            self.duplicates += 1
+        return decision
+
+    def should_notify(self, user_id: int) -> bool:
+        """True at most once per `notice_interval` for each throttled user."""
+        now = self._clock()
+        last = self._notified.get(user_id)
+        if last is not None and now - last < self.notice_interval:
+            return False
+        self._notified[user_id] = now
+        if len(self._notified) > 10_000:
+            cutoff = now - self.notice_interval
+            self._notified = {u: t for u, t in self._notified.items() if t >= cutoff}
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "admitted": self.admitted,
+            "throttled": self.throttled,
+            "duplicates": self.duplicates,
+            "tracked_users": len(self.limiter),
+        }
@@ -0,0 +1,144 @@
+import json
+import logging
+import operator
+import os
+from string import Formatter
+from typing import Callable, Dict, FrozenSet, Mapping, Union
+
+logger = logging.getLogger(__name__)
+
+# A compiled entry is either the final text (no placeholders) or a function rendering a dict of values
+CompiledMessage = Union[str, Callable[[Mapping[str, object]], str]]
+
+
+class CatalogError(ValueError):
+    """Raised when the message files are inconsistent."""
+
+
+def placeholders(template: str) -> FrozenSet[str]:
+    """Returns the placeholder names used in a str.format template."""
+    names = set()
+    for _, field_name, _, _ in Formatter().parse(template):
+        if field_name is None:
+            continue
+        if not field_name.isidentifier():
+            raise CatalogError(f"Placeholder {{{field_name}}} must be a plain name")
+        names.add(field_name)
+    return frozenset(names)
+
+
+def compile_template(template: str) -> Callable[[Mapping[str, object]], str]:
+    """Turns a str.format template into a %-style function that renders a dict of values.
+
+    Templates using conversions or format specs ("{x!r}", "{x:>5}") keep str.format_map.
+    """
+    fragments = []
+    names = []
+    for literal, field_name, format_spec, conversion in Formatter().parse(template):
+        fragments.append(literal.replace("%", "%%"))
+        if field_name is None:
+            continue
+        if format_spec or conversion:
+            return template.format_map
+        fragments.append("%s")
+        names.append(field_name)
+    percent_template = "".join(fragments)
+    if len(names) == 1:
+        name = names[0]
+        return lambda values: percent_template % (values[name],)
+    getter = operator.itemgetter(*names)
+    return lambda values: percent_template % getter(values)
+
+
+class MessageCatalog:
+    """Per-language messages loaded from `<directory>/<language>.json` and compiled once.
+
+    Messages without placeholders are rendered at load time and returned as-is;
+    messages with placeholders are compiled into a render function. Every
+    language is validated against the default language at load time: unknown keys
+    and placeholder mismatches are errors, missing keys fall back to the default
+    language. `reload_if_changed()` swaps in a new catalog when a file changed and
+    keeps the current one if the new files do not validate.
+    """
+
+    def __init__(self, directory: str, default_language: str = "en"):
+        self.directory = directory
+        self.default_language = default_language
+        self._tables: Dict[str, Dict[str, CompiledMessage]] = {}
+        self._default_table: Dict[str, CompiledMessage] = {}
+        self._mtimes: Dict[str, float] = {}
+        self.load()
+
+    @property
+    def languages(self):
+        return self._tables.keys()
+
+    def _scan(self) -> Dict[str, float]:
+        return {
+            name: os.path.getmtime(os.path.join(self.directory, name))
+            for name in os.listdir(self.directory)
+            if name.endswith(".json")
+        }
+
+    def load(self) -> None:
+        """Reads, validates and compiles every language file (raises CatalogError on problems)."""
+        mtimes = self._scan()
+        raw = {}
+        for name in mtimes:
+            with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                raw[name[:-len(".json")]] = json.load(f)
+        self._tables = self._compile(raw)
+        self._default_table = self._tables[self.default_language]
+        self._mtimes = mtimes
+        logger.info("Loaded messages for languages: %s", ", ".join(sorted(self._tables)))
+
+    def _compile(self, raw: Dict[str, Dict[str, str]]) -> Dict[str, Dict[str, CompiledMessage]]:
+        if self.default_language not in raw:
+            raise CatalogError(f"Missing {self.default_language}.json in {self.directory}")
+        default = raw[self.default_language]
+        expected = {key: placeholders(template) for key, template in default.items()}
+
+        tables = {}
+        for language, messages in raw.items():
+            unknown = set(messages) - set(default)
+            if unknown:
+                raise CatalogError(f"{language}.json has keys missing from {self.default_language}.json: {sorted(unknown)}")
+            for key, template in messages.items():
+                if placeholders(template) != expected[key]:
+                    raise CatalogError(
+                        f"{language}.json '{key}' uses {sorted(placeholders(template))}, expected {sorted(expected[key])}"
+                    )
+            missing = set(default) - set(messages)
+            if missing:
+                logger.warning("%s.json is missing %s, using %s", language, sorted(missing), self.default_language)
+
+            table = {}
+            for key, template in {**default, **messages}.items():
+                # format() with no arguments also turns "{{" into "{" for static texts
+                table[key] = compile_template(template) if expected[key] else template.format()
+            tables[language] = table
+        return tables
+
+    def reload_if_changed(self) -> bool:
+        """Reloads the catalog if a file was added, removed or modified. Returns True on reload."""
+        try:
+            if self._scan() == self._mtimes:
+                return False
+            self.load()
+            return True
+        except (OSError, ValueError) as e:  # json.JSONDecodeError and CatalogError are ValueErrors
+            logger.error("Message catalog not reloaded, keeping the current one: %s", e)
+            return False
+
+    def render(self, language: str, key: str, values: Mapping[str, object]) -> str:
+        """Returns the message for `key` in `language` (falling back to the default language)."""
+        entry = self._tables.get(language, self._default_table).get(key)
+        if entry is None:
+            return f"Error: Message key '{key}' not found."
+        if entry.__class__ is str:
+            return entry
+        return entry(values)
+
+    def get(self, language: str, key: str, **kwargs) -> str:
+        """Keyword-argument version of render()."""
+        return self.render(language, key, kwargs)
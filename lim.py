@@ -1,9 +1,15 @@
 import os
+import functools
+import asyncio
 import logging
+import socket
+import time
+from typing import Callable, Dict, List, Optional
 from dotenv import load_dotenv
-from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram import Bot, Message, Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import (
     Application,
+    ApplicationHandlerStop,
     CommandHandler,
     ContextTypes,
     MessageHandler,
@@ -11,7 +17,23 @@ from telegram.ext import (
     JobQueue,
     CallbackQueryHandler
 )
-from telegram.error import Forbidden # Import Forbidden to handle blocked users
+from telegram.error import RetryAfter
+from backlog import BacklogReport, fetch_backlog, split_backlog
+from broadcast import BroadcastEngine, retry_after_seconds
+from broadcast_jobs import BroadcastJobRunner
+from cluster import LeaderLease, UpdateReceiver, UpdateRouter, partition, serve_router, serve_worker
+from concurrency import PerChatUpdateProcessor
+from flood_control import InboundGuard, normalize_tx_hash
+from i18n import MessageCatalog
+from log_pipeline import setup_logging
+from media_groups import MediaGroupCollector
+from metrics import BotMetrics, InstrumentedRequest, MetricsServer
+from owner_digest import MAX_FORWARD_BATCH, MODE_FORWARD, OwnerDigest
+from owner_inbox import format_age
+from state_store import (
+    PersistentDigestMap, PersistentOwnerInbox, PersistentUserMap, PersistentUserRegistry, StateStore, open_state_store,
+)
+from user_registry import UserRegistry
 
 # Load environment variables from .env file
 load_dotenv()
@@ -20,10 +42,93 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 OWNER_ID = os.getenv("OWNER_ID")  # Must be in string format
 
-# Logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
+# Broadcast tuning (defaults follow Telegram's ~30 msg/s global and ~1 msg/s per chat limits)
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "30"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "25"))
+# One faucet list broadcast per interval (slots aligned to UTC, 28800 = 00:00, 08:00, 16:00), spread over
+# BROADCAST_WINDOW seconds (0 = as fast as the rate allows) and checkpointed every BROADCAST_BATCH users
+BROADCAST_INTERVAL = float(os.getenv("BROADCAST_INTERVAL", "28800"))
+BROADCAST_WINDOW = float(os.getenv("BROADCAST_WINDOW", "0"))
+BROADCAST_BATCH = int(os.getenv("BROADCAST_BATCH", "50"))
+
+# State persistence ("sqlite" keeps user_map, all_users and user_languages across restarts, "memory" does not)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "bot_state.db")
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "2"))  # seconds between group commits
+# Registry file written on a clean shutdown and memory-mapped on the next start instead of reading the
+# users table (sqlite backend only, empty disables it)
+USER_SNAPSHOT_PATH = os.getenv("USER_SNAPSHOT_PATH", STATE_DB_PATH + ".users")
+
+# How updates are received: "polling" (default), "webhook", or "router"/"worker" for the horizontal mode below
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Public HTTPS URL Telegram should post updates to
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")  # Local address of the webhook server
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Optional secret token checked on every webhook request
+
+# Horizontal mode: the router (BOT_MODE=router) receives Telegram's webhook and hands each update to the
+# worker owning its chat (chat id % number of workers). Workers (BOT_MODE=worker) listen on WEBHOOK_LISTEN,
+# WEBHOOK_PORT and WEBHOOK_PATH, share the state store at STATE_DB_PATH, and hold a lease to lead the
+# scheduled broadcast one at a time.
+CLUSTER_WORKER_URLS = [url for url in os.getenv("CLUSTER_WORKER_URLS", "").split(",") if url]  # router only, in order
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", "1"))  # worker: number of workers
+CLUSTER_WORKER_ID = int(os.getenv("CLUSTER_WORKER_ID", "0"))  # worker: its index, from 0
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", "30"))  # seconds
+if BOT_MODE == "worker" and USER_SNAPSHOT_PATH:
+    USER_SNAPSHOT_PATH = f"{USER_SNAPSHOT_PATH}.{CLUSTER_WORKER_ID}"  # One registry file per worker
+
+# Updates from different chats processed in parallel (1 = one update at a time, like before)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))
+
+# How user messages reach the owner: "forward" (forward + notice), "copy" (one message with
+# the attribution) or "digest" (bursts collected for OWNER_DIGEST_WINDOW seconds and sent together)
+OWNER_DELIVERY = os.getenv("OWNER_DELIVERY", "forward")
+OWNER_DIGEST_WINDOW = float(os.getenv("OWNER_DIGEST_WINDOW", "5"))
+
+# Owner inbox: pending threads listed per /inbox page, and forwards kept per user for /thread
+INBOX_PAGE_SIZE = int(os.getenv("INBOX_PAGE_SIZE", "20"))
+INBOX_RECENT_MESSAGES = int(os.getenv("INBOX_RECENT_MESSAGES", "5"))
+
+# Seconds to wait for more photos of an album before handling it
+ALBUM_WINDOW = float(os.getenv("ALBUM_WINDOW", "1.0"))
+
+# Message files and how often (seconds) to check them for changes (0 disables hot reload)
+I18N_DIR = os.getenv("I18N_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "locales"))
+I18N_RELOAD_INTERVAL = float(os.getenv("I18N_RELOAD_INTERVAL", "30"))
+
+# Reply routing index limits (forwards past either limit can no longer be replied to)
+USER_MAP_MAX_ENTRIES = int(os.getenv("USER_MAP_MAX_ENTRIES", "200000"))  # kept in memory
+USER_MAP_MAX_AGE_DAYS = float(os.getenv("USER_MAP_MAX_AGE_DAYS", "30"))
+
+# Inbound flood control: messages per minute and burst allowed per user (INBOUND_RATE=0 disables it),
+# how many tx hashes are remembered for duplicate detection and how often a throttled user is told so
+INBOUND_RATE = float(os.getenv("INBOUND_RATE", "20"))
+INBOUND_BURST = int(os.getenv("INBOUND_BURST", "5"))
+TX_HASH_MEMORY = int(os.getenv("TX_HASH_MEMORY", "100000"))
+THROTTLE_NOTICE_INTERVAL = float(os.getenv("THROTTLE_NOTICE_INTERVAL", "60"))
+
+# Catch-up on start: pending updates are fetched in bulk and each user's messages are answered once
+BACKLOG_DRAIN = os.getenv("BACKLOG_DRAIN", "1") == "1"
+BACKLOG_MAX_UPDATES = int(os.getenv("BACKLOG_MAX_UPDATES", "10000"))  # the rest is handled live
+BACKLOG_CONCURRENCY = int(os.getenv("BACKLOG_CONCURRENCY", "4"))  # users answered in parallel
+
+# Local Prometheus endpoint (GET /metrics); METRICS_PORT=0 disables it
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))
+if BOT_MODE == "worker" and METRICS_PORT:
+    METRICS_PORT += CLUSTER_WORKER_ID  # One port per worker: 9090, 9091, ...
+
+# Logging: records are formatted and written by a background thread, never on the event loop
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json" (one object per line)
+LOG_FILE = os.getenv("LOG_FILE")  # Defaults to stderr
+LOG_USER_RATE = float(os.getenv("LOG_USER_RATE", "20"))  # INFO records per user per minute, 0 = no limit
+LOG_UPDATES = os.getenv("LOG_UPDATES", "1") == "1"  # One record per handled update (handler, user, latency)
+
+setup_logging(LOG_LEVEL, json_format=LOG_FORMAT == "json", path=LOG_FILE, user_rate=LOG_USER_RATE)
+# httpx logs every Bot API request at INFO; the metrics endpoint already counts them
+logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 # Main keyboard definition (will be stored in bot_data)
@@ -39,91 +144,31 @@ _main_menu_keyboard_definition = [
 # The button text will display as "/script access on github" as per user request,
 # but Telegram automatically handles spaces in button text by converting them to underscores for the command.
 
+# Language selection keyboard shown by /start (built once, stored in bot_data)
+_language_keyboard_definition = [
+    [InlineKeyboardButton("Bahasa Indonesia", callback_data='lang_id')],
+    [InlineKeyboardButton("English", callback_data='lang_en')]
+]
+
 
-# Define all messages in both Indonesian and English
-MESSAGES = {
-    "id": {
-        "start_greeting": "Halo {user_name}! Silakan pilih bahasa Anda.",
-        "welcome_menu": "Halo {user_name}! Selamat datang di @VirtualAssistant19_bot 😎\nSilakan pilih opsi dari menu yang tersedia , selamat menikmati Sahabat !!",
-        "tx_hash_prompt": "Silakan kirim bukti tx hash transaksi blockchain Anda\nContoh: tx hash : 0x123abc...",
-        "picture_proof_prompt": "Silakan kirimkan bukti gambar.",
-        "photo_received_owner": "⬆️ Gambar di atas dikirim oleh: {user_full_name} (ID: {user_id})",
-        "photo_received_user": "Gambar Anda telah diterima dan diteruskan ke pemilik. Terima kasih!",
-        "reply_from_owner": "📩 Balasan dari pemilik:\n\n{text}",
-        "reply_sent_success": "✅ Balasan berhasil dikirim ke pengguna asli.",
-        "reply_send_fail": "❌ Gagal mengirim balasan: {error}",
-        "hash_received_owner": "⬆️ Pesan hash di atas dari: {user_full_name} (ID: {user_id})",
-        "hash_received_user": "Pesan hash Anda telah diteruskan ke pemilik.",
-        "unknown_text_forwarded_owner": "⬆️ Pesan di atas dari: {user_full_name} (ID: {user_id})",
-        "unknown_text_forwarded_user": "Pesan Anda telah diteruskan ke pemilik. Terima kasih!",
-        "purchase_details_prompt": "Silakan isi keterangan\n▫️Pilih Nomor atau nama Faucetnya :\n▫️Jumlah Pembelian :\n▫️Alamat Wallet kamu :\n▫️Metode Pembayaran :",
-        "invalid_text_message": "Maaf, saya hanya bisa menerima gambar sebagai bukti transaksi, pesan dalam format 'tx hash : [hash Anda]', atau angka untuk pembelian faucet.\n\nSilakan gunakan menu di bawah ini.",
-        "script_access_prompt": (
-            "Silakan kirim 1.6 $Usdt atau $Usdc ke alamat ini: 0xf01fb9a6855f175d3f3e28e00fa617009c38ef59\n\n"
-            "Dan kirimkan bukti transaksi dengan memilih menu /send_tx_hash dan menu /send_picture_proof untuk mengirimkan script di github yang ingin diakses."
-        ),
-        "faucet_list_message": (
-            "🟢Ready Faucet :\n\n"
-            "1. Monad Testnet 🔁 Rp. 1.200 | 0.074 $Usdt or $Usdc / 1\n"
-            "2. ETH Sepolia 🔁 Rp. 4500 | 0.28 $Usdt or $Usdc / 1\n"
-            "3. Somnia/stt Testnet 🔁 Rp. 450 | 0.031 $Usdt or $Usdc / 1\n"
-            "4. Pharos Testnet 🔁 Rp. 600 | 0.037 $Usdt or $Usdc / 1\n"
-            "5. Sui Testnet 🔁 Rp 350 | 0.021 $Usdt or $Usdc / 1\n"
-            "6. 0G Testnet >> Coming soon..\n\n"
-            "🛗 Payment Method\n"
-            "⏺ Dana : 085275232733 | A/N : Hardianti\n"
-            "⏺ Crypto : USDT & USDC | ➡️wallet address: 0xa138031dc7ea75c464364ed1a6d1cb3b510ff630\n\n"
-            "Silakan pilih nomor 1,2,3,4,5,6... jika kamu ingin membeli."
-        )
-    },
-    "en": {
-        "start_greeting": "Hello {user_name}! Please select your language.",
-        "welcome_menu": "Halo {user_name}! Welcome to @VirtualAssistant19_bot 😎\nPlease select an option from the menu, enjoy!",
-        "tx_hash_prompt": "Please send your blockchain transaction hash proof\nExample: tx hash : 0x123abc...",
-        "picture_proof_prompt": "Please send your picture proof.",
-        "photo_received_owner": "⬆️ The photo above was sent by: {user_full_name} (ID: {user_id})",
-        "photo_received_user": "Your photo has been received and forwarded to the owner. Thank you!",
-        "reply_from_owner": "📩 Reply from owner:\n\n{text}",
-        "reply_sent_success": "✅ Reply sent successfully to the original user.",
-        "reply_send_fail": "❌ Failed to send reply: {error}",
-        "hash_received_owner": "⬆️ The hash message above is from: {user_full_name} (ID: {user_id})",
-        "hash_received_user": "Your hash message has been forwarded to the owner.",
-        "unknown_text_forwarded_owner": "⬆️ The message above is from: {user_full_name} (ID: {user_id})",
-        "unknown_text_forwarded_user": "Your message has been forwarded to the owner. Thank you!",
-        "purchase_details_prompt": "Please fill in the details\n▫️Select Faucet Number or Name :\n▫️Purchase Quantity :\n▫️Your Wallet Address :\n▫️Payment Method :",
-        "invalid_text_message": "Sorry, I can only accept images as transaction proof, messages in the format 'tx hash : [your hash]', or a number for faucet purchase.\n\nPlease use the menu below.",
-        "script_access_prompt": (
-            "Please send 1.6 $Usdt or $Usdc to this address: 0xf01fb9a6855f175d3f3e28e00fa617009c38ef59\n\n"
-            "And send transaction proof by selecting the /send_tx_hash menu and the /send_picture_proof menu to send the script on GitHub that you want to access."
-        ),
-        "faucet_list_message": (
-            "🟢Ready Faucet :\n\n"
-            "1. Monad Testnet 🔁 Rp. 1.200 | 0.074 $Usdt or $Usdc / 1\n"
-            "2. ETH Sepolia 🔁 Rp. 4500 | 0.28 $Usdt or $Usdc / 1\n"
-            "3. Somnia/stt Testnet 🔁 Rp. 450 | 0.031 $Usdt or $Usdc / 1\n"
-            "4. Pharos Testnet 🔁 Rp. 600 | 0.037 $Usdt or $Usdc / 1\n"
-            "5. Sui Testnet 🔁 Rp 350 | 0.021 $Usdt or $Usdc / 1\n"
-            "6. 0G Testnet >> Coming soon..\n\n"
-            "🛗 Payment Method\n"
-            "⏺ Dana : 085275232733 | A/N : Hardianti\n"
-            "⏺ Crypto : USDT & USDC | ➡️wallet address: 0xa138031dc7ea75c464364ed1a6d1cb3b510ff630\n\n"
-            "Please select number 1,2,3,4,5,6... if you wish to purchase."
-        )
-    }
-}
+# All messages (Indonesian and English) live in locales/<language>.json and are compiled once at startup
+MESSAGES = MessageCatalog(I18N_DIR, default_language="en")
 
 # Global variable for the application instance (will be set in main)
 application = None
 
 def get_message(context: ContextTypes.DEFAULT_TYPE, _user_id_for_lang_lookup: int, key: str, **kwargs) -> str:
     """Retrieves a message in the user's preferred language."""
-    # Default to English if language not set or invalid
+    # Default to English if language not set or invalid (the catalog falls back to English for missing keys)
     user_lang = context.bot_data.get('user_languages', {}).get(_user_id_for_lang_lookup, 'en')
-    logger.debug(f"get_message: User ID {_user_id_for_lang_lookup}, Key '{key}', Using language '{user_lang}'")
-    
-    # Fallback to English if the key is not found in the selected language
-    message_template = MESSAGES.get(user_lang, MESSAGES['en']).get(key, MESSAGES['en'].get(key, f"Error: Message key '{key}' not found."))
-    return message_template.format(**kwargs)
+    return MESSAGES.render(user_lang, key, kwargs)
+
+
+# Periodic check for edited message files
+async def reload_messages(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Reloads the message catalog when a file in I18N_DIR changed."""
+    if MESSAGES.reload_if_changed():
+        logger.info("Message catalog reloaded.")
 
 
 # /start command
@@ -143,14 +188,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         )
     else:
         # Offer language selection
-        keyboard = [
-            [InlineKeyboardButton("Bahasa Indonesia", callback_data='lang_id')],
-            [InlineKeyboardButton("English", callback_data='lang_en')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
         await update.message.reply_text(
             get_message(context, user_id, "start_greeting", user_name=user_name), # Use a generic greeting for language selection
-            reply_markup=reply_markup
+            reply_markup=context.bot_data['language_markup'] # Access from bot_data
         )
 
 async def button_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -164,7 +204,7 @@ async def button_callback_handler(update: Update, context: ContextTypes.DEFAULT_
     if query.data.startswith('lang_'):
         selected_lang = query.data.split('_')[1]
         context.bot_data.setdefault('user_languages', {})[user_id] = selected_lang
-        logger.info(f"User {user_name} (ID: {user_id}) selected language: {selected_lang}")
+        logger.info("User %s (ID: %s) selected language: %s", user_name, user_id, selected_lang, extra={"user_id": user_id})
 
         # Delete the original message containing the inline keyboard
         await query.delete_message()
@@ -210,6 +250,38 @@ async def script_access_on_github_prompt(update: Update, context: ContextTypes.D
     await update.message.reply_text(get_message(context, user_id, "script_access_prompt"))
 
 
+async def admit_inbound(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Runs before the other handlers: drops messages of users over their rate and repeated tx hashes."""
+    message = update.message
+    user_id = update.effective_user.id
+    if str(message.chat_id) == OWNER_ID:
+        return
+    guard = context.bot_data['inbound_guard']
+    decision = guard.admit(user_id, message.text, message.media_group_id)
+    if decision == InboundGuard.ADMITTED:
+        return
+    if decision == InboundGuard.DUPLICATE:
+        await message.reply_text(get_message(context, user_id, "duplicate_tx_hash"))
+    elif guard.should_notify(user_id):
+        # Texts without placeholders are pre-rendered, the reply costs one API call per notice interval
+        await message.reply_text(get_message(context, user_id, "inbound_throttled"))
+    logger.info("Dropped %s message from user ID: %s", decision, user_id, extra={"user_id": user_id})
+    raise ApplicationHandlerStop  # Skip the regular handlers
+
+
+async def deliver_to_owner(update: Update, context: ContextTypes.DEFAULT_TYPE, notice_key: str,
+                           on_sent: Optional[Callable[[], None]] = None) -> None:
+    """Sends the user's message to the owner according to OWNER_DELIVERY (`on_sent` runs once it arrived)."""
+    user = update.effective_user
+    owner_digest = context.bot_data['owner_digest']
+    # Forward mode keeps the original "message above is from" notice, the other modes attach a one-line attribution
+    key = notice_key if owner_digest.mode == MODE_FORWARD else "owner_attribution"
+    await owner_digest.deliver(
+        update.message, user.id, get_message(context, user.id, key, user_full_name=user.full_name, user_id=user.id),
+        on_sent=on_sent,
+    )
+
+
 # Handle photo
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles messages containing photos (transaction proofs)."""
@@ -222,24 +294,18 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     # Initialize user_map to store forwarded message_id to original user's chat_id mapping.
     context.bot_data.setdefault('user_map', {})
 
-    # Forward the photo to the bot owner
-    forwarded_message = await context.bot.forward_message(
-        chat_id=OWNER_ID,
-        from_chat_id=user_id,
-        message_id=update.message.message_id,
-    )
-    # Corrected: Pass user_id explicitly for string formatting
-    logger.info(get_message(context, user_id, "photo_received_owner", user_full_name=user.full_name, user_id=user_id) + f" Forwarded Message ID: {forwarded_message.message_id}")
+    # An album the user sent before this photo reaches the owner first
+    await context.bot_data['media_groups'].flush_chat(update.message.chat_id, keep=update.message.media_group_id)
 
-    # Store the original user's ID with the forwarded message's ID as the key
-    context.bot_data['user_map'][forwarded_message.message_id] = user_id
+    # Photos of an album are collected first and handled together in handle_album
+    if update.message.media_group_id:
+        context.bot_data['media_groups'].add(
+            update.message, lambda messages: handle_album(context, user, messages)
+        )
+        return
 
-    # Inform the owner that the photo has been received
-    # Corrected: Pass user_id explicitly for string formatting
-    await context.bot.send_message(
-        chat_id=OWNER_ID,
-        text=get_message(context, user_id, "photo_received_owner", user_full_name=user.full_name, user_id=user_id)
-    )
+    # Send the photo to the bot owner with its attribution (user_map is updated on delivery)
+    await deliver_to_owner(update, context, "photo_received_owner")
 
     # Inform the user that the photo has been forwarded
     await update.message.reply_text(
@@ -247,6 +313,22 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         reply_markup=context.bot_data['main_menu_markup'] # Access from bot_data
     )
 
+# Handle a complete album (media group) of photos
+async def handle_album(context: ContextTypes.DEFAULT_TYPE, user, messages: List[Message]) -> None:
+    """Sends all photos of an album to the owner in one group and acknowledges them once."""
+    user_id = user.id
+    owner_digest = context.bot_data['owner_digest']
+    key = "album_received_owner" if owner_digest.mode == MODE_FORWARD else "owner_attribution"
+    text = get_message(context, user_id, key, count=len(messages), user_full_name=user.full_name, user_id=user_id)
+    await owner_digest.deliver_album(messages, user_id, text)
+
+    # One acknowledgement for the whole album
+    await context.bot.send_message(
+        chat_id=user_id,
+        text=get_message(context, user_id, "album_received_user", count=len(messages)),
+        reply_markup=context.bot_data['main_menu_markup'] # Access from bot_data
+    )
+
 # Handle text messages
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles text messages, both from regular users and replies from the owner."""
@@ -264,13 +346,20 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     # --- Handle replies from the bot owner ---
     # If the message is from the OWNER_ID and is a reply to another message
     if str(chat_id) == OWNER_ID and update.message.reply_to_message:
-        logger.info(f"Owner {user.full_name} (ID: {user.id}) replied to a message.")
-        logger.info(f"Replied Message ID: {update.message.reply_to_message.message_id}")
-        logger.info(f"Sender of Replied Message: {update.message.reply_to_message.from_user.full_name if update.message.reply_to_message.from_user else 'None'}")
+        logger.info("Owner %s (ID: %s) replied to message ID: %s", user.full_name, user.id,
+                    update.message.reply_to_message.message_id, extra={"user_id": user.id})
 
         replied_msg_id = update.message.reply_to_message.message_id
         original_user_id = context.bot_data['user_map'].get(replied_msg_id)
 
+        # Replies to a digest with messages from several users pick the item with "#<n>"
+        if not original_user_id and context.bot_data['owner_digest'].is_digest(replied_msg_id):
+            resolved = context.bot_data['owner_digest'].resolve_reply(replied_msg_id, text)
+            if not resolved:
+                await update.message.reply_text(get_message(context, chat_id, "digest_reply_needs_number"))
+                return
+            original_user_id, text = resolved
+
         if original_user_id:
             try:
                 # Send the reply to the original user
@@ -278,38 +367,36 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
                     chat_id=original_user_id,
                     text=get_message(context, original_user_id, "reply_from_owner", text=text)
                 )
+                context.bot_data['owner_inbox'].mark_answered(original_user_id)
                 # Corrected: Use chat_id for the owner's language context
                 await update.message.reply_text(get_message(context, chat_id, "reply_sent_success"))
-                logger.info(f"Successfully sent reply to user ID: {original_user_id}.")
+                logger.info("Successfully sent reply to user ID: %s.", original_user_id, extra={"user_id": original_user_id})
             except Exception as e:
                 # Corrected: Use original_user_id for error message language context
-                logger.error(get_message(context, original_user_id, "reply_send_fail", error=e))
+                logger.error("Failed to send reply to user ID: %s: %s", original_user_id, e, extra={"user_id": original_user_id})
                 # Corrected: Use chat_id for the owner's language context
                 await update.message.reply_text(get_message(context, chat_id, "reply_send_fail", error=e))
-            return # Exit the function after handling the owner's reply
+        else:
+            # Expired, or sent by another worker that has not flushed it to the store yet
+            logger.warning("Owner reply to message ID %s matches no user.", replied_msg_id, extra={"user_id": user.id})
+            await update.message.reply_text(get_message(context, chat_id, "reply_not_routed"))
+        return # Exit the function after handling the owner's reply
 
     # --- Handle messages from regular users ---
     # If the message is not from the owner (or not a reply from the owner)
     if str(chat_id) != OWNER_ID:
+        # An album the user sent before this message reaches the owner first
+        await context.bot_data['media_groups'].flush_chat(chat_id)
+
         # If the message contains "tx hash :"
         if "tx hash :" in text.lower():
-            # Forward the hash message to the bot owner
-            forwarded_message = await context.bot.forward_message(
-                chat_id=OWNER_ID,
-                from_chat_id=chat_id,
-                message_id=update.message.message_id
-            )
-            # Corrected: Pass user_id explicitly for string formatting
-            logger.info(get_message(context, user_id, "hash_received_owner", user_full_name=user.full_name, user_id=user_id) + f" Forwarded Message ID: {forwarded_message.message_id}")
-            # Store the original user's ID
-            context.bot_data['user_map'][forwarded_message.message_id] = user_id
-
-            # Inform the owner
-            # Corrected: Pass user_id explicitly for string formatting
-            await context.bot.send_message(
-                chat_id=OWNER_ID,
-                text=get_message(context, user_id, "hash_received_owner", user_full_name=user.full_name, user_id=user_id)
-            )
+            # Send the hash message to the bot owner with its attribution
+            # Only a delivered hash counts as submitted: after a failure (or a dropped digest) the user
+            # can send it again
+            remember = None
+            if 'inbound_guard' in context.bot_data:
+                remember = functools.partial(context.bot_data['inbound_guard'].remember_tx_hash, text)
+            await deliver_to_owner(update, context, "hash_received_owner", on_sent=remember)
 
             # Inform the user
             await update.message.reply_text(
@@ -325,84 +412,547 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
             )
         else:
             # If it's any other text message from the user, forward it to the owner
-            forwarded_message = await context.bot.forward_message(
-                chat_id=OWNER_ID,
-                from_chat_id=chat_id,
-                message_id=update.message.message_id
-            )
-            # Corrected: Pass user_id explicitly for string formatting
-            logger.info(get_message(context, user_id, "unknown_text_forwarded_owner", user_full_name=user.full_name, user_id=user_id) + f" Forwarded Message ID: {forwarded_message.message_id}")
-            context.bot_data['user_map'][forwarded_message.message_id] = user_id
-
-            # Corrected: Pass user_id explicitly for string formatting
-            await context.bot.send_message(
-                chat_id=OWNER_ID,
-                text=get_message(context, user_id, "unknown_text_forwarded_owner", user_full_name=user.full_name, user_id=user_id)
-            )
+            await deliver_to_owner(update, context, "unknown_text_forwarded_owner")
             await update.message.reply_text(
                 get_message(context, user_id, "unknown_text_forwarded_user"),
                 reply_markup=context.bot_data['main_menu_markup'] # Access from bot_data
             )
 
+# Owner inbox commands (owner only)
+async def refresh_owner_inbox(bot_data: dict) -> None:
+    """Horizontal mode: merges the threads the other workers wrote to the shared store since the last refresh."""
+    if BOT_MODE != "worker":
+        return
+    await bot_data['owner_inbox'].refresh()
+
+async def inbox_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Lists the threads waiting for an answer, longest waiting first: /inbox [page]."""
+    owner_id = update.effective_chat.id
+    inbox = context.bot_data['owner_inbox']
+    await refresh_owner_inbox(context.bot_data)
+    if not inbox.pending:
+        await update.message.reply_text(get_message(context, owner_id, "inbox_empty"))
+        return
+    pages = -(-inbox.pending // INBOX_PAGE_SIZE)
+    page = int(context.args[0]) if context.args and context.args[0].isdigit() else 1
+    page = min(max(page, 1), pages)
+    now = time.time()
+    lines = [get_message(context, owner_id, "inbox_header", count=inbox.pending, page=page, pages=pages)]
+    for number, thread in enumerate(inbox.page(page - 1, INBOX_PAGE_SIZE), start=(page - 1) * INBOX_PAGE_SIZE + 1):
+        lines.append(get_message(
+            context, owner_id, "inbox_item", number=number, user_full_name=thread.name, user_id=thread.user_id,
+            count=thread.unanswered, age=format_age(now - thread.since),
+        ))
+    if page < pages:
+        lines.append(get_message(context, owner_id, "inbox_next_page", page=page + 1))
+    await update.message.reply_text("\n".join(lines))
+
+async def thread_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Forwards a user's recent messages to the bottom of the owner's chat again, ready to be replied to."""
+    owner_id = update.effective_chat.id
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text(get_message(context, owner_id, "thread_usage"))
+        return
+    user_id = int(context.args[0])
+    await refresh_owner_inbox(context.bot_data)
+    thread = context.bot_data['owner_inbox'].thread(user_id)
+    if thread is None or not thread.message_ids:
+        await update.message.reply_text(get_message(context, owner_id, "thread_not_found", user_id=user_id))
+        return
+    # The owner's copies are messages of the owner's chat; forwarding them again maps the new copies too
+    sent = await context.bot.forward_messages(
+        chat_id=owner_id, from_chat_id=owner_id, message_ids=sorted(thread.message_ids)[-MAX_FORWARD_BATCH:]
+    )
+    for message_id in sent:
+        context.bot_data['user_map'][message_id.message_id] = user_id
+    await update.message.reply_text(get_message(
+        context, owner_id, "thread_forwarded", count=len(sent), user_full_name=thread.name, user_id=user_id,
+        unanswered=thread.unanswered,
+    ))
+
+async def reply_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Sends one answer to several users: /reply <user id>[,<user id>...] <text>, or /reply all <text>."""
+    owner_id = update.effective_chat.id
+    parts = update.message.text.split(maxsplit=2)
+    if len(parts) < 3:
+        await update.message.reply_text(get_message(context, owner_id, "reply_usage"))
+        return
+    targets, text = parts[1], parts[2]
+    if targets.lower() == "all":
+        await refresh_owner_inbox(context.bot_data)
+        user_ids = context.bot_data['owner_inbox'].pending_users()
+    else:
+        try:
+            user_ids = list(dict.fromkeys(int(target) for target in targets.split(",") if target))
+        except ValueError:
+            await update.message.reply_text(get_message(context, owner_id, "reply_usage"))
+            return
+    if not user_ids:
+        await update.message.reply_text(get_message(context, owner_id, "inbox_empty"))
+        return
+    await update.message.reply_text(get_message(context, owner_id, "bulk_reply_started", count=len(user_ids)))
+    # Sent in the background: at the broadcast rate a large reply takes minutes, the owner's chat must not wait
+    context.application.create_task(send_bulk_reply(context, owner_id, user_ids, text), update=update)
+
+def remove_blocked_user(bot_data: dict, user_id: int) -> None:
+    """Removes a user who blocked the bot from all_users, or from the store when another worker holds them."""
+    # discard: the user may already be gone
+    if not bot_data['all_users'].discard(user_id) and BOT_MODE == "worker":
+        bot_data['state_store'].queue_user_removal(user_id)  # Held by another worker
+    logger.warning("User ID: %s blocked the bot. Removed from scheduled messages.", user_id,
+                   extra={"user_id": user_id})
+
+async def send_bulk_reply(context: ContextTypes.DEFAULT_TYPE, owner_id: int, user_ids: List[int], text: str) -> None:
+    """Sends the owner's answer through the rate-limited broadcast engine, then reports back to the owner."""
+    inbox = context.bot_data['owner_inbox']
+
+    def prune_blocked_user(user_id: int) -> None:
+        inbox.mark_answered(user_id)  # Nothing more can reach them
+        remove_blocked_user(context.bot_data, user_id)
+
+    report = await context.bot_data['broadcast_engine'].broadcast(
+        user_ids,
+        render=lambda user_id: get_message(context, user_id, "reply_from_owner", text=text),
+        on_forbidden=prune_blocked_user,
+        on_sent=inbox.mark_answered,
+    )
+    logger.info("Owner reply to %d users finished: %s", len(user_ids), report)
+    await context.bot.send_message(chat_id=owner_id, text=get_message(
+        context, owner_id, "bulk_reply_done", sent=report.sent, total=report.total, failed=report.failed,
+        blocked=report.pruned,
+    ))
+
 # Scheduled function to send faucet list
 async def send_scheduled_faucet_list(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Sends the faucet list message to all known users."""
-    if 'all_users' in context.bot_data:
-        for user_id in list(context.bot_data['all_users']): # Iterate over a copy to allow modification if users block
-            try:
-                await context.bot.send_message(chat_id=user_id, text=get_message(context, user_id, "faucet_list_message"))
-                logger.info(f"Sent scheduled faucet list to user ID: {user_id}")
-            except Forbidden:
-                # User blocked the bot, remove them from the list
-                context.bot_data['all_users'].remove(user_id)
-                logger.warning(f"User ID: {user_id} blocked the bot. Removed from scheduled messages.")
-            except Exception as e:
-                logger.error(f"Failed to send scheduled faucet list to user ID: {user_id}: {e}")
-
-# Main function
-def main() -> None:
-    """Main function to run the bot."""
-    global application # Declare application as global to be accessible by get_message
+    """Starts this interval's faucet list broadcast or resumes an interrupted one (a no-op when it already ran)."""
+    if 'all_users' not in context.bot_data:
+        return
 
-    if not BOT_TOKEN or not OWNER_ID:
-        logger.error("BOT_TOKEN or OWNER_ID not found! Please ensure they are set in your .env file.")
+    runner = context.bot_data['broadcast_jobs']
+    audience = context.bot_data['all_users']
+    if BOT_MODE == "worker":
+        if not runner.due():
+            return  # Not the leader, or nothing to send
+        # Each worker only holds its own chats: take every user (and language) from the shared store
+        audience = await load_all_users(context.bot_data['state_store'])
+
+    report = await runner.tick(
+        audience=audience.snapshot,  # Frozen view, handlers may add users while the broadcast runs
+        render=lambda user_id: MESSAGES.render(audience.language(user_id) or 'en', "faucet_list_message", {}),
+        on_forbidden=lambda user_id: remove_blocked_user(context.bot_data, user_id),
+    )
+    if report is None:
+        return
+    context.bot_data['last_broadcast_report'] = report
+    logger.info("Scheduled faucet list broadcast finished: %s", report)
+
+async def load_all_users(store: StateStore) -> UserRegistry:
+    """Reads every stored user into a new registry, off the event loop, after flushing this process's changes."""
+    await store.flush()
+    users = UserRegistry()
+    await asyncio.to_thread(users.load_rows, store.iter_users())
+    return users
+
+# Lease renewal in the horizontal mode
+async def renew_leadership(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Keeps (or takes over) the lead for the scheduled jobs that must run in one worker only."""
+    await context.bot_data['leader_lease'].renew()
+
+def is_follower(bot_data: dict) -> bool:
+    """True in a worker that does not hold the leader lease."""
+    return 'leader_lease' in bot_data and not bot_data['leader_lease'].is_leader
+
+# Periodic group commit of queued state changes
+async def flush_state(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Writes the state changes queued by the handlers to the persistence backend."""
+    try:
+        written = await context.bot_data['state_store'].flush()
+        if written:
+            logger.debug("Flushed %d state changes.", written)
+    except Exception as e:
+        logger.error("Failed to flush state, will retry on the next run: %s", e)
+
+# Daily clean-up of expired forwards
+async def purge_expired_forwards(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Deletes forwards and answered inbox threads older than USER_MAP_MAX_AGE_DAYS and logs the counters."""
+    user_map = context.bot_data['user_map']
+    inbox = context.bot_data['owner_inbox']
+    cutoff = time.time() - user_map.max_age
+    inbox.purge(cutoff)
+    if is_follower(context.bot_data):
         return
+    deleted = await context.bot_data['state_store'].purge_forwards(cutoff)
+    threads = await context.bot_data['state_store'].purge_threads(cutoff)
+    logger.info("Purged %d expired forwards and %d answered threads. user_map stats: %s, inbox stats: %s",
+                deleted, threads, user_map.stats(), inbox.stats())
+
+async def flush_owner_digest(app: Application) -> None:
+    """Delivers any albums and digest items still waiting when the bot stops."""
+    await app.bot_data['media_groups'].flush()
+    owner_digest = app.bot_data['owner_digest']
+    await owner_digest.flush()
+    logger.info("Owner delivery stats: %s", owner_digest.stats())
+
+async def shutdown_state(app: Application) -> None:
+    """Flushes the remaining state changes, snapshots the user registry and closes the backend on shutdown."""
+    store = app.bot_data['state_store']
+    await store.flush()
+    if STATE_BACKEND == "sqlite" and USER_SNAPSHOT_PATH:
+        # Only written once everything is flushed, so it matches the users table
+        try:
+            await asyncio.to_thread(app.bot_data['all_users'].save, USER_SNAPSHOT_PATH)
+        except OSError as e:
+            logger.warning("Could not write the user registry snapshot: %s", e)
+    store.close()
+    logger.info("State flushed and store closed.")
+
+async def start_metrics_server(app: Application) -> None:
+    """Starts the local /metrics endpoint once the application is initialized."""
+    if 'metrics_server' in app.bot_data:
+        await app.bot_data['metrics_server'].start()
+
+def is_backlog_message(update: Update) -> bool:
+    """User texts and photos, the updates that would each be forwarded to the owner.
+
+    Digits get the purchase prompt rather than a forward, so they go through the
+    regular handlers.
+    """
+    message = update.message
+    if message is None or update.effective_user is None or str(message.chat_id) == OWNER_ID:
+        return False
+    text = message.text
+    return bool(message.photo) or bool(text and not text.startswith("/") and not text.isdigit())
+
+def drop_duplicate_tx_hashes(guard: InboundGuard, by_user: Dict[int, List[Message]]) -> List[int]:
+    """Removes backlog texts whose tx hash was already submitted, or sent earlier in the backlog.
+
+    Returns the users who are left without messages; they only get the duplicate reply.
+    """
+    claimed = set()
+    emptied = []
+    for user_id, messages in list(by_user.items()):
+        kept = []
+        for message in messages:
+            tx_hash = normalize_tx_hash(message.text) if message.text else None
+            if tx_hash is not None:
+                if tx_hash in guard.seen or tx_hash in claimed:
+                    guard.duplicates += 1
+                    continue
+                claimed.add(tx_hash)
+            kept.append(message)
+        if kept:
+            by_user[user_id] = kept
+        else:
+            del by_user[user_id]
+            emptied.append(user_id)
+    return emptied
+
+async def answer_backlog_user(app: Application, user_id: int, messages: List[Message]) -> None:
+    """Forwards a user's pending messages to the owner as one batch and acknowledges them once."""
+    user = messages[0].from_user
+    app.bot_data['all_users'].add(user_id)
+    notice = get_message(app, user_id, "backlog_received_owner",
+                         count=len(messages), user_full_name=user.full_name, user_id=user_id)
+    for attempt in range(3):
+        try:
+            await app.bot_data['owner_digest'].forward_batch(
+                [m.message_id for m in messages], user_id, notice, name=user.full_name
+            )
+            break
+        except RetryAfter as e:
+            if attempt == 2:
+                raise
+            await asyncio.sleep(retry_after_seconds(e))
+    if 'inbound_guard' in app.bot_data:
+        for message in messages:
+            if message.text:
+                app.bot_data['inbound_guard'].remember_tx_hash(message.text)
+    await app.bot_data['broadcast_engine'].send(
+        user_id, get_message(app, user_id, "backlog_received_user", count=len(messages)),
+        reply_markup=app.bot_data['main_menu_markup'],
+    )
 
+async def drain_backlog(app: Application) -> BacklogReport:
+    """Handles the updates that piled up while the bot was offline, before live updates start.
+
+    User texts and photos are coalesced per user, without the tx hashes that were
+    already submitted; commands, digits, button presses and owner replies go
+    through the regular handlers in their original order.
+    """
+    report = BacklogReport()
+    updates = await fetch_backlog(app.bot, BACKLOG_MAX_UPDATES)
+    report.fetch_seconds = time.monotonic() - report.started_at
+    report.updates = len(updates)
+    by_user, others = split_backlog(updates, is_backlog_message)
+    duplicate_only = []
+    if 'inbound_guard' in app.bot_data:
+        guard = app.bot_data['inbound_guard']
+        duplicates = guard.duplicates
+        duplicate_only = drop_duplicate_tx_hashes(guard, by_user)
+        report.duplicates = guard.duplicates - duplicates
+    report.users = len(by_user)
+    report.coalesced = sum(len(messages) for messages in by_user.values())
+
+    for update in others:
+        await app.process_update(update)
+        report.processed += 1
+
+    semaphore = asyncio.Semaphore(BACKLOG_CONCURRENCY)
+
+    async def answer(user_id: int, messages: List[Message]) -> None:
+        async with semaphore:
+            try:
+                await answer_backlog_user(app, user_id, messages)
+            except Exception as e:
+                report.failed_users += 1
+                logger.error("Failed to answer the backlog of user ID: %s: %s", user_id, e, extra={"user_id": user_id})
+
+    await asyncio.gather(*(answer(user_id, messages) for user_id, messages in by_user.items()))
+    for user_id in duplicate_only:
+        await app.bot_data['broadcast_engine'].send(user_id, get_message(app, user_id, "duplicate_tx_hash"))
+    report.duration = time.monotonic() - report.started_at
+    app.bot_data['last_backlog_report'] = report
+    logger.info("Backlog drained, going live: %s", report)
+    return report
+
+async def startup(app: Application) -> None:
+    """Starts the metrics endpoint and catches up on the backlog before live updates are received."""
+    await start_metrics_server(app)
+    if BACKLOG_DRAIN and BOT_MODE != "worker":  # Workers get the backlog from the router
+        try:
+            await drain_backlog(app)
+        except Exception as e:
+            logger.error("Backlog drain failed, the remaining updates are handled live: %s", e)
+
+async def shutdown(app: Application) -> None:
+    """Stops the metrics endpoint, hands over the lead, then flushes and closes the state store."""
+    if 'metrics_server' in app.bot_data:
+        await app.bot_data['metrics_server'].stop()
+    if 'leader_lease' in app.bot_data:
+        await app.bot_data['leader_lease'].release()
+    await shutdown_state(app)
+
+def register_gauges(app: Application, metrics: BotMetrics) -> None:
+    """Exposes state sizes, backlog and broadcast progress; they are read only when scraped."""
+    registry = metrics.registry
+    bot_data = app.bot_data
+    runner = bot_data['broadcast_jobs']
+    registry.gauge("bot_users", "Known users (broadcast audience)", lambda: len(bot_data['all_users']))
+    registry.gauge("bot_user_languages", "Users with a language preference", lambda: len(bot_data['user_languages']))
+    registry.gauge("bot_user_map_entries", "Forwards kept in memory for reply routing", lambda: len(bot_data['user_map']))
+    registry.gauge("bot_state_pending_writes", "State changes waiting for the next group commit",
+                   lambda: bot_data['state_store'].pending)
+    registry.gauge("bot_update_queue_depth", "Updates fetched but not yet dispatched", lambda: app.update_queue.qsize())
+    registry.gauge("bot_updates_in_progress", "Updates being processed right now",
+                   lambda: app.update_processor.current_concurrent_updates)
+    registry.gauge("bot_inbox_threads", "Users with an owner inbox thread", lambda: len(bot_data['owner_inbox']))
+    registry.gauge("bot_inbox_pending", "Inbox threads waiting for an owner answer",
+                   lambda: bot_data['owner_inbox'].pending)
+    registry.gauge("bot_pending_albums", "Albums waiting for more photos", lambda: len(bot_data['media_groups']))
+    if 'inbound_guard' in bot_data:
+        guard = bot_data['inbound_guard']
+        registry.gauge("bot_inbound_throttled_total", "User messages dropped by flood control",
+                       lambda: guard.throttled, metric_type="counter")
+        registry.gauge("bot_inbound_duplicates_total", "Repeated tx hashes not forwarded to the owner",
+                       lambda: guard.duplicates, metric_type="counter")
+        registry.gauge("bot_inbound_tracked_users", "Users with a partly used message budget",
+                       lambda: len(guard.limiter))
+    registry.gauge("bot_backlog_updates", "Updates pending at the last start",
+                   lambda: bot_data['last_backlog_report'].updates)
+    registry.gauge("bot_backlog_drain_seconds", "Time spent draining the backlog at the last start",
+                   lambda: bot_data['last_backlog_report'].duration)
+    registry.gauge("bot_broadcast_in_progress", "1 while a broadcast is running",
+                   lambda: int(runner.current_job is not None))
+    registry.gauge("bot_broadcast_audience", "Audience snapshot of the running broadcast",
+                   lambda: runner.current_job.total if runner.current_job else 0)
+    registry.gauge("bot_broadcast_cursor", "Audience position reached by the running broadcast",
+                   lambda: runner.current_job.cursor if runner.current_job else 0)
+    registry.gauge("bot_broadcast_sent", "Messages sent by the running broadcast",
+                   lambda: runner.current_job.sent if runner.current_job else 0)
+    registry.gauge("bot_broadcast_failed", "Messages the running broadcast gave up on",
+                   lambda: runner.current_job.failed if runner.current_job else 0)
+
+def load_users(store: StateStore) -> PersistentUserRegistry:
+    """Loads the user registry from the shutdown snapshot if there is one, otherwise from the store."""
+    # Workers share the store: the broadcast leader may remove this worker's users from it,
+    # and owner replies may go to another worker's users, whose language is only in the store
+    shared = BOT_MODE == "worker"
+    users = PersistentUserRegistry(store, write_through=shared, read_through=shared)
+    if STATE_BACKEND == "sqlite" and USER_SNAPSHOT_PATH and os.path.exists(USER_SNAPSHOT_PATH):
+        try:
+            users.load(USER_SNAPSHOT_PATH)
+            # Used once: after a crash there is no snapshot and the users table is read instead
+            os.remove(USER_SNAPSHOT_PATH)
+            return users
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring the user registry snapshot: %s", e)
+            users = PersistentUserRegistry(store, write_through=shared, read_through=shared)
+    rows = store.iter_users()
+    if BOT_MODE == "worker":
+        # Only this worker's chats; the other workers keep theirs
+        rows = (row for row in rows if partition(row[0], CLUSTER_WORKERS) == CLUSTER_WORKER_ID)
+    users.load_rows(rows)
+    return users
+
+def build_application(base_url: Optional[str] = None) -> Application:
+    """Builds the Application with its state, handlers and jobs (base_url points the bot at another Bot API server)."""
     # Create a JobQueue instance
     job_queue_instance = JobQueue()
 
-    # Build the Application and pass the JobQueue instance to it
-    application = Application.builder().token(BOT_TOKEN).job_queue(job_queue_instance).build()
+    # Handler and Bot API latencies and errors
+    metrics = BotMetrics(update_log=logging.getLogger("updates") if LOG_UPDATES else None)
 
-    # Initialize user_map and all_users in application.bot_data to persist across handlers
-    application.bot_data['user_map'] = {}
-    application.bot_data['all_users'] = set() # Use a set to store unique user IDs
-    application.bot_data['user_languages'] = {} # Store user language preferences
+    # Build the Application and pass the JobQueue instance to it
+    builder = (
+        Application.builder().token(BOT_TOKEN).job_queue(job_queue_instance)
+        .request(InstrumentedRequest(metrics, connection_pool_size=256))
+        .post_init(startup).post_stop(flush_owner_digest).post_shutdown(shutdown)
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    if UPDATE_CONCURRENCY > 1:
+        # Different chats run in parallel, each chat's updates stay in order
+        builder = builder.concurrent_updates(PerChatUpdateProcessor(UPDATE_CONCURRENCY))
+    app = builder.build()
+
+    # Open the state store; users and languages are loaded now, user_map is read lazily on lookup
+    store = open_state_store(STATE_BACKEND, STATE_DB_PATH)
+    all_users = load_users(store)
+    logger.info("Loaded %d users from the %s state store.", len(all_users), STATE_BACKEND)
+
+    # Initialize user_map and all_users in app.bot_data to persist across handlers
+    app.bot_data['state_store'] = store
+    app.bot_data['user_map'] = PersistentUserMap(
+        store, max_entries=USER_MAP_MAX_ENTRIES, max_age=USER_MAP_MAX_AGE_DAYS * 86400
+    )
+    app.bot_data['all_users'] = all_users # Compact registry of unique user IDs and their language codes
+    app.bot_data['user_languages'] = all_users.languages # Store user language preferences (view of the registry)
+    # Per-user threads of what the owner received, with their pending/answered state
+    app.bot_data['owner_inbox'] = PersistentOwnerInbox(store, recent=INBOX_RECENT_MESSAGES)
+    app.bot_data['owner_inbox'].version = store.thread_version()  # Later refreshes only read what changed after
+    app.bot_data['owner_inbox'].load_rows(store.iter_threads(time.time() - USER_MAP_MAX_AGE_DAYS * 86400))
+    logger.info("Loaded %d inbox threads, %d pending.",
+                len(app.bot_data['owner_inbox']), app.bot_data['owner_inbox'].pending)
+    # Rate-limited engine shared by every broadcast
+    app.bot_data['broadcast_engine'] = BroadcastEngine(
+        app.bot, global_rate=BROADCAST_RATE, concurrency=BROADCAST_CONCURRENCY
+    )
+    # Workers elect one leader for the broadcast and the daily clean-up through a lease in the shared store
+    lease = None
+    if BOT_MODE == "worker":
+        lease = app.bot_data['leader_lease'] = LeaderLease(
+            store, "scheduler", f"{socket.gethostname()}:{os.getpid()}:{CLUSTER_WORKER_ID}", ttl=LEADER_LEASE_TTL
+        )
+    # Durable faucet list broadcast: one per interval, resumed after a restart
+    app.bot_data['broadcast_jobs'] = BroadcastJobRunner(
+        store, app.bot_data['broadcast_engine'], "faucet_list", interval=BROADCAST_INTERVAL,
+        window=BROADCAST_WINDOW, batch_size=BROADCAST_BATCH, leader=(lambda: lease.is_leader) if lease else None,
+    )
+    # Owner delivery (forward, copy or digest)
+    app.bot_data['owner_digest'] = OwnerDigest(
+        app.bot, OWNER_ID, app.bot_data['user_map'], mode=OWNER_DELIVERY, window=OWNER_DIGEST_WINDOW,
+        digest_header=lambda count: get_message(app, int(OWNER_ID), "owner_digest_header", count=count),
+        inbox=app.bot_data['owner_inbox'],
+        # Shared through the store: in horizontal mode the owner's reply may reach another worker
+        digests=PersistentDigestMap(store, max_age=USER_MAP_MAX_AGE_DAYS * 86400),
+    )
+    # Album parts waiting for the rest of their media group
+    app.bot_data['media_groups'] = MediaGroupCollector(window=ALBUM_WINDOW)
     # Store the main_menu_markup in bot_data for easy access
-    application.bot_data['main_menu_markup'] = ReplyKeyboardMarkup(_main_menu_keyboard_definition, resize_keyboard=True, one_time_keyboard=False)
-    logger.info("user_map, all_users, user_languages, and main_menu_markup initialized.")
+    app.bot_data['main_menu_markup'] = ReplyKeyboardMarkup(_main_menu_keyboard_definition, resize_keyboard=True, one_time_keyboard=False)
+    app.bot_data['language_markup'] = InlineKeyboardMarkup(_language_keyboard_definition)
+    logger.info("user_map, all_users, user_languages, main_menu_markup and language_markup initialized.")
 
     # Register handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CallbackQueryHandler(button_callback_handler)) # Handler for inline button presses
-    application.add_handler(CommandHandler("send_tx_hash", send_tx_hash_prompt))
-    application.add_handler(CommandHandler("send_picture_proof", send_picture_proof_prompt))
-    application.add_handler(CommandHandler("buy_testnet_faucet", buy_testnet_faucet_prompt))
-    application.add_handler(CommandHandler("script_access_on_github", script_access_on_github_prompt)) # Updated handler registration
-    application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
+    if INBOUND_RATE > 0:
+        # Group -1 runs before the handlers below and can stop an update from reaching them
+        app.bot_data['inbound_guard'] = InboundGuard(
+            INBOUND_RATE, burst=INBOUND_BURST, seen_capacity=TX_HASH_MEMORY, notice_interval=THROTTLE_NOTICE_INTERVAL
+        )
+        app.add_handler(MessageHandler((filters.TEXT & ~filters.COMMAND) | filters.PHOTO, admit_inbound), group=-1)
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CallbackQueryHandler(button_callback_handler)) # Handler for inline button presses
+    app.add_handler(CommandHandler("send_tx_hash", send_tx_hash_prompt))
+    app.add_handler(CommandHandler("send_picture_proof", send_picture_proof_prompt))
+    app.add_handler(CommandHandler("buy_testnet_faucet", buy_testnet_faucet_prompt))
+    app.add_handler(CommandHandler("script_access_on_github", script_access_on_github_prompt)) # Updated handler registration
+    owner_only = filters.Chat(chat_id=int(OWNER_ID))
+    app.add_handler(CommandHandler("inbox", inbox_command, filters=owner_only))
+    app.add_handler(CommandHandler("thread", thread_command, filters=owner_only))
+    app.add_handler(CommandHandler("reply", reply_command, filters=owner_only))
+    app.add_handler(MessageHandler(filters.PHOTO, handle_photo))
     # Handle text messages that are not commands
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+
+    # Time every handler registered above and expose the metrics
+    metrics.instrument_application(app)
+    register_gauges(app, metrics)
+    app.bot_data['metrics'] = metrics
+    if METRICS_PORT:
+        app.bot_data['metrics_server'] = MetricsServer(metrics.registry, METRICS_HOST, METRICS_PORT)
 
     # Get the JobQueue instance (which is now correctly set)
-    job_queue = application.job_queue
+    job_queue = app.job_queue
+
+    # Check every minute whether this interval's faucet list is due or was interrupted; a restart no longer
+    # re-sends it. A second instance may start while a long broadcast runs and returns right away.
+    job_queue.run_repeating(send_scheduled_faucet_list, interval=60, first=5, job_kwargs={"max_instances": 2})
+    logger.info("Scheduled faucet list message to run once every %.0f hours.", BROADCAST_INTERVAL / 3600)
+
+    if 'leader_lease' in app.bot_data:
+        job_queue.run_repeating(renew_leadership, interval=LEADER_LEASE_TTL / 3, first=0)
 
-    # Schedule the recurring message every 8 hours (28800 seconds)
-    job_queue.run_repeating(send_scheduled_faucet_list, interval=28800, first=5) # first=5 to send first message 5 seconds after start
-    logger.info("Scheduled faucet list message to run every 8 hours.")
+    # Group-commit state changes off the handler path
+    job_queue.run_repeating(flush_state, interval=STATE_FLUSH_INTERVAL, first=STATE_FLUSH_INTERVAL)
+    job_queue.run_repeating(purge_expired_forwards, interval=86400, first=60)
 
-    logger.info("🤖 Bot is running...")
-    # Start polling to receive updates
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Pick up edited message files without a restart
+    if I18N_RELOAD_INTERVAL > 0:
+        job_queue.run_repeating(reload_messages, interval=I18N_RELOAD_INTERVAL, first=I18N_RELOAD_INTERVAL)
+
+    return app
+
+# Main function
+def main() -> None:
+    """Main function to run the bot."""
+    global application # Declare application as global to be accessible by get_message
+
+    if not BOT_TOKEN or not OWNER_ID:
+        logger.error("BOT_TOKEN or OWNER_ID not found! Please ensure they are set in your .env file.")
+        return
+
+    if BOT_MODE == "router":
+        if not CLUSTER_WORKER_URLS:
+            logger.error("CLUSTER_WORKER_URLS is required when BOT_MODE=router.")
+            return
+        # Stateless front process: no application, handlers or jobs
+        router = UpdateRouter(CLUSTER_WORKER_URLS, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET)
+        asyncio.run(serve_router(router, Bot(BOT_TOKEN), WEBHOOK_URL))
+        return
+
+    application = build_application()
+
+    logger.info("🤖 Bot is running (%s, up to %d concurrent updates)...", BOT_MODE, UPDATE_CONCURRENCY)
+    if BOT_MODE == "worker":
+        # Updates come from the router; the router owns the webhook
+        receiver = UpdateReceiver(application, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET)
+        asyncio.run(serve_worker(application, receiver))
+    elif BOT_MODE == "webhook":
+        if not WEBHOOK_URL:
+            logger.error("WEBHOOK_URL is required when BOT_MODE=webhook.")
+            return
+        # Local HTTP server that receives updates pushed by Telegram
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        # Start polling to receive updates
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == "__main__":
     main()
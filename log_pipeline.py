@@ -0,0 +1,136 @@
+import atexit
+import json
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Record attributes (passed with `extra=`) copied into the JSON output
+STRUCTURED_FIELDS = ("update_id", "user_id", "chat_id", "handler", "latency_ms")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the structured fields of the record."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = record.__dict__
+        for name in STRUCTURED_FIELDS:
+            value = fields.get(name)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class UserRateLimitFilter(logging.Filter):
+    """Lets through at most `per_minute` records per user below WARNING.
+
+    Records without a `user_id` and warnings or worse always pass. Runs in the
+    thread that logs, before the record is queued, so dropped records never
+    reach the writer. Idle users are forgotten once more than `max_users` are tracked.
+    """
+
+    def __init__(self, per_minute: float, max_users: int = 100_000):
+        super().__init__()
+        self.rate = per_minute / 60
+        self.capacity = max(per_minute, 1.0)
+        self.max_users = max_users
+        self._buckets: Dict[int, Tuple[float, float]] = {}  # user_id -> (tokens, last refill)
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        user_id = record.__dict__.get("user_id")
+        if user_id is None or record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        tokens, last = self._buckets.get(user_id, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self._buckets[user_id] = (tokens, now)
+            self.dropped += 1
+            return False
+        self._buckets[user_id] = (tokens - 1, now)
+        if len(self._buckets) > self.max_users:
+            self._forget_idle(now)
+        return True
+
+    def _forget_idle(self, now: float) -> None:
+        # A bucket that refilled completely behaves like a new one
+        full_after = self.capacity / self.rate if self.rate else float("inf")
+        for user_id in [u for u, (_, last) in self._buckets.items() if now - last >= full_after]:
+            del self._buckets[user_id]
+
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler that leaves the formatting to the writer thread.
+
+    The stock QueueHandler formats every record before queuing it (so it can be
+    pickled for multiprocessing queues). Here the queue stays in-process, so the
+    record is queued as-is and its arguments are only interpolated by the
+    writer: pass values that are not mutated after the call.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class _Listener(QueueListener):
+    def stop(self) -> None:
+        # Safe to call twice (explicit stop, then the atexit hook)
+        if self._thread is not None:
+            super().stop()
+
+
+def update_fields(update: object, handler: str, latency: float) -> dict:
+    """Structured fields describing one processed update."""
+    fields = {"update_id": getattr(update, "update_id", None), "handler": handler, "latency_ms": round(latency * 1000, 2)}
+    user = getattr(update, "effective_user", None)
+    if user is not None:
+        fields["user_id"] = user.id
+    return fields
+
+
+def setup_logging(level: str = "INFO", json_format: bool = False, path: Optional[str] = None,
+                  user_rate: float = 0, handler: Optional[logging.Handler] = None) -> QueueListener:
+    """Routes every log record through a queue to a background writer thread.
+
+    The event loop only creates the record and puts it on the queue; formatting
+    (text or JSON) and writing to stderr or `path` happen on the writer thread.
+    `user_rate` > 0 limits the records per user per minute. `handler` replaces
+    the default file or stderr handler.
+    """
+    if handler is None:
+        handler = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+
+    records = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(records)
+    if user_rate > 0:
+        queue_handler.addFilter(UserRateLimitFilter(user_rate))
+
+    # Neither format prints the source line or process: skip collecting them for every record
+    # (the optimizations listed in the logging HOWTO)
+    logging._srcfile = None
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = _Listener(records, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # Writes out what is still queued at exit
+    return listener
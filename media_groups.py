@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from telegram import Message
+
+logger = logging.getLogger(__name__)
+
+MAX_ALBUM_SIZE = 10  # Telegram albums hold at most 10 items
+
+AlbumCallback = Callable[[List[Message]], Awaitable[None]]
+
+
+class _PendingAlbum:
+    __slots__ = ("messages", "on_complete", "timer")
+
+    def __init__(self, on_complete: AlbumCallback):
+        self.messages: Dict[int, Message] = {}  # message_id -> message, duplicates collapse
+        self.on_complete = on_complete
+        self.timer = None
+
+
+class MediaGroupCollector:
+    """Buffers the parts of an album (same chat and media_group_id) until it is complete.
+
+    Telegram delivers every photo of an album as its own update, possibly out of
+    order and, with concurrent processing or webhooks, from different tasks. Parts
+    are collected until no new part arrived for `window` seconds (or the album hit
+    Telegram's 10 item limit), then `on_complete` runs once with the parts sorted
+    by message_id.
+
+    `flush_chat()` completes a chat's albums early, so a message sent after an
+    album is not handled before it.
+    """
+
+    def __init__(self, window: float = 1.0):
+        self.window = window
+        self._albums: Dict[Tuple[int, str], _PendingAlbum] = {}
+        self._tasks: Dict[asyncio.Task, int] = {}  # Running on_complete -> chat id
+
+    def __len__(self) -> int:
+        return len(self._albums)
+
+    def add(self, message: Message, on_complete: AlbumCallback) -> None:
+        """Adds one album part; `on_complete` of the first part is the one that runs."""
+        key = (message.chat_id, message.media_group_id)
+        album = self._albums.get(key)
+        if album is None:
+            album = self._albums[key] = _PendingAlbum(on_complete)
+        album.messages[message.message_id] = message
+
+        if album.timer is not None:
+            album.timer.cancel()
+        if len(album.messages) >= MAX_ALBUM_SIZE:
+            self._complete(key)
+        else:
+            album.timer = asyncio.get_running_loop().call_later(self.window, self._complete, key)
+
+    def _complete(self, key: Tuple[int, str]) -> None:
+        album = self._albums.pop(key, None)
+        if album is None:
+            return
+        if album.timer is not None:
+            album.timer.cancel()
+        messages = [album.messages[message_id] for message_id in sorted(album.messages)]
+        task = asyncio.get_running_loop().create_task(self._run(album.on_complete, messages))
+        self._tasks[task] = key[0]
+        task.add_done_callback(self._forget)
+
+    def _forget(self, task: asyncio.Task) -> None:
+        del self._tasks[task]
+
+    @staticmethod
+    async def _run(on_complete: AlbumCallback, messages: List[Message]) -> None:
+        try:
+            await on_complete(messages)
+        except Exception as e:
+            logger.error("Failed to process album of %d photos from chat %s: %s", len(messages), messages[0].chat_id, e)
+
+    async def flush_chat(self, chat_id: int, keep: Optional[str] = None) -> None:
+        """Completes the chat's buffered albums (except media group `keep`) and waits until they are handled."""
+        if not self._albums and not self._tasks:
+            return
+        for key in [key for key in self._albums if key[0] == chat_id and key[1] != keep]:
+            self._complete(key)
+        tasks = [task for task, chat in self._tasks.items() if chat == chat_id]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def flush(self) -> None:
+        """Completes every buffered album and waits for them (used on shutdown)."""
+        for key in list(self._albums):
+            self._complete(key)
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
@@ -0,0 +1,254 @@
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from telegram.error import NetworkError, TimedOut
+from telegram.ext import ApplicationHandlerStop
+from telegram.request import HTTPXRequest
+
+from log_pipeline import update_fields
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers fast local handlers up to slow Bot API round trips
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Bot API HTTP status -> the python-telegram-bot exception it turns into
+STATUS_ERRORS = {400: "BadRequest", 401: "InvalidToken", 403: "Forbidden", 404: "InvalidToken", 409: "Conflict",
+                 429: "RetryAfter"}
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Gauge:
+    """Value read from a callback when the metrics are scraped, so the update path pays nothing.
+
+    `metric_type="counter"` exposes a total kept by another object as a counter.
+    """
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], float], metric_type: str = "gauge"):
+        self.name = name
+        self.help = help_text
+        self.read = read
+        self.metric_type = metric_type
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception as e:
+            logger.debug("Gauge %s unavailable: %s", self.name, e)
+            return
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.metric_type}"
+        yield f"{self.name} {value}"
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Histogram:
+    """Latency histogram with fixed buckets; `labels()` returns a child to observe into."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._children: Dict[Tuple[str, ...], _HistogramChild] = {}
+
+    def labels(self, *values: str) -> _HistogramChild:
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = _HistogramChild(self.buckets)
+        return child
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="' + le + '"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {child.sum}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Registry:
+    """Holds the metrics and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], float], metric_type: str = "gauge") -> Gauge:
+        return self.register(Gauge(name, help_text, read, metric_type))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class BotMetrics:
+    """The bot's metrics: handler and Bot API latencies and errors, plus state gauges."""
+
+    def __init__(self, registry: Optional[Registry] = None, update_log: Optional[logging.Logger] = None):
+        self.registry = registry or Registry()
+        self.update_log = update_log  # Gets one structured INFO record per handled update
+        self.handler_seconds = self.registry.histogram(
+            "bot_handler_duration_seconds", "Time spent in each update handler", ["handler"])
+        self.handler_errors = self.registry.counter(
+            "bot_handler_errors_total", "Exceptions raised by update handlers", ["handler", "error"])
+        self.api_seconds = self.registry.histogram(
+            "bot_api_request_duration_seconds", "Bot API request round-trip time", ["method"])
+        self.api_errors = self.registry.counter(
+            "bot_api_errors_total", "Failed Bot API requests by error type", ["method", "error"])
+
+    def wrap_handler(self, callback):
+        """Returns `callback` wrapped to record its latency and exceptions."""
+        name = callback.__name__
+        latency = self.handler_seconds.labels(name)  # Bound once, no label lookup per update
+        errors = self.handler_errors
+        update_log = self.update_log
+
+        @functools.wraps(callback)
+        async def instrumented(update, context):
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            except ApplicationHandlerStop:
+                raise  # Flow control, not a failure
+            except Exception as e:
+                errors.inc(name, type(e).__name__)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                latency.observe(elapsed)
+                if update_log is not None and update_log.isEnabledFor(logging.INFO):
+                    fields = update_fields(update, name, elapsed)
+                    update_log.info("%s handled update %s in %.1fms", name, fields["update_id"], fields["latency_ms"],
+                                    extra=fields)
+
+        return instrumented
+
+    def instrument_application(self, app) -> None:
+        """Wraps every handler registered on the application."""
+        for handlers in app.handlers.values():
+            for handler in handlers:
+                handler.callback = self.wrap_handler(handler.callback)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records the latency and failures of every Bot API call."""
+
+    def __init__(self, metrics: BotMetrics, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            status, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+        except TimedOut:
+            self.metrics.api_errors.inc(endpoint, "TimedOut")
+            raise
+        except NetworkError:
+            self.metrics.api_errors.inc(endpoint, "NetworkError")
+            raise
+        finally:
+            self.metrics.api_seconds.labels(endpoint).observe(time.perf_counter() - started)
+        if status >= 400:
+            self.metrics.api_errors.inc(endpoint, STATUS_ERRORS.get(status, "NetworkError"))
+        return status, payload
+
+
+class MetricsServer:
+    """Serves GET /metrics from a local asyncio HTTP server."""
+
+    def __init__(self, registry: Registry, host: str = "127.0.0.1", port: int = 9090):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Metrics available on http://%s:%s/metrics", self.host, self.port)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()).strip():
+                pass  # Headers are not needed
+            parts = request_line.decode(errors="replace").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
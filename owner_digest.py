@@ -0,0 +1,321 @@
+import asyncio
+import logging
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from telegram import InputMediaPhoto, Message
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from broadcast import retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+# How user messages reach the owner
+MODE_FORWARD = "forward"  # forward_message + separate notice (2 owner calls per message)
+MODE_COPY = "copy"  # one call: the attribution travels with the message
+MODE_DIGEST = "digest"  # bursts are coalesced into periodic digests
+MODES = (MODE_FORWARD, MODE_COPY, MODE_DIGEST)
+
+MAX_MESSAGE_LENGTH = 4096  # Telegram limit for a text message
+MAX_CAPTION_LENGTH = 1024  # Telegram limit for a media caption
+MAX_MEDIA_GROUP = 10  # Telegram limit for one media group
+MAX_FORWARD_BATCH = 100  # Telegram limit for one forward_messages call
+MAX_DIGESTS_KEPT = 10_000  # Digest messages the owner can still reply to
+MAX_FLUSH_RETRIES = 3  # Network errors in a row before a digest is dropped
+
+# "#3 thanks, confirmed" -> item 3, "thanks, confirmed"
+_ITEM_PREFIX = re.compile(r"^\s*#(\d+)[\s:.-]*(.*)$", re.DOTALL)
+
+
+@dataclass
+class DigestItem:
+    user_id: int
+    attribution: str
+    name: str = ""  # Sender's full name, for the owner inbox
+    text: Optional[str] = None  # Text messages
+    photo_file_id: Optional[str] = None  # Photos
+    caption: Optional[str] = None
+    on_sent: Optional[Callable[[], None]] = None  # Called once the owner received it
+
+
+class DigestMap:
+    """Multi-user digest message_id -> sender ids in item order, the oldest dropped past max_entries."""
+
+    def __init__(self, max_entries: int = MAX_DIGESTS_KEPT):
+        self.max_entries = max_entries
+        self._digests: Dict[int, Tuple[int, ...]] = {}
+
+    def __setitem__(self, message_id: int, user_ids: Tuple[int, ...]) -> None:
+        self._digests[message_id] = user_ids
+        if len(self._digests) > self.max_entries:
+            del self._digests[next(iter(self._digests))]
+
+    def get(self, message_id: int) -> Optional[Tuple[int, ...]]:
+        return self._digests.get(message_id)
+
+    def __len__(self) -> int:
+        return len(self._digests)
+
+
+def _sender_name(message: Message) -> str:
+    return message.from_user.full_name if message.from_user else ""
+
+
+class OwnerDigest:
+    """Delivers user messages to the owner with their attribution.
+
+    In digest mode, text messages collected during `window` seconds go out as one
+    numbered digest message. The owner replies to a digest with "#<n> <answer>" to
+    answer item n (no prefix is needed when every item came from the same user).
+    Photos are sent as media groups with the attribution as caption, so every photo
+    is its own message and ordinary replies keep working through user_map.
+
+    With an `inbox`, every message the owner receives is also recorded in the
+    sender's thread there. `digests` keeps the multi-user digests (a DigestMap by
+    default; pass a shared one when another process may receive the owner's reply).
+    """
+
+    def __init__(self, bot, owner_id: str, user_map, mode: str = MODE_FORWARD, window: float = 5.0,
+                 digest_header: Callable[[int], str] = lambda count: f"🗂 {count} new messages", inbox=None,
+                 digests: Optional[DigestMap] = None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown owner delivery mode: {mode}")
+        self.bot = bot
+        self.owner_id = owner_id
+        self.user_map = user_map
+        self.mode = mode
+        self.window = window
+        self.digest_header = digest_header
+        self.inbox = inbox
+        self._pending: List[DigestItem] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._failed_flushes = 0  # Flushes in a row that hit a network error
+        self.digests = digests if digests is not None else DigestMap()
+        self.inbound = 0
+        self.owner_calls = 0
+
+    # --- delivery ---
+    async def deliver(self, message: Message, user_id: int, text: str,
+                      on_sent: Optional[Callable[[], None]] = None) -> None:
+        """Sends `message` to the owner.
+
+        `text` is the separate notice in forward mode and the attribution line in
+        the other modes. `on_sent` runs once the owner received the message, which
+        in digest mode is when the digest went out (never if it was dropped).
+        """
+        self.inbound += 1
+        if self.mode == MODE_FORWARD:
+            forwarded_message = await self.bot.forward_message(
+                chat_id=self.owner_id, from_chat_id=user_id, message_id=message.message_id
+            )
+            logger.info("%s Forwarded Message ID: %s", text, forwarded_message.message_id, extra={"user_id": user_id})
+            self._map(forwarded_message.message_id, user_id, _sender_name(message))
+            await self.bot.send_message(chat_id=self.owner_id, text=text)
+            self.owner_calls += 2
+            if on_sent is not None:
+                on_sent()
+        elif self.mode == MODE_COPY:
+            await self._send_items([self._item(message, user_id, text, on_sent)])
+        else:
+            self._pending.append(self._item(message, user_id, text, on_sent))
+            if self._flush_task is None or self._flush_task.done():
+                self._flush_task = asyncio.create_task(self._flush_later(self.window))
+
+    async def deliver_album(self, messages: List[Message], user_id: int, text: str) -> None:
+        """Sends the photos of one album to the owner as one group with a single attribution.
+
+        Every message the owner receives is mapped back to the user in user_map.
+        """
+        if self.mode == MODE_FORWARD:
+            await self.forward_batch([m.message_id for m in messages], user_id, text, name=_sender_name(messages[0]))
+            return
+        self.inbound += len(messages)
+        # Copy and digest modes: the album is already a batch, send it right away
+        items = [self._item(message, user_id, text if i == 0 else "") for i, message in enumerate(messages)]
+        for start in range(0, len(items), MAX_MEDIA_GROUP):
+            group = items[start:start + MAX_MEDIA_GROUP]
+            sent = await self.bot.send_media_group(
+                chat_id=self.owner_id,
+                media=[InputMediaPhoto(item.photo_file_id, caption=self._caption(item) or None) for item in group],
+            )
+            self.owner_calls += 1
+            for owner_message in sent:
+                self._map(owner_message.message_id, user_id, items[0].name)
+
+    async def forward_batch(self, message_ids: List[int], user_id: int, text: str, name: str = "") -> int:
+        """Forwards messages of one user with as few calls as possible, then sends `text` once.
+
+        Used whatever the mode. Every forwarded message is mapped back to the user
+        in user_map. Returns the number of messages the owner received.
+        """
+        self.inbound += len(message_ids)
+        forwarded = 0
+        for start in range(0, len(message_ids), MAX_FORWARD_BATCH):
+            sent = await self.bot.forward_messages(
+                chat_id=self.owner_id, from_chat_id=user_id, message_ids=message_ids[start:start + MAX_FORWARD_BATCH]
+            )
+            self.owner_calls += 1
+            for message_id in sent:
+                self._map(message_id.message_id, user_id, name)
+            forwarded += len(sent)
+        logger.info("%s Forwarded %d messages.", text, forwarded, extra={"user_id": user_id})
+        await self.bot.send_message(chat_id=self.owner_id, text=text)
+        self.owner_calls += 1
+        return forwarded
+
+    @staticmethod
+    def _item(message: Message, user_id: int, attribution: str,
+              on_sent: Optional[Callable[[], None]] = None) -> DigestItem:
+        name = _sender_name(message)
+        if message.photo:
+            return DigestItem(user_id, attribution, name, photo_file_id=message.photo[-1].file_id,
+                              caption=message.caption, on_sent=on_sent)
+        return DigestItem(user_id, attribution, name, text=message.text or message.caption or "", on_sent=on_sent)
+
+    @staticmethod
+    def _sent(items: List[DigestItem]) -> None:
+        for item in items:
+            if item.on_sent is not None:
+                item.on_sent()
+
+    def _map(self, owner_message_id: int, user_id: int, name: str) -> None:
+        """Routes replies to the owner's copy back to the user and adds it to the user's inbox thread."""
+        self.user_map[owner_message_id] = user_id
+        if self.inbox is not None:
+            self.inbox.record(user_id, owner_message_id, name)
+
+    async def _flush_later(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Sends everything collected so far."""
+        items, self._pending = self._pending, []
+        if not items:
+            return
+        try:
+            await self._send_items(items)
+        except RetryAfter as e:
+            # Keep the unsent items and try again once Telegram allows it
+            self._pending = items + self._pending
+            self._flush_task = asyncio.create_task(self._flush_later(retry_after_seconds(e)))
+            logger.warning("Owner digest hit flood control, retrying %d items later", len(items))
+        except BadRequest as e:  # Retrying the same content cannot help
+            self._failed_flushes = 0
+            logger.error("Failed to deliver owner digest of %d items: %s", len(items), e)
+        except NetworkError as e:  # includes TimedOut
+            if self._failed_flushes >= MAX_FLUSH_RETRIES:
+                self._failed_flushes = 0
+                logger.error("Dropped owner digest of %d items after %d network errors: %s",
+                             len(items), MAX_FLUSH_RETRIES + 1, e)
+                return
+            delay = min(2 ** self._failed_flushes, 10)
+            self._failed_flushes += 1
+            # Items sent before the error may reach the owner twice, which beats losing the rest
+            self._pending = items + self._pending
+            self._flush_task = asyncio.create_task(self._flush_later(delay))
+            logger.warning("Network error in owner digest, retrying %d items in %ss: %s", len(items), delay, e)
+        except Exception as e:
+            self._failed_flushes = 0
+            logger.error("Failed to deliver owner digest of %d items: %s", len(items), e)
+        else:
+            self._failed_flushes = 0
+            logger.info("Owner digest delivered %d items. %s", len(items), self.stats())
+
+    async def _send_items(self, items: List[DigestItem]) -> None:
+        photos = [item for item in items if item.photo_file_id]
+        texts = [item for item in items if not item.photo_file_id]
+
+        for start in range(0, len(photos), MAX_MEDIA_GROUP):
+            group = photos[start:start + MAX_MEDIA_GROUP]
+            if len(group) == 1:
+                sent = [await self.bot.send_photo(
+                    chat_id=self.owner_id, photo=group[0].photo_file_id, caption=self._caption(group[0])
+                )]
+            else:
+                sent = await self.bot.send_media_group(
+                    chat_id=self.owner_id,
+                    media=[InputMediaPhoto(item.photo_file_id, caption=self._caption(item)) for item in group],
+                )
+            self.owner_calls += 1
+            for item, owner_message in zip(group, sent):
+                self._map(owner_message.message_id, item.user_id, item.name)
+            self._sent(group)
+
+        if len(texts) == 1:
+            item = texts[0]
+            owner_message = await self.bot.send_message(
+                chat_id=self.owner_id, text=f"{item.attribution}\n\n{item.text}"[:MAX_MESSAGE_LENGTH]
+            )
+            self.owner_calls += 1
+            self._map(owner_message.message_id, item.user_id, item.name)
+            self._sent(texts)
+        elif texts:
+            for chunk in self._chunks(texts):
+                lines = [self.digest_header(len(chunk))]
+                for number, item in enumerate(chunk, start=1):
+                    lines.append(f"#{number} {item.attribution}\n{item.text}")
+                owner_message = await self.bot.send_message(chat_id=self.owner_id, text="\n\n".join(lines))
+                self.owner_calls += 1
+                self._remember_digest(owner_message.message_id, tuple(item.user_id for item in chunk))
+                if self.inbox is not None:
+                    for item in chunk:
+                        self.inbox.record(item.user_id, owner_message.message_id, item.name)
+                self._sent(chunk)
+
+    @staticmethod
+    def _caption(item: DigestItem) -> str:
+        caption = "\n\n".join(part for part in (item.attribution, item.caption) if part)
+        return caption[:MAX_CAPTION_LENGTH]
+
+    def _chunks(self, items: List[DigestItem]):
+        """Splits text items into digests that fit in one Telegram message."""
+        chunk, length = [], 200  # Room for the header
+        for item in items:
+            # A single oversized item is cut so it still fits in a digest of its own
+            item.text = item.text[:MAX_MESSAGE_LENGTH - 200 - len(item.attribution) - 10]
+            entry = len(item.attribution) + len(item.text) + 10
+            if chunk and length + entry > MAX_MESSAGE_LENGTH:
+                yield chunk
+                chunk, length = [], 200
+            chunk.append(item)
+            length += entry
+        if chunk:
+            yield chunk
+
+    def _remember_digest(self, message_id: int, user_ids: Tuple[int, ...]) -> None:
+        if len(set(user_ids)) == 1:
+            # Only one sender: plain replies work through user_map
+            self.user_map[message_id] = user_ids[0]
+            return
+        self.digests[message_id] = user_ids
+
+    # --- owner replies ---
+    def is_digest(self, message_id: int) -> bool:
+        """True for the digests that need a "#<n>" prefix to be answered."""
+        return self.digests.get(message_id) is not None
+
+    def resolve_reply(self, replied_message_id: int, text: str) -> Optional[Tuple[int, str]]:
+        """Maps an owner reply to a multi-user digest to (user_id, answer), or None."""
+        user_ids = self.digests.get(replied_message_id)
+        if user_ids is None:
+            return None
+        match = _ITEM_PREFIX.match(text)
+        if not match:
+            return None
+        number = int(match.group(1))
+        if not 1 <= number <= len(user_ids):
+            return None
+        return user_ids[number - 1], match.group(2)
+
+    def stats(self) -> dict:
+        """Owner-side API calls per inbound message (the forward mode costs 2)."""
+        per_inbound = self.owner_calls / self.inbound if self.inbound else 0.0
+        return {
+            "mode": self.mode,
+            "inbound": self.inbound,
+            "owner_calls": self.owner_calls,
+            "owner_calls_per_inbound": round(per_inbound, 3),
+            "calls_saved_per_inbound": round(2 - per_inbound, 3) if self.inbound else 0.0,
+        }
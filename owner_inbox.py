@@ -0,0 +1,309 @@
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Position or slot value meaning "none"
+_NONE = -1
+_MIN_CAPACITY = 64
+MAX_NAME_LENGTH = 64  # Characters of the user's name kept for the listing
+
+
+@dataclass
+class InboxThread:
+    """Copy of one user's thread as returned by OwnerInbox.thread() and page()."""
+    user_id: int
+    name: str
+    unanswered: int  # Forwards since the last answer (0 = answered)
+    since: float  # Unix time the thread started waiting (0 when answered)
+    updated_at: float  # Unix time of the last forward or answer
+    message_ids: List[int]  # Owner-side ids of the most recent forwards, oldest first
+
+    @property
+    def pending(self) -> bool:
+        return self.unanswered > 0
+
+
+def format_age(seconds: float) -> str:
+    """Short age for the owner: 45s, 12m, 5h, 3d."""
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= size:
+            return f"{int(seconds // size)}{unit}"
+    return f"{max(int(seconds), 0)}s"
+
+
+class OwnerInbox:
+    """One thread per user who wrote to the owner: recent forwards and pending/answered state.
+
+    A thread lives in a slot of parallel arrays (user id, waiting since, last
+    activity, forwards since the last answer, and the owner-side ids of the
+    last `recent` forwards); a dict maps user ids to slots, so recording a
+    forward, answering and looking up a thread are O(1).
+
+    Pending threads are ordered by the time they started waiting. Each holds a
+    position in an append-only order array and a Fenwick tree counts the live
+    positions, so the n-th pending thread (the start of an /inbox page) is found
+    in O(log n) and answering a thread frees its position without shifting the
+    others. Freed positions are reclaimed when the order array is full.
+    """
+
+    def __init__(self, recent: int = 5, clock: Callable[[], float] = time.time):
+        if recent < 1:
+            raise ValueError("recent must be at least 1")
+        self.recent = recent
+        self._clock = clock
+        self._reset()
+
+    def _reset(self) -> None:
+        self._slots: Dict[int, int] = {}  # user_id -> slot
+        self._free: List[int] = []  # Slots of purged threads
+        self._users = array('q')
+        self._names: List[str] = []
+        self._unanswered = array('l')
+        self._since = array('d')
+        self._updated = array('d')
+        self._counts = array('B')  # Message ids kept per slot
+        self._message_ids = array('q')  # `recent` ids per slot, newest first
+        self._positions = array('q')  # Slot -> position in the pending order, _NONE when answered
+        # Pending order: position -> slot, and a Fenwick tree of live positions
+        self._order = array('q', [_NONE]) * _MIN_CAPACITY
+        self._tree = array('l', bytes(array('l').itemsize * (_MIN_CAPACITY + 1)))
+        self._next = 0  # Next free position
+        self._pending = 0
+
+    # --- slots ---
+    def _slot(self, user_id: int) -> int:
+        slot = self._slots.get(user_id)
+        if slot is not None:
+            return slot
+        if self._free:
+            slot = self._free.pop()
+            self._users[slot] = user_id
+            self._names[slot] = ""
+            self._unanswered[slot] = 0
+            self._since[slot] = self._updated[slot] = 0.0
+            self._counts[slot] = 0
+            self._positions[slot] = _NONE
+        else:
+            slot = len(self._users)
+            self._users.append(user_id)
+            self._names.append("")
+            self._unanswered.append(0)
+            self._since.append(0.0)
+            self._updated.append(0.0)
+            self._counts.append(0)
+            self._message_ids.extend(array('q', bytes(8 * self.recent)))
+            self._positions.append(_NONE)
+        self._slots[user_id] = slot
+        return slot
+
+    # --- pending order (Fenwick tree over positions) ---
+    def _tree_add(self, position: int, delta: int) -> None:
+        tree = self._tree
+        i = position + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def _select(self, rank: int) -> int:
+        """Position of the pending thread with 0-based `rank` in waiting order."""
+        tree = self._tree
+        position = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            i = position + step
+            if i < len(tree) and tree[i] <= rank:
+                position = i
+                rank -= tree[i]
+            step >>= 1
+        return position
+
+    def _enqueue(self, slot: int) -> None:
+        if self._next == len(self._order):
+            self._compact()
+        position = self._next
+        self._next += 1
+        self._order[position] = slot
+        self._positions[slot] = position
+        self._tree_add(position, 1)
+        self._pending += 1
+
+    def _dequeue(self, slot: int) -> None:
+        position = self._positions[slot]
+        self._order[position] = _NONE
+        self._positions[slot] = _NONE
+        self._tree_add(position, -1)
+        self._pending -= 1
+
+    def _insert(self, slot: int) -> None:
+        """Enqueues `slot` by its `since` rather than at the end.
+
+        Threads that started waiting later move up one position, up to the first
+        free position after them, so the cost grows with the number of positions
+        after this one (few for a thread flushed a moment ago by another worker).
+        """
+        if self._next == len(self._order):
+            self._compact()
+        order, since = self._order, self._since[slot]
+        position = self._next
+        while position and (order[position - 1] == _NONE or since < self._since[order[position - 1]]):
+            position -= 1
+        end = position
+        while end < self._next and order[end] != _NONE:
+            end += 1
+        if end == self._next:
+            self._next += 1
+        for moved_from in range(end - 1, position - 1, -1):
+            moved = order[moved_from]
+            order[moved_from + 1] = moved
+            self._positions[moved] = moved_from + 1
+            self._tree_add(moved_from, -1)
+            self._tree_add(moved_from + 1, 1)
+        order[position] = slot
+        self._positions[slot] = position
+        self._tree_add(position, 1)
+        self._pending += 1
+
+    def _compact(self) -> None:
+        """Renumbers the pending threads from 0, with room for as many more (amortized O(1) per enqueue)."""
+        live = array('q', (slot for slot in self._order[:self._next] if slot != _NONE))
+        capacity = max(_MIN_CAPACITY, 2 * len(live))
+        self._order = live + array('q', [_NONE]) * (capacity - len(live))
+        tree = array('l', bytes(array('l').itemsize * (capacity + 1)))
+        for position, slot in enumerate(live):
+            self._positions[slot] = position
+            # Linear Fenwick build: every live position counts 1, pushed up to its parent
+            i = position + 1
+            tree[i] += 1
+            parent = i + (i & -i)
+            if parent <= capacity:
+                tree[parent] += tree[i]
+        for i in range(len(live) + 1, capacity + 1):
+            parent = i + (i & -i)
+            if parent <= capacity:
+                tree[parent] += tree[i]
+        self._tree = tree
+        self._next = len(live)
+
+    # --- handler path ---
+    def record(self, user_id: int, message_id: int, name: str = "") -> None:
+        """Adds a message forwarded to the owner (its owner-side id) to the user's thread, which becomes pending."""
+        slot = self._slot(user_id)
+        now = self._clock()
+        base = slot * self.recent
+        ids = self._message_ids
+        if not self._counts[slot] or ids[base] != message_id:  # A digest holds several messages of one user
+            ids[base + 1:base + self.recent] = ids[base:base + self.recent - 1]  # Newest first, the oldest drops out
+            ids[base] = message_id
+            self._counts[slot] = min(self._counts[slot] + 1, self.recent)
+        if name:
+            self._names[slot] = name[:MAX_NAME_LENGTH]
+        if self._positions[slot] == _NONE:
+            self._since[slot] = now
+            self._enqueue(slot)
+        self._unanswered[slot] += 1
+        self._updated[slot] = now
+
+    def mark_answered(self, user_id: int) -> bool:
+        """Marks the user's thread answered; returns True if it was pending."""
+        slot = self._slots.get(user_id)
+        if slot is None or self._positions[slot] == _NONE:
+            return False
+        self._dequeue(slot)
+        self._unanswered[slot] = 0
+        self._since[slot] = 0.0
+        self._updated[slot] = self._clock()
+        return True
+
+    # --- queries ---
+    def __contains__(self, user_id) -> bool:
+        return user_id in self._slots
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    @property
+    def pending(self) -> int:
+        """Number of pending threads."""
+        return self._pending
+
+    def is_pending(self, user_id: int) -> bool:
+        slot = self._slots.get(user_id)
+        return slot is not None and self._positions[slot] != _NONE
+
+    def _thread(self, slot: int) -> InboxThread:
+        base = slot * self.recent
+        return InboxThread(
+            self._users[slot], self._names[slot], self._unanswered[slot], self._since[slot], self._updated[slot],
+            list(reversed(self._message_ids[base:base + self._counts[slot]])),
+        )
+
+    def thread(self, user_id: int) -> Optional[InboxThread]:
+        slot = self._slots.get(user_id)
+        return None if slot is None else self._thread(slot)
+
+    def page(self, number: int, size: int) -> List[InboxThread]:
+        """Pending threads number * size to (number + 1) * size - 1, longest waiting first."""
+        start = number * size
+        return [self._thread(self._order[self._select(rank)])
+                for rank in range(start, min(start + size, self._pending))]
+
+    def pending_users(self) -> List[int]:
+        """User ids of every pending thread, longest waiting first."""
+        users = self._users
+        return [users[slot] for slot in self._order[:self._next] if slot != _NONE]
+
+    # --- maintenance ---
+    def purge(self, older_than: float) -> int:
+        """Drops answered threads without activity since `older_than` (unix time), returns how many."""
+        purged = [user_id for user_id, slot in self._slots.items()
+                  if self._positions[slot] == _NONE and self._updated[slot] < older_than]
+        for user_id in purged:
+            self._free.append(self._slots.pop(user_id))
+        return len(purged)
+
+    def _set_row(self, slot: int, name: str, unanswered: int, since: float, updated_at: float,
+                 message_ids: str) -> None:
+        ids = [int(message_id) for message_id in message_ids.split()][-self.recent:]
+        base = slot * self.recent
+        self._message_ids[base:base + len(ids)] = array('q', reversed(ids))
+        self._counts[slot] = len(ids)
+        self._names[slot] = name
+        self._unanswered[slot] = unanswered
+        self._since[slot] = since
+        self._updated[slot] = updated_at
+
+    def load_rows(self, rows: Iterable[Tuple[int, str, int, float, float, str]]) -> None:
+        """Replaces the contents with store rows, pending ones in the order they started waiting.
+
+        Rows are (user_id, name, unanswered, since, updated_at, message ids), the
+        ids space-separated, oldest first.
+        """
+        self._reset()
+        for user_id, name, unanswered, since, updated_at, message_ids in rows:
+            slot = self._slot(user_id)
+            self._set_row(slot, name, unanswered, since, updated_at, message_ids)
+            if unanswered:
+                self._enqueue(slot)
+
+    def merge_rows(self, rows: Iterable[Tuple[int, str, int, float, float, str]]) -> None:
+        """Applies store rows (as load_rows) that are at least as recent as the threads here.
+
+        Pending threads take their place in the waiting order by `since`.
+        """
+        for user_id, name, unanswered, since, updated_at, message_ids in rows:
+            slot = self._slots.get(user_id)
+            if slot is not None and self._updated[slot] > updated_at:
+                continue  # Changed here since the row was written
+            slot = self._slot(user_id)
+            queued = self._positions[slot] != _NONE
+            if queued and (not unanswered or self._since[slot] != since):
+                self._dequeue(slot)
+                queued = False
+            self._set_row(slot, name, unanswered, since, updated_at, message_ids)
+            if unanswered and not queued:
+                self._insert(slot)
+
+    def stats(self) -> dict:
+        """Counters for monitoring the inbox."""
+        return {"threads": len(self._slots), "pending": self._pending, "order_capacity": len(self._order)}
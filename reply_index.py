@@ -0,0 +1,141 @@
+import time
+from array import array
+from typing import Callable, Optional
+
+# Slot value used in the hash table for "empty"
+_EMPTY = -1
+
+
+class ReplyIndex:
+    """Capped, time-aware map of forwarded message_id -> original user_id.
+
+    Entries live in three parallel ring buffers (message id, user id, forward time)
+    ordered by insertion, and an open-addressing hash table of ring positions gives
+    O(1) lookups. Both eviction rules work from the oldest end of the ring: an entry
+    is dropped when the ring is full (max_entries) or when it is older than max_age
+    seconds. Memory is allocated once up front, so it stays flat however many
+    messages are forwarded.
+    """
+
+    def __init__(self, max_entries: int = 1_000_000, max_age: Optional[float] = 30 * 86400,
+                 clock: Callable[[], float] = time.time):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._clock = clock
+
+        # Ring buffers (q = signed 64 bit: Telegram user ids no longer fit in 32 bits)
+        self._keys = array('q', bytes(8 * max_entries))
+        self._values = array('q', bytes(8 * max_entries))
+        self._times = array('d', bytes(8 * max_entries))
+        self._head = 0  # Oldest entry
+        self._size = 0
+
+        # Hash table of ring positions, kept at most half full
+        table_size = 1
+        while table_size < 2 * max_entries:
+            table_size <<= 1
+        self._mask = table_size - 1
+        self._table = array('i', [_EMPTY]) * table_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # Dropped because the index was full
+        self.expirations = 0  # Dropped because they were older than max_age
+
+    # --- hash table helpers ---
+    def _find(self, message_id: int) -> int:
+        """Returns the table index holding message_id, or the empty index where it would go."""
+        i = (message_id * 0x9E3779B1) & self._mask
+        table, keys = self._table, self._keys
+        while True:
+            pos = table[i]
+            if pos == _EMPTY or keys[pos] == message_id:
+                return i
+            i = (i + 1) & self._mask
+
+    def _delete_at(self, i: int) -> None:
+        """Removes table[i] with backward-shift deletion (no tombstones)."""
+        table, keys, mask = self._table, self._keys, self._mask
+        table[i] = _EMPTY
+        j = i
+        while True:
+            j = (j + 1) & mask
+            pos = table[j]
+            if pos == _EMPTY:
+                return
+            home = (keys[pos] * 0x9E3779B1) & mask
+            # Move the entry back if its home slot is not between i (exclusive) and j (inclusive)
+            if (j > i and (home <= i or home > j)) or (j < i and (home <= i and home > j)):
+                table[i] = pos
+                table[j] = _EMPTY
+                i = j
+
+    def _pop_oldest(self) -> None:
+        pos = self._head
+        self._delete_at(self._find(self._keys[pos]))
+        self._head = (pos + 1) % self.max_entries
+        self._size -= 1
+
+    def _expire(self, now: float) -> None:
+        if self.max_age is None:
+            return
+        cutoff = now - self.max_age
+        while self._size and self._times[self._head] < cutoff:
+            self._pop_oldest()
+            self.expirations += 1
+
+    # --- mapping interface used by the handlers ---
+    def __setitem__(self, message_id: int, user_id: int) -> None:
+        now = self._clock()
+        self._expire(now)
+        i = self._find(message_id)
+        pos = self._table[i]
+        if pos != _EMPTY:
+            # Same message forwarded again: refresh in place
+            self._values[pos] = user_id
+            return
+        if self._size == self.max_entries:
+            self._pop_oldest()
+            self.evictions += 1
+            i = self._find(message_id)
+        pos = (self._head + self._size) % self.max_entries
+        self._keys[pos] = message_id
+        self._values[pos] = user_id
+        self._times[pos] = now
+        self._table[i] = pos
+        self._size += 1
+
+    def get(self, message_id: int, default=None):
+        self._expire(self._clock())
+        pos = self._table[self._find(message_id)]
+        if pos == _EMPTY:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return self._values[pos]
+
+    def __getitem__(self, message_id: int) -> int:
+        user_id = self.get(message_id)
+        if user_id is None:
+            raise KeyError(message_id)
+        return user_id
+
+    def __contains__(self, message_id) -> bool:
+        self._expire(self._clock())
+        return self._table[self._find(message_id)] != _EMPTY
+
+    def __len__(self) -> int:
+        return self._size
+
+    def stats(self) -> dict:
+        """Counters for monitoring the index."""
+        return {
+            "size": self._size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,829 @@
+import asyncio
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import astuple, dataclass, field
+from typing import Collection, Dict, Iterator, List, Optional, Set, Tuple
+
+from broadcast_jobs import BroadcastJob
+from owner_digest import DigestMap
+from owner_inbox import MAX_NAME_LENGTH, OwnerInbox
+from reply_index import ReplyIndex
+from user_registry import UserRegistry
+
+logger = logging.getLogger(__name__)
+
+AUDIENCE_CHUNK = 50_000  # Audience rows written or deleted per transaction
+_JOB_COLUMNS = "job_id, name, slot, created_at, total, cursor, sent, failed, pruned, finished_at"
+
+
+@dataclass
+class ThreadDelta:
+    """Changes to one user's inbox thread since the last flush, applied on top of the stored row.
+
+    Deltas rather than whole rows: the worker holding a user never sees the owner's
+    answers (given on the owner's worker), so its own copy of the thread is stale.
+    """
+    recent: int  # Message ids kept per thread
+    name: str = ""
+    answered_at: Optional[float] = None  # The owner answered (before the forwards below)
+    forwards: int = 0  # Forwards since the answer, or since the last flush
+    since: float = 0.0  # Time of the first of these forwards
+    updated_at: float = 0.0
+    message_ids: List[int] = field(default_factory=list)  # Owner-side ids, oldest first
+
+    def extend(self, later: "ThreadDelta") -> None:
+        """Adds the changes of `later`, made after these."""
+        if later.answered_at is not None:
+            self.answered_at = later.answered_at
+            self.forwards = 0
+        if later.forwards:
+            if not self.forwards:
+                self.since = later.since
+            self.forwards += later.forwards
+        self.updated_at = max(self.updated_at, later.updated_at)
+        self.name = later.name or self.name
+        self.message_ids = _recent_ids(self.message_ids, later.message_ids, self.recent)
+
+
+def _recent_ids(stored: List[int], added: List[int], recent: int) -> List[int]:
+    """The last `recent` ids of `stored` followed by `added`; a digest sent as one message counts once."""
+    ids = list(stored)
+    for message_id in added:
+        if not ids or ids[-1] != message_id:
+            ids.append(message_id)
+    return ids[-recent:]
+
+
+def _recent_id_text(stored: str, added: str, recent: int) -> str:
+    """_recent_ids() over the space-separated ids of the inbox_threads table (an SQL function)."""
+    return " ".join(map(str, _recent_ids(list(map(int, stored.split())), list(map(int, added.split())), recent)))
+
+
+class StateStore:
+    """Persistence backend for user_map, owner digests, all_users, user_languages, the owner inbox, broadcast jobs
+    and leases.
+
+    Handlers never talk to the backend directly: the Persistent* containers below
+    queue every change in memory and `flush()` writes the queued changes in one
+    batch (group commit) off the event loop. Broadcast jobs and leases are
+    written right away (still off the event loop): a checkpoint must be durable
+    before the batch it claims is sent, and a lease before its holder acts on it.
+    """
+
+    def __init__(self):
+        self._pending_users: Dict[int, Optional[str]] = {}  # user_id -> language (None keeps the stored one)
+        self._pending_removed: Set[int] = set()
+        self._pending_forwards: Dict[int, Tuple[int, float]] = {}  # forwarded message_id -> (user_id, time)
+        self._pending_digests: Dict[int, Tuple[Tuple[int, ...], float]] = {}  # digest message_id -> (user ids, time)
+        self._pending_threads: Dict[int, ThreadDelta] = {}  # user_id -> changes to the inbox thread
+        self._flush_lock = asyncio.Lock()
+
+    # --- handler path (O(1), no I/O) ---
+    def queue_user(self, user_id: int, language: Optional[str] = None) -> None:
+        self._pending_removed.discard(user_id)
+        if language is not None or user_id not in self._pending_users:
+            self._pending_users[user_id] = language
+
+    def queue_user_removal(self, user_id: int) -> None:
+        self._pending_users.pop(user_id, None)
+        self._pending_removed.add(user_id)
+
+    def queue_forward(self, message_id: int, user_id: int, forwarded_at: float) -> None:
+        self._pending_forwards[message_id] = (user_id, forwarded_at)
+
+    def queue_digest(self, message_id: int, user_ids: Tuple[int, ...], sent_at: float) -> None:
+        self._pending_digests[message_id] = (user_ids, sent_at)
+
+    def queue_thread(self, user_id: int, delta: ThreadDelta) -> None:
+        pending = self._pending_threads.get(user_id)
+        if pending is None:
+            self._pending_threads[user_id] = delta
+        else:
+            pending.extend(delta)
+
+    @property
+    def pending(self) -> int:
+        return (len(self._pending_users) + len(self._pending_removed) + len(self._pending_forwards)
+                + len(self._pending_digests) + len(self._pending_threads))
+
+    async def flush(self) -> int:
+        """Writes every queued change in a single transaction, returns the number of rows written."""
+        async with self._flush_lock:
+            if not self.pending:
+                return 0
+            users, self._pending_users = self._pending_users, {}
+            removed, self._pending_removed = self._pending_removed, set()
+            forwards, self._pending_forwards = self._pending_forwards, {}
+            digests, self._pending_digests = self._pending_digests, {}
+            threads, self._pending_threads = self._pending_threads, {}
+            try:
+                await asyncio.to_thread(self._write_batch, users, removed, forwards, digests, threads)
+            except Exception:
+                # Put the batch back under anything queued meanwhile so the next flush retries it
+                users.update(self._pending_users)
+                self._pending_users = users
+                self._pending_removed = (removed - set(users)) | self._pending_removed
+                forwards.update(self._pending_forwards)
+                self._pending_forwards = forwards
+                digests.update(self._pending_digests)
+                self._pending_digests = digests
+                for user_id, delta in self._pending_threads.items():
+                    if user_id in threads:
+                        threads[user_id].extend(delta)
+                    else:
+                        threads[user_id] = delta
+                self._pending_threads = threads
+                raise
+            return len(users) + len(removed) + len(forwards) + len(digests) + len(threads)
+
+    async def purge_forwards(self, older_than: float) -> int:
+        """Deletes stored forwards and digests sent before `older_than` (unix time), returns the number deleted."""
+        async with self._flush_lock:
+            return await asyncio.to_thread(self._delete_forwards, older_than)
+
+    async def purge_threads(self, older_than: float) -> int:
+        """Deletes answered inbox threads without activity since `older_than`, returns the number deleted."""
+        async with self._flush_lock:
+            return await asyncio.to_thread(self._delete_threads, older_than)
+
+    async def create_broadcast(self, job: BroadcastJob, user_ids: Collection[int]) -> bool:
+        """Stores a new job with its audience snapshot; False if a job with that id already exists.
+
+        The audience is written AUDIENCE_CHUNK rows per transaction and the lock is
+        released between them, so flushes and lease renewals keep going while a
+        large snapshot is stored. The job is only loaded as unfinished once its
+        whole audience is there.
+        """
+        async with self._flush_lock:
+            if not await asyncio.to_thread(self._insert_broadcast, job):
+                return False
+        user_ids = iter(user_ids)
+        for start in range(0, job.total, AUDIENCE_CHUNK):
+            chunk = list(itertools.islice(user_ids, AUDIENCE_CHUNK))
+            async with self._flush_lock:
+                await asyncio.to_thread(self._insert_audience, job.job_id, start, chunk)
+        async with self._flush_lock:
+            await asyncio.to_thread(self._mark_broadcast_ready, job.job_id)
+        return True
+
+    async def checkpoint_broadcast(self, job: BroadcastJob, expected_cursor: Optional[int] = None) -> bool:
+        """Saves the job's cursor and counters; a finished job's audience is deleted (in chunks).
+
+        With `expected_cursor`, nothing is saved and False is returned unless the
+        stored cursor still has that value (another process moved the job on).
+        """
+        async with self._flush_lock:
+            updated = await asyncio.to_thread(self._update_broadcast, job, expected_cursor)
+        if updated and job.finished_at is not None:
+            for start in range(0, job.total, AUDIENCE_CHUNK):
+                async with self._flush_lock:
+                    await asyncio.to_thread(self._delete_audience, job.job_id, start, start + AUDIENCE_CHUNK)
+        return updated
+
+    async def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """Takes or renews the lease `name` for `ttl` seconds; False while another holder has it."""
+        async with self._flush_lock:
+            now = time.time()
+            return await asyncio.to_thread(self._acquire_lease, name, holder, now, now + ttl)
+
+    async def release_lease(self, name: str, holder: str) -> None:
+        """Gives up the lease if `holder` has it, so another process can take it right away."""
+        async with self._flush_lock:
+            await asyncio.to_thread(self._release_lease, name, holder)
+
+    # --- backend hooks ---
+    def _insert_broadcast(self, job: BroadcastJob) -> bool:
+        """Stores the job row, not ready yet; False if the job id exists."""
+        raise NotImplementedError
+
+    def _insert_audience(self, job_id: str, start: int, user_ids: List[int]) -> None:
+        raise NotImplementedError
+
+    def _mark_broadcast_ready(self, job_id: str) -> None:
+        raise NotImplementedError
+
+    def _delete_audience(self, job_id: str, start: int, end: int) -> None:
+        raise NotImplementedError
+
+    def _update_broadcast(self, job: BroadcastJob, expected_cursor: Optional[int]) -> bool:
+        raise NotImplementedError
+
+    def _acquire_lease(self, name: str, holder: str, now: float, expires_at: float) -> bool:
+        raise NotImplementedError
+
+    def _release_lease(self, name: str, holder: str) -> None:
+        raise NotImplementedError
+
+    def load_broadcast(self, job_id: str) -> Optional[BroadcastJob]:
+        raise NotImplementedError
+
+    def load_unfinished_broadcast(self, name: str) -> Optional[BroadcastJob]:
+        """Returns the oldest unfinished job with this name, if any."""
+        raise NotImplementedError
+
+    def load_audience(self, job_id: str, start: int, limit: int) -> List[int]:
+        """Returns up to `limit` user ids of the snapshot from position `start` on."""
+        raise NotImplementedError
+
+    def _write_batch(self, users: Dict[int, Optional[str]], removed: Set[int],
+                     forwards: Dict[int, Tuple[int, float]], digests: Dict[int, Tuple[Tuple[int, ...], float]],
+                     threads: Dict[int, ThreadDelta]) -> None:
+        raise NotImplementedError
+
+    def _delete_forwards(self, older_than: float) -> int:
+        raise NotImplementedError
+
+    def _delete_threads(self, older_than: float) -> int:
+        raise NotImplementedError
+
+    def iter_threads(self, not_before: float = 0) -> Iterator[tuple]:
+        """Yields the pending inbox threads and the answered ones active since `not_before`.
+
+        Rows are (user_id, name, unanswered, since, updated_at, message ids), pending
+        ones in the order they started waiting.
+        """
+        raise NotImplementedError
+
+    def thread_changes(self, after: int) -> Tuple[int, List[tuple]]:
+        """Returns the latest inbox version and the thread rows (as iter_threads) written after version `after`.
+
+        Every flush that writes threads gets the next version, in commit order, so
+        passing the returned version back misses nothing however late a worker flushes.
+        """
+        raise NotImplementedError
+
+    def thread_version(self) -> int:
+        """The latest inbox version (0 before any thread was written)."""
+        raise NotImplementedError
+
+    def iter_users(self) -> Iterator[Tuple[int, Optional[str]]]:
+        """Yields the stored (user_id, language) rows sorted by user_id."""
+        raise NotImplementedError
+
+    def lookup_forward(self, message_id: int, not_before: Optional[float] = None) -> Optional[int]:
+        """Returns the user who sent the forwarded message (if forwarded after `not_before`), or None."""
+        raise NotImplementedError
+
+    def lookup_digest(self, message_id: int, not_before: Optional[float] = None) -> Optional[Tuple[int, ...]]:
+        """Returns the senders of a multi-user digest (if sent after `not_before`) in item order, or None."""
+        raise NotImplementedError
+
+    def lookup_language(self, user_id: int) -> Optional[str]:
+        """Returns the stored language of the user, or None."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStateStore(StateStore):
+    """Keeps nothing across restarts (the original behaviour)."""
+
+    def __init__(self):
+        super().__init__()
+        self._broadcasts: Dict[str, BroadcastJob] = {}
+        self._audiences: Dict[str, Collection[int]] = {}  # Sliceable by position
+        self._leases: Dict[str, Tuple[str, float]] = {}  # name -> (holder, expires_at)
+
+    async def create_broadcast(self, job: BroadcastJob, user_ids: Collection[int]) -> bool:
+        # Nothing to write: the frozen snapshot (a RegistrySnapshot, or a list) is kept as the audience
+        if not self._insert_broadcast(job):
+            return False
+        self._audiences[job.job_id] = user_ids if hasattr(user_ids, "__getitem__") else list(user_ids)
+        return True
+
+    def _insert_broadcast(self, job: BroadcastJob) -> bool:
+        if job.job_id in self._broadcasts:
+            return False
+        self._broadcasts[job.job_id] = BroadcastJob(*astuple(job))
+        return True
+
+    def _delete_audience(self, job_id: str, start: int, end: int) -> None:
+        pass
+
+    def _update_broadcast(self, job: BroadcastJob, expected_cursor: Optional[int]) -> bool:
+        if expected_cursor is not None and self._broadcasts[job.job_id].cursor != expected_cursor:
+            return False
+        self._broadcasts[job.job_id] = BroadcastJob(*astuple(job))
+        if job.finished_at is not None:
+            self._audiences.pop(job.job_id, None)
+        return True
+
+    def _acquire_lease(self, name: str, holder: str, now: float, expires_at: float) -> bool:
+        current = self._leases.get(name)
+        if current is not None and current[0] != holder and current[1] >= now:
+            return False
+        self._leases[name] = (holder, expires_at)
+        return True
+
+    def _release_lease(self, name: str, holder: str) -> None:
+        if self._leases.get(name, (None,))[0] == holder:
+            del self._leases[name]
+
+    def load_broadcast(self, job_id: str) -> Optional[BroadcastJob]:
+        job = self._broadcasts.get(job_id)
+        return BroadcastJob(*astuple(job)) if job else None
+
+    def load_unfinished_broadcast(self, name: str) -> Optional[BroadcastJob]:
+        for job in sorted(self._broadcasts.values(), key=lambda j: j.slot):
+            if job.name == name and job.finished_at is None:
+                return BroadcastJob(*astuple(job))
+        return None
+
+    def load_audience(self, job_id: str, start: int, limit: int) -> List[int]:
+        return list(self._audiences.get(job_id, [])[start:start + limit])
+
+    def _write_batch(self, users, removed, forwards, digests, threads) -> None:
+        pass
+
+    def _delete_forwards(self, older_than: float) -> int:
+        return 0
+
+    def _delete_threads(self, older_than: float) -> int:
+        return 0
+
+    def iter_threads(self, not_before: float = 0) -> Iterator[tuple]:
+        return iter(())
+
+    def thread_changes(self, after: int) -> Tuple[int, List[tuple]]:
+        return after, []
+
+    def thread_version(self) -> int:
+        return 0
+
+    def iter_users(self) -> Iterator[Tuple[int, Optional[str]]]:
+        return iter(())
+
+    def lookup_forward(self, message_id: int, not_before: Optional[float] = None) -> Optional[int]:
+        return None
+
+    def lookup_digest(self, message_id: int, not_before: Optional[float] = None) -> Optional[Tuple[int, ...]]:
+        return None
+
+    def lookup_language(self, user_id: int) -> Optional[str]:
+        return None
+
+
+class SQLiteStateStore(StateStore):
+    """SQLite backend in WAL mode.
+
+    Writes go through a dedicated connection used only by the flush thread, while
+    lookups use their own connection, so a long group commit never blocks a
+    reader on the event loop. Several processes can share one database (the
+    workers of the horizontal mode): writers take turns on SQLite's file lock and
+    every read sees the other processes' committed changes.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._write_conn = self._connect()
+        self._write_conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                language TEXT
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS user_map (
+                message_id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                forwarded_at REAL NOT NULL DEFAULT 0
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS owner_digests (
+                message_id INTEGER PRIMARY KEY,
+                user_ids TEXT NOT NULL,
+                sent_at REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS owner_digests_sent_at ON owner_digests (sent_at);
+            CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                job_id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                slot INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                total INTEGER NOT NULL,
+                cursor INTEGER NOT NULL,
+                sent INTEGER NOT NULL,
+                failed INTEGER NOT NULL,
+                pruned INTEGER NOT NULL,
+                finished_at REAL,
+                ready INTEGER NOT NULL DEFAULT 1
+            );
+            CREATE TABLE IF NOT EXISTS inbox_threads (
+                user_id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                unanswered INTEGER NOT NULL,
+                since REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                message_ids TEXT NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS broadcast_audience (
+                job_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                PRIMARY KEY (job_id, position)
+            ) WITHOUT ROWID;
+            """
+        )
+        # Databases created before forwards could expire have no forwarded_at column
+        columns = [row[1] for row in self._write_conn.execute("PRAGMA table_info(user_map)")]
+        if "forwarded_at" not in columns:
+            self._write_conn.execute("ALTER TABLE user_map ADD COLUMN forwarded_at REAL NOT NULL DEFAULT 0")
+            # Give existing forwards a full max_age from now instead of expiring them all at once
+            self._write_conn.execute("UPDATE user_map SET forwarded_at = ?", (time.time(),))
+        self._write_conn.execute("CREATE INDEX IF NOT EXISTS user_map_forwarded_at ON user_map (forwarded_at)")
+        # Jobs are created unready while their audience is written in chunks
+        columns = [row[1] for row in self._write_conn.execute("PRAGMA table_info(broadcast_jobs)")]
+        if "ready" not in columns:
+            self._write_conn.execute("ALTER TABLE broadcast_jobs ADD COLUMN ready INTEGER NOT NULL DEFAULT 1")
+        columns = [row[1] for row in self._write_conn.execute("PRAGMA table_info(inbox_threads)")]
+        if "version" not in columns:
+            self._write_conn.execute("ALTER TABLE inbox_threads ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        self._write_conn.execute("CREATE INDEX IF NOT EXISTS inbox_threads_version ON inbox_threads (version)")
+        # One-row counter: versions must never be reused, even after the newest thread was purged
+        self._write_conn.execute(
+            "CREATE TABLE IF NOT EXISTS inbox_version (id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER NOT NULL)"
+        )
+        self._write_conn.execute(
+            "INSERT OR IGNORE INTO inbox_version VALUES (0, (SELECT COALESCE(MAX(version), 0) FROM inbox_threads))"
+        )
+        self._write_conn.create_function("recent_ids", 3, _recent_id_text, deterministic=True)
+        self._read_conn = self._connect()
+        self._read_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=10000")  # Wait for another process's transaction instead of failing
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # Durable at checkpoints, safe against corruption
+        return conn
+
+    def _write_batch(self, users, removed, forwards, digests, threads) -> None:
+        conn = self._write_conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO users (user_id, language) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET language = COALESCE(excluded.language, users.language)",
+                users.items(),
+            )
+            conn.executemany("DELETE FROM users WHERE user_id = ?", ((u,) for u in removed))
+            conn.executemany(
+                "INSERT OR REPLACE INTO user_map (message_id, user_id, forwarded_at) VALUES (?, ?, ?)",
+                ((message_id, user_id, at) for message_id, (user_id, at) in forwards.items()),
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO owner_digests (message_id, user_ids, sent_at) VALUES (?, ?, ?)",
+                ((message_id, " ".join(map(str, user_ids)), at) for message_id, (user_ids, at) in digests.items()),
+            )
+            if threads:
+                # Versions follow the commit order: the write lock is held until COMMIT
+                version = conn.execute("UPDATE inbox_version SET version = version + 1 RETURNING version").fetchone()[0]
+                # An answer never undoes a later forward; it creates the row if the user's worker has not
+                # flushed their thread yet, so the forwards it answered do not reopen it afterwards
+                conn.executemany(
+                    "INSERT INTO inbox_threads (user_id, name, unanswered, since, updated_at, message_ids, version) "
+                    "VALUES (?, '', 0, 0, ?, '', ?) ON CONFLICT(user_id) DO UPDATE SET unanswered = 0, since = 0, "
+                    "updated_at = excluded.updated_at, version = excluded.version "
+                    "WHERE inbox_threads.updated_at <= excluded.updated_at",
+                    ((user_id, delta.answered_at, version)
+                     for user_id, delta in threads.items() if delta.answered_at is not None),
+                )
+                # Forwards add to the stored count. Those older than an answer given on another worker
+                # leave the thread answered; the first one after an answer starts the waiting time.
+                adds = ("(excluded.unanswered > 0 AND NOT (inbox_threads.unanswered = 0 "
+                        "AND inbox_threads.updated_at > excluded.updated_at))")
+                conn.executemany(
+                    "INSERT INTO inbox_threads (user_id, name, unanswered, since, updated_at, message_ids, version) "
+                    "VALUES (:user_id, :name, :forwards, :since, :updated_at, :message_ids, :version) "
+                    "ON CONFLICT(user_id) DO UPDATE SET "
+                    "name = CASE WHEN excluded.name = '' THEN inbox_threads.name ELSE excluded.name END, "
+                    f"unanswered = inbox_threads.unanswered + CASE WHEN {adds} THEN excluded.unanswered ELSE 0 END, "
+                    f"since = CASE WHEN {adds} AND inbox_threads.unanswered = 0 THEN excluded.since "
+                    "ELSE inbox_threads.since END, "
+                    "updated_at = MAX(inbox_threads.updated_at, excluded.updated_at), "
+                    "message_ids = recent_ids(inbox_threads.message_ids, excluded.message_ids, :recent), "
+                    "version = excluded.version",
+                    (
+                        {"user_id": user_id, "name": delta.name, "forwards": delta.forwards,
+                         "since": delta.since if delta.forwards else 0.0, "updated_at": delta.updated_at,
+                         "message_ids": " ".join(map(str, delta.message_ids)), "recent": delta.recent,
+                         "version": version}
+                        for user_id, delta in threads.items() if delta.forwards or delta.message_ids or delta.name
+                    ),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _insert_broadcast(self, job: BroadcastJob) -> bool:
+        conn = self._write_conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Audience rows left by earlier jobs of this name that crashed while being created or finished
+            conn.execute(
+                "DELETE FROM broadcast_audience WHERE job_id IN (SELECT job_id FROM broadcast_jobs "
+                "WHERE name = ? AND slot < ? AND (ready = 0 OR finished_at IS NOT NULL))",
+                (job.name, job.slot),
+            )
+            conn.execute(
+                f"INSERT INTO broadcast_jobs ({_JOB_COLUMNS}, ready) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                astuple(job),
+            )
+            conn.execute("COMMIT")
+        except sqlite3.IntegrityError:
+            conn.execute("ROLLBACK")
+            return False
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def _insert_audience(self, job_id: str, start: int, user_ids: List[int]) -> None:
+        conn = self._write_conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO broadcast_audience (job_id, position, user_id) VALUES (?, ?, ?)",
+                ((job_id, position, user_id) for position, user_id in enumerate(user_ids, start)),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _mark_broadcast_ready(self, job_id: str) -> None:
+        self._write_conn.execute("UPDATE broadcast_jobs SET ready = 1 WHERE job_id = ?", (job_id,))
+
+    def _delete_audience(self, job_id: str, start: int, end: int) -> None:
+        self._write_conn.execute(
+            "DELETE FROM broadcast_audience WHERE job_id = ? AND position >= ? AND position < ?", (job_id, start, end)
+        )
+
+    def _update_broadcast(self, job: BroadcastJob, expected_cursor: Optional[int]) -> bool:
+        return bool(self._write_conn.execute(
+            "UPDATE broadcast_jobs SET cursor = ?, sent = ?, failed = ?, pruned = ?, finished_at = ? "
+            "WHERE job_id = ? AND (? IS NULL OR cursor = ?)",
+            (job.cursor, job.sent, job.failed, job.pruned, job.finished_at, job.job_id,
+             expected_cursor, expected_cursor),
+        ).rowcount)
+
+    def _acquire_lease(self, name: str, holder: str, now: float, expires_at: float) -> bool:
+        return bool(self._write_conn.execute(
+            "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+            "WHERE leases.holder = excluded.holder OR leases.expires_at < ?",
+            (name, holder, expires_at, now),
+        ).rowcount)
+
+    def _release_lease(self, name: str, holder: str) -> None:
+        self._write_conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+
+    def load_broadcast(self, job_id: str) -> Optional[BroadcastJob]:
+        with self._read_lock:
+            row = self._read_conn.execute(
+                f"SELECT {_JOB_COLUMNS} FROM broadcast_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return BroadcastJob(*row) if row else None
+
+    def load_unfinished_broadcast(self, name: str) -> Optional[BroadcastJob]:
+        with self._read_lock:
+            row = self._read_conn.execute(
+                f"SELECT {_JOB_COLUMNS} FROM broadcast_jobs WHERE name = ? AND finished_at IS NULL AND ready = 1 "
+                "ORDER BY slot LIMIT 1",
+                (name,),
+            ).fetchone()
+        return BroadcastJob(*row) if row else None
+
+    def load_audience(self, job_id: str, start: int, limit: int) -> List[int]:
+        with self._read_lock:
+            rows = self._read_conn.execute(
+                "SELECT user_id FROM broadcast_audience WHERE job_id = ? AND position >= ? ORDER BY position LIMIT ?",
+                (job_id, start, limit),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def _delete_forwards(self, older_than: float) -> int:
+        conn = self._write_conn
+        deleted = conn.execute("DELETE FROM user_map WHERE forwarded_at < ?", (older_than,)).rowcount
+        return deleted + conn.execute("DELETE FROM owner_digests WHERE sent_at < ?", (older_than,)).rowcount
+
+    def _delete_threads(self, older_than: float) -> int:
+        return self._write_conn.execute(
+            "DELETE FROM inbox_threads WHERE unanswered = 0 AND updated_at < ?", (older_than,)
+        ).rowcount
+
+    def iter_users(self) -> Iterator[Tuple[int, Optional[str]]]:
+        # Own connection: a long scan (possibly in another thread) must not hold up lookups
+        conn = self._connect()
+        try:
+            yield from conn.execute("SELECT user_id, language FROM users ORDER BY user_id")
+        finally:
+            conn.close()
+
+    def iter_threads(self, not_before: float = 0) -> Iterator[tuple]:
+        conn = self._connect()
+        try:
+            yield from conn.execute(
+                "SELECT user_id, name, unanswered, since, updated_at, message_ids FROM inbox_threads "
+                "WHERE unanswered > 0 OR updated_at >= ? ORDER BY since, user_id",
+                (not_before,),
+            )
+        finally:
+            conn.close()
+
+    def thread_changes(self, after: int) -> Tuple[int, List[tuple]]:
+        with self._read_lock:
+            rows = self._read_conn.execute(
+                "SELECT user_id, name, unanswered, since, updated_at, message_ids, version FROM inbox_threads "
+                "WHERE version > ? ORDER BY since, user_id",
+                (after,),
+            ).fetchall()
+        return max((row[6] for row in rows), default=after), [row[:6] for row in rows]
+
+    def thread_version(self) -> int:
+        with self._read_lock:
+            return self._read_conn.execute("SELECT version FROM inbox_version").fetchone()[0]
+
+    def lookup_forward(self, message_id: int, not_before: Optional[float] = None) -> Optional[int]:
+        with self._read_lock:
+            row = self._read_conn.execute(
+                "SELECT user_id FROM user_map WHERE message_id = ? AND forwarded_at >= ?",
+                (message_id, not_before if not_before is not None else 0),
+            ).fetchone()
+        return row[0] if row else None
+
+    def lookup_digest(self, message_id: int, not_before: Optional[float] = None) -> Optional[Tuple[int, ...]]:
+        with self._read_lock:
+            row = self._read_conn.execute(
+                "SELECT user_ids FROM owner_digests WHERE message_id = ? AND sent_at >= ?",
+                (message_id, not_before if not_before is not None else 0),
+            ).fetchone()
+        return tuple(map(int, row[0].split())) if row else None
+
+    def lookup_language(self, user_id: int) -> Optional[str]:
+        with self._read_lock:
+            row = self._read_conn.execute("SELECT language FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def close(self) -> None:
+        self._write_conn.close()
+        self._read_conn.close()
+
+
+def open_state_store(backend: str, path: str) -> StateStore:
+    """Creates the configured backend ('sqlite' or 'memory')."""
+    if backend == "memory":
+        return MemoryStateStore()
+    if backend == "sqlite":
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return SQLiteStateStore(path)
+    raise ValueError(f"Unknown state backend: {backend}")
+
+
+class PersistentUserRegistry(UserRegistry):
+    """`all_users` registry that queues additions, removals and language changes for the store.
+
+    With `write_through`, every add is queued (with the user's language), not only
+    new users: other processes sharing the store may have removed the user. With
+    `read_through`, the language of a user who is not a member here (one of another
+    worker's users) is read from the store.
+    """
+
+    def __init__(self, store: StateStore, write_through: bool = False, read_through: bool = False, **kwargs):
+        super().__init__(**kwargs)
+        self.store = store
+        self.write_through = write_through
+        self.read_through = read_through
+        self.store_hits = 0
+
+    def add(self, user_id: int, language: Optional[str] = None) -> bool:
+        added = super().add(user_id, language)
+        if added or language is not None:
+            self.store.queue_user(user_id, language)
+        elif self.write_through:
+            self.store.queue_user(user_id, self.language(user_id))
+        return added
+
+    def discard(self, user_id: int) -> bool:
+        removed = super().discard(user_id)
+        if removed:
+            self.store.queue_user_removal(user_id)
+        return removed
+
+    def language(self, user_id: int) -> Optional[str]:
+        language = super().language(user_id)
+        if language is None and self.read_through and user_id not in self:
+            language = self.store.lookup_language(user_id)
+            if language is not None:
+                self.store_hits += 1
+        return language
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["store_hits"] = self.store_hits
+        return stats
+
+
+class PersistentUserMap(ReplyIndex):
+    """`user_map` reply index with write-behind and lazy read-through.
+
+    Recent forwards are served from the bounded in-memory index. A lookup that
+    misses there (evicted, or forwarded before the last restart) falls back to a
+    single primary-key query, so restart time does not depend on the map size.
+    Forwards older than max_age are treated as expired in both places.
+    """
+
+    def __init__(self, store: StateStore, max_entries: int = 200_000, max_age: Optional[float] = 30 * 86400):
+        super().__init__(max_entries=max_entries, max_age=max_age)
+        self.store = store
+        self.store_hits = 0
+
+    def __setitem__(self, message_id: int, user_id: int) -> None:
+        super().__setitem__(message_id, user_id)
+        self.store.queue_forward(message_id, user_id, self._clock())
+
+    def get(self, message_id: int, default=None):
+        user_id = super().get(message_id)
+        if user_id is None:
+            not_before = self._clock() - self.max_age if self.max_age is not None else None
+            user_id = self.store.lookup_forward(message_id, not_before)
+            if user_id is None:
+                return default
+            self.store_hits += 1
+        return user_id
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["store_hits"] = self.store_hits
+        return stats
+
+
+class PersistentDigestMap(DigestMap):
+    """Digest map shared through the store, so any worker can resolve a "#<n>" reply.
+
+    Digests this process sent stay in memory; the others (sent by another worker,
+    or before a restart) are read from the store on lookup and cached. Digests
+    older than max_age are treated as expired, like user_map forwards.
+    """
+
+    def __init__(self, store: StateStore, max_age: Optional[float] = 30 * 86400, clock=time.time, **kwargs):
+        super().__init__(**kwargs)
+        self.store = store
+        self.max_age = max_age
+        self._clock = clock
+
+    def __setitem__(self, message_id: int, user_ids: Tuple[int, ...]) -> None:
+        super().__setitem__(message_id, user_ids)
+        self.store.queue_digest(message_id, user_ids, self._clock())
+
+    def get(self, message_id: int) -> Optional[Tuple[int, ...]]:
+        user_ids = super().get(message_id)
+        if user_ids is None:
+            not_before = self._clock() - self.max_age if self.max_age is not None else None
+            user_ids = self.store.lookup_digest(message_id, not_before)
+            if user_ids is not None:
+                DigestMap.__setitem__(self, message_id, user_ids)
+        return user_ids
+
+
+class PersistentOwnerInbox(OwnerInbox):
+    """`owner_inbox` that queues every thread change for the store (write-behind)."""
+
+    def __init__(self, store: StateStore, recent: int = 5):
+        super().__init__(recent=recent)
+        self.store = store
+        self.version = 0  # Store version of the threads merged so far, see StateStore.thread_changes
+
+    async def refresh(self) -> int:
+        """Merges the threads other processes wrote since the last refresh; returns how many rows were read."""
+        await self.store.flush()  # This process's own changes first, so stored rows are not older than ours
+        self.version, rows = await asyncio.to_thread(self.store.thread_changes, self.version)
+        self.merge_rows(rows)
+        return len(rows)
+
+    def record(self, user_id: int, message_id: int, name: str = "") -> None:
+        super().record(user_id, message_id, name)
+        at = self._updated[self._slots[user_id]]
+        self.store.queue_thread(user_id, ThreadDelta(
+            self.recent, name[:MAX_NAME_LENGTH], forwards=1, since=at, updated_at=at, message_ids=[message_id]
+        ))
+
+    def mark_answered(self, user_id: int) -> bool:
+        answered = super().mark_answered(user_id)
+        # Also queued when the thread is not known here: another worker may have recorded it
+        at = self._clock()
+        self.store.queue_thread(user_id, ThreadDelta(self.recent, answered_at=at, updated_at=at))
+        return answered
@@ -0,0 +1,324 @@
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Language code of a user without a preference
+_NO_LANGUAGE = 0
+_MAX_LANGUAGES = 255
+
+# Snapshot file: header, language table (JSON), ids (int64, 8-byte aligned), language codes (uint8)
+_MAGIC = b"UREG"
+_VERSION = 1
+_HEADER = struct.Struct("<4sHBxQI")  # magic, version, little-endian flag, count, table length
+
+
+def _copy_ids(leaf) -> array:
+    copy = array('q')
+    with memoryview(leaf) as view:
+        copy.frombytes(view.cast('B'))
+    return copy
+
+
+class UserRegistry:
+    """Set of user ids with one packed language code per user.
+
+    Ids are kept sorted in leaves: int64 arrays of `leaf_size` to 2 * `leaf_size`
+    ids, each with a parallel byte array of language codes (an index into a
+    small table such as [None, "en", "id"]). A user costs 9 bytes instead of a
+    boxed int in a set plus a dict entry. A lookup is a binary search over the
+    leaves' last ids, then within one leaf; an insert or removal only moves the
+    tail of that leaf.
+
+    `snapshot()` returns read-only views of the leaves without copying them.
+    Leaves are copy-on-write from then on: the first change to a leaf after a
+    snapshot writes to a fresh copy, so the snapshot stays valid and unchanged
+    while handlers keep adding users. Leaves loaded from a snapshot file are
+    views of the mapped file and are copied the same way when first changed.
+    """
+
+    def __init__(self, languages: Iterable[str] = ("en", "id"), leaf_size: int = 8192):
+        self.leaf_size = leaf_size
+        self._table: List[Optional[str]] = [None]
+        self._codes: Dict[str, int] = {}
+        for language in languages:
+            self._code(language)
+        self._leaves: list = []  # array('q'), or read-only memoryviews until first written
+        self._langs: List[bytearray] = []
+        self._maxes: List[int] = []  # Last id of each leaf
+        self._shared: List[bool] = []  # Leaf may be referenced outside: copy before writing
+        self._size = 0
+        self._with_language = 0
+        self.copies = 0  # Leaves copied because they were shared
+
+    def _code(self, language: Optional[str]) -> int:
+        if language is None:
+            return _NO_LANGUAGE
+        code = self._codes.get(language)
+        if code is None:
+            if len(self._table) >= _MAX_LANGUAGES:
+                raise ValueError(f"Too many languages, cannot add {language!r}")
+            code = self._codes[language] = len(self._table)
+            self._table.append(language)
+        return code
+
+    def _locate(self, user_id: int) -> Tuple[int, int, bool]:
+        """(leaf, position, found) where user_id is or would be inserted; needs at least one leaf."""
+        j = bisect_left(self._maxes, user_id)
+        if j == len(self._maxes):
+            j -= 1  # Past the last id: goes at the end of the last leaf
+        leaf = self._leaves[j]
+        i = bisect_left(leaf, user_id)
+        return j, i, i < len(leaf) and leaf[i] == user_id
+
+    def _writable(self, j: int) -> array:
+        if self._shared[j]:
+            self._leaves[j] = _copy_ids(self._leaves[j])
+            self._shared[j] = False
+            self.copies += 1
+        return self._leaves[j]
+
+    # --- set interface used by the handlers ---
+    def add(self, user_id: int, language: Optional[str] = None) -> bool:
+        """Adds the user (with a language, if given); returns True if they were not a member."""
+        code = self._code(language)
+        if not self._leaves:
+            self._leaves.append(array('q', [user_id]))
+            self._langs.append(bytearray([code]))
+            self._maxes.append(user_id)
+            self._shared.append(False)
+        else:
+            j, i, found = self._locate(user_id)
+            if found:
+                if language is not None:
+                    langs = self._langs[j]
+                    self._with_language += (code != _NO_LANGUAGE) - (langs[i] != _NO_LANGUAGE)
+                    langs[i] = code
+                return False
+            leaf = self._writable(j)
+            leaf.insert(i, user_id)
+            self._langs[j].insert(i, code)
+            if i == len(leaf) - 1:
+                self._maxes[j] = user_id
+            if len(leaf) >= 2 * self.leaf_size:
+                self._split(j)
+        self._size += 1
+        self._with_language += code != _NO_LANGUAGE
+        return True
+
+    def _split(self, j: int) -> None:
+        leaf, langs = self._leaves[j], self._langs[j]
+        half = len(leaf) // 2
+        self._leaves[j:j + 1] = [leaf[:half], leaf[half:]]
+        self._langs[j:j + 1] = [langs[:half], langs[half:]]
+        self._maxes[j:j + 1] = [leaf[half - 1], leaf[-1]]
+        self._shared[j:j + 1] = [False, False]
+
+    def discard(self, user_id: int) -> bool:
+        """Removes the user if present; returns True if they were a member."""
+        if not self._leaves:
+            return False
+        j, i, found = self._locate(user_id)
+        if not found:
+            return False
+        leaf = self._writable(j)
+        langs = self._langs[j]
+        self._with_language -= langs[i] != _NO_LANGUAGE
+        del leaf[i]
+        del langs[i]
+        if not leaf:
+            del self._leaves[j], self._langs[j], self._maxes[j], self._shared[j]
+        elif i == len(leaf):
+            self._maxes[j] = leaf[-1]
+        self._size -= 1
+        return True
+
+    def remove(self, user_id: int) -> None:
+        if not self.discard(user_id):
+            raise KeyError(user_id)
+
+    def __contains__(self, user_id) -> bool:
+        return bool(self._leaves) and self._locate(user_id)[2]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[int]:
+        """Members in ascending order, from a snapshot (adding users meanwhile is safe)."""
+        return iter(self.snapshot())
+
+    # --- languages ---
+    def language(self, user_id: int) -> Optional[str]:
+        """The user's language, or None if they have none or are not a member."""
+        if not self._leaves:
+            return None
+        j, i, found = self._locate(user_id)
+        return self._table[self._langs[j][i]] if found else None
+
+    def set_language(self, user_id: int, language: str) -> None:
+        """Sets the user's language, adding them if they are not a member."""
+        self.add(user_id, language)
+
+    @property
+    def languages(self) -> "UserLanguages":
+        """Mapping view of user_id -> language, for code that expects the old `user_languages` dict."""
+        return UserLanguages(self)
+
+    # --- bulk operations ---
+    def snapshot(self) -> "RegistrySnapshot":
+        """Frozen, sorted view of the current members; later changes do not affect it."""
+        self._shared = [True] * len(self._leaves)
+        return RegistrySnapshot([memoryview(leaf).toreadonly() for leaf in self._leaves])
+
+    def load_rows(self, rows: Iterable[Tuple[int, Optional[str]]]) -> None:
+        """Replaces the contents with (user_id, language) rows sorted by user_id."""
+        leaves, all_langs = [], []
+        with_language = 0
+        last = None
+        rows = iter(rows)
+        while True:
+            leaf, langs = array('q'), bytearray()
+            for user_id, language in itertools.islice(rows, self.leaf_size):
+                if last is not None and user_id <= last:
+                    raise ValueError("Rows must be sorted by user_id without duplicates")
+                code = self._code(language)
+                leaf.append(user_id)
+                langs.append(code)
+                with_language += code != _NO_LANGUAGE
+                last = user_id
+            if not leaf:
+                break
+            leaves.append(leaf)
+            all_langs.append(langs)
+        self._replace(leaves, all_langs, shared=False)
+        self._with_language = with_language
+
+    def _replace(self, leaves: list, langs: List[bytearray], shared: bool) -> None:
+        self._leaves, self._langs = leaves, langs
+        self._maxes = [leaf[-1] for leaf in leaves]
+        self._shared = [shared] * len(leaves)
+        self._size = sum(len(leaf) for leaf in leaves)
+
+    def stats(self) -> dict:
+        """Counters for monitoring the registry."""
+        return {
+            "users": self._size,
+            "with_language": self._with_language,
+            "leaves": len(self._leaves),
+            "copies": self.copies,
+        }
+
+    # --- snapshot file ---
+    def save(self, path: str) -> None:
+        """Writes the members to `path` (atomically replaced) for a fast `load()` after a restart."""
+        table = json.dumps(self._table[1:]).encode()
+        table += b" " * (-(_HEADER.size + len(table)) % 8)  # Keep the id array 8-byte aligned
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, sys.byteorder == "little", self._size, len(table)))
+            f.write(table)
+            for leaf in self._leaves:
+                with memoryview(leaf) as view:
+                    f.write(view.cast('B'))
+            for langs in self._langs:
+                f.write(langs)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def load(self, path: str) -> None:
+        """Replaces the contents with a file written by `save()`.
+
+        The ids are used straight from the memory-mapped file, so loading does
+        not read or copy them; only the language codes (1 byte per user) are
+        copied. The file may be deleted afterwards, the mapping stays valid.
+        """
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, little_endian, count, table_length = _HEADER.unpack_from(mapped)
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError(f"{path} is not a user registry snapshot")
+            if little_endian != (sys.byteorder == "little"):
+                raise ValueError(f"{path} was written on a machine with another byte order")
+            start = _HEADER.size + table_length
+            if len(mapped) != start + count * 9:
+                raise ValueError(f"{path} is truncated")
+            languages = json.loads(mapped[_HEADER.size:start])
+        except Exception:
+            mapped.close()
+            raise
+        self._table = [None]
+        self._codes = {}
+        for language in languages:
+            self._code(language)
+        ids = memoryview(mapped)[start:start + count * 8].cast('q')
+        codes = mapped[start + count * 8:]
+        step = self.leaf_size
+        self._replace(
+            [ids[k:k + step] for k in range(0, count, step)],
+            [bytearray(codes[k:k + step]) for k in range(0, count, step)],
+            shared=True,
+        )
+        self._with_language = count - codes.count(_NO_LANGUAGE)
+
+
+class RegistrySnapshot:
+    """Frozen, sorted user ids of a UserRegistry, as read-only views of its leaves."""
+
+    def __init__(self, views: List[memoryview]):
+        self.views = views
+        self._starts = list(itertools.accumulate((len(view) for view in views), initial=0))  # Position of each view
+        self._size = self._starts[-1]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[int]:
+        return itertools.chain.from_iterable(self.views)
+
+    def __getitem__(self, positions: slice) -> List[int]:
+        """The user ids at `positions` (a slice without step), e.g. one broadcast batch."""
+        start, stop, step = positions.indices(self._size)
+        if step != 1:
+            raise ValueError("RegistrySnapshot slices do not take a step")
+        ids: List[int] = []
+        i = bisect_right(self._starts, start) - 1
+        while start < stop:
+            offset = start - self._starts[i]
+            part = self.views[i][offset:offset + stop - start]
+            ids.extend(part)
+            start += len(part)
+            i += 1
+        return ids
+
+
+class UserLanguages:
+    """`user_languages` view of a UserRegistry: `in` is true for users with a language."""
+
+    def __init__(self, registry: UserRegistry):
+        self._registry = registry
+
+    def get(self, user_id: int, default=None):
+        language = self._registry.language(user_id)
+        return default if language is None else language
+
+    def __getitem__(self, user_id: int) -> str:
+        language = self._registry.language(user_id)
+        if language is None:
+            raise KeyError(user_id)
+        return language
+
+    def __setitem__(self, user_id: int, language: str) -> None:
+        self._registry.set_language(user_id, language)
+
+    def __contains__(self, user_id) -> bool:
+        return self._registry.language(user_id) is not None
+
+    def __len__(self) -> int:
+        return self._registry._with_language